@@ -0,0 +1,4 @@
+"""
+Performance benchmarks for the auth service. Run modules with
+``python -m benchmarks.<name>`` from the project root.
+"""
@@ -0,0 +1,115 @@
+"""
+Compare the full settings profile with the API-node profile
+(core.settings_api): worker startup time, the memory and modules it loads,
+and per-request overhead on two endpoints that never touch the database
+(token verify, and a cached profile read).
+
+Each measurement runs in a fresh interpreter, because Django settings
+can't be swapped within a process:
+
+    python -m benchmarks.api_profile --requests 2000 --startups 7
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+
+PROFILES = ['core.settings', 'core.settings_api']
+
+
+def measure_startup():
+    """
+    Import the project, build the ASGI handler and load the URLconf, as a
+    worker does before it answers its first request.
+    """
+    started = time.perf_counter()
+    from core.asgi import application  # noqa: F401
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+    elapsed = time.perf_counter() - started
+    return {
+        'startup_ms': elapsed * 1000,
+        'modules': len(sys.modules),
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def measure_requests(count):
+    """Time requests through the ASGI handler and middleware chain, in-process."""
+    import asyncio
+
+    import django
+    django.setup()
+    from django.test import AsyncClient
+    from django.test.utils import setup_test_environment
+
+    from users.models import User
+    from users.utils import get_tokens_for_user
+
+    setup_test_environment()
+    client = AsyncClient()
+    # Neither endpoint reads the user row, so an unsaved user is enough.
+    access = get_tokens_for_user(User(id=1, email='bench@example.com', full_name='Bench User'))['access']
+    requests = {
+        'verify': lambda: client.post('/api/auth/token/verify/', {'token': access}),
+        'profile': lambda: client.get('/api/auth/profile/', headers={'Authorization': f'Bearer {access}'}),
+    }
+
+    async def run():
+        results = {}
+        for name, request in requests.items():
+            for _ in range(min(count, 100)):
+                response = await request()
+                assert response.status_code == 200, response.content
+            started = time.perf_counter()
+            for _ in range(count):
+                await request()
+            results[f'{name}_us'] = (time.perf_counter() - started) / count * 1e6
+        return results
+
+    return asyncio.run(run())
+
+
+def run_child(settings_module, *args):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.api_profile', *args],
+        env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000, help='Timed requests per endpoint.')
+    parser.add_argument('--startups', type=int, default=7, help='Cold starts per profile (the median is reported).')
+    parser.add_argument('--profiles', nargs='+', default=PROFILES, help='Settings modules to compare.')
+    parser.add_argument('--child', choices=['startup', 'requests'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child == 'startup':
+        print(json.dumps(measure_startup()))
+        return
+    if args.child == 'requests':
+        print(json.dumps(measure_requests(args.requests)))
+        return
+
+    print(f'{"profile":<20} {"startup ms":>11} {"modules":>8} {"RSS MB":>7} {"verify us":>10} {"profile us":>11}')
+    for settings_module in args.profiles:
+        startups = [run_child(settings_module, '--child', 'startup') for _ in range(args.startups)]
+        requests = run_child(settings_module, '--child', 'requests', '--requests', str(args.requests))
+        print(f'{settings_module:<20} '
+              f'{statistics.median(s["startup_ms"] for s in startups):>11.1f} '
+              f'{startups[0]["modules"]:>8} '
+              f'{statistics.median(s["max_rss_mb"] for s in startups):>7.1f} '
+              f'{requests["verify_us"]:>10.1f} '
+              f'{requests["profile_us"]:>11.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+"""
+Load test for the auth endpoints.
+
+Starts the app in-process (uvicorn for ASGI, Django's threaded server for
+WSGI) on a throwaway SQLite or Postgres database, drives each endpoint from
+``--concurrency`` keep-alive HTTP clients and reports requests/s and
+p50/p95/p99 latency:
+
+    python -m benchmarks.load --concurrency 32 --requests 1000 --output bench.json
+    python -m benchmarks.load --baseline bench.json      # fail on regressions
+    python -m benchmarks.load --compare new.json --baseline bench.json
+
+``--redis fakeredis`` (the default; needs ``pip install fakeredis[lua]``)
+gives the Redis code paths without a server, ``--redis env`` uses
+REDIS_URL, and ``--redis none`` the in-process fallbacks. Passwords are
+hashed with MD5 unless ``--real-hashing`` is given, so the numbers reflect
+the service rather than PBKDF2. Load generator and server share a process,
+so compare runs with each other rather than with production.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+
+ENDPOINTS = ['register', 'login', 'refresh', 'verify', 'profile', 'forgot-password', 'reset-password']
+PASSWORD = 'BenchPassword123!'
+
+
+class Request:
+    __slots__ = ('method', 'path', 'body', 'headers', 'expected_status')
+
+    def __init__(self, method, path, body=None, headers=None, expected_status=200):
+        self.method = method
+        self.path = path
+        self.body = json.dumps(body).encode() if body is not None else None
+        self.headers = {'Content-Type': 'application/json', **(headers or {})}
+        self.expected_status = expected_status
+
+
+def build_requests(endpoint, count):
+    """Create the fixtures for ``count`` requests to ``endpoint``."""
+    from users.models import User
+    from users.utils import generate_password_reset_token, get_tokens_for_user
+
+    def user(name):
+        return User.objects.create_user(email=f'bench-{name}@example.com', full_name='Bench User', password=PASSWORD)
+
+    if endpoint == 'register':
+        run = time.time_ns()
+        return [
+            Request('POST', '/api/auth/register/', {
+                'full_name': 'Bench User',
+                'email': f'bench-register-{run}-{i}@example.com',
+                'password': PASSWORD,
+                'password2': PASSWORD,
+            }, expected_status=201)
+            for i in range(count)
+        ]
+    if endpoint == 'login':
+        email = user('login').email
+        return [Request('POST', '/api/auth/login/', {'email': email, 'password': PASSWORD}) for _ in range(count)]
+    if endpoint == 'refresh':
+        # Rotation consumes each refresh token, so every request needs its own.
+        owner = user('refresh')
+        return [
+            Request('POST', '/api/auth/token/refresh/', {'refresh': get_tokens_for_user(owner)['refresh']})
+            for _ in range(count)
+        ]
+    if endpoint == 'verify':
+        access = get_tokens_for_user(user('verify'))['access']
+        return [Request('POST', '/api/auth/token/verify/', {'token': access}) for _ in range(count)]
+    if endpoint == 'profile':
+        access = get_tokens_for_user(user('profile'))['access']
+        return [Request('GET', '/api/auth/profile/', headers={'Authorization': f'Bearer {access}'}) for _ in range(count)]
+    if endpoint == 'forgot-password':
+        email = user('forgot').email
+        return [Request('POST', '/api/auth/forgot-password/', {'email': email}) for _ in range(count)]
+    if endpoint == 'reset-password':
+        owner = user('reset')
+        return [
+            Request('POST', '/api/auth/reset-password/', {
+                'token': generate_password_reset_token(owner.id),
+                'new_password': PASSWORD,
+                'new_password2': PASSWORD,
+            })
+            for _ in range(count)
+        ]
+    raise ValueError(f'Unknown endpoint {endpoint!r}')
+
+
+class Server:
+    """The app on an ephemeral localhost port, served from a background thread."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.port = None
+        self._stop = None
+        self._thread = None
+
+    def start(self):
+        if self.kind == 'asgi':
+            import uvicorn
+            from django.core.asgi import get_asgi_application
+
+            sock = socket.socket()
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+            server = uvicorn.Server(uvicorn.Config(
+                get_asgi_application(), log_level='warning', lifespan='off', access_log=False, backlog=4096))
+            self._thread = threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True)
+            self._thread.start()
+            while not server.started:
+                time.sleep(0.01)
+
+            def stop():
+                server.should_exit = True
+        else:
+            from django.core.servers.basehttp import ThreadedWSGIServer
+            from django.core.wsgi import get_wsgi_application
+            from django.test.testcases import QuietWSGIRequestHandler
+
+            httpd = ThreadedWSGIServer(('127.0.0.1', 0), QuietWSGIRequestHandler, allow_reuse_address=False)
+            httpd.set_app(get_wsgi_application())
+            self.port = httpd.server_address[1]
+            self._thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+            self._thread.start()
+
+            def stop():
+                httpd.shutdown()
+                httpd.server_close()
+        self._stop = stop
+        return self
+
+    def stop(self):
+        self._stop()
+        self._thread.join(timeout=10)
+
+
+def drive(port, requests, concurrency):
+    """
+    Send ``requests`` over ``concurrency`` keep-alive connections.
+
+    Returns:
+        tuple: ``(latencies in seconds, error count, wall-clock seconds)``.
+    """
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    pending = iter(requests)
+
+    def worker():
+        nonlocal errors
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        while True:
+            with lock:
+                request = next(pending, None)
+            if request is None:
+                break
+            started = time.perf_counter()
+            try:
+                conn.request(request.method, request.path, body=request.body, headers=request.headers)
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == request.expected_status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                errors += not ok
+        conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - started
+
+
+def summarize(latencies, errors, duration):
+    cuts = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'duration_s': round(duration, 3),
+        'rps': round(len(latencies) / duration, 1),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 2),
+        'p50_ms': round(cuts[49] * 1000, 2),
+        'p95_ms': round(cuts[94] * 1000, 2),
+        'p99_ms': round(cuts[98] * 1000, 2),
+        'max_ms': round(max(latencies) * 1000, 2),
+    }
+
+
+def compare(current, baseline, tolerance):
+    """
+    Print how ``current`` moved against ``baseline``.
+
+    Returns:
+        list: ``(endpoint, metric, change)`` for every metric that got worse
+        by more than ``tolerance`` (a fraction).
+    """
+    for key in ('server', 'database', 'redis', 'real_hashing', 'concurrency'):
+        if current['meta'].get(key) != baseline['meta'].get(key):
+            print(f'warning: {key} differs from the baseline '
+                  f'({current["meta"].get(key)!r} vs {baseline["meta"].get(key)!r})', file=sys.stderr)
+
+    regressions = []
+    print(f'{"endpoint":<16} {"req/s":>16} {"p95 ms":>16} {"p99 ms":>16}')
+    for endpoint, result in current['results'].items():
+        base = baseline['results'].get(endpoint)
+        if base is None:
+            continue
+        cells = []
+        for metric, higher_is_better in (('rps', True), ('p95_ms', False), ('p99_ms', False)):
+            change = result[metric] / base[metric] - 1 if base[metric] else 0.0
+            worse = -change if higher_is_better else change
+            flag = '!' if worse > tolerance else ' '
+            if worse > tolerance:
+                regressions.append((endpoint, metric, change))
+            cells.append(f'{result[metric]:>8} {change:+6.1%}{flag}')
+        print(f'{endpoint:<16} ' + ' '.join(cells))
+    return regressions
+
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=['asgi', 'wsgi'], default='asgi')
+    parser.add_argument('--database', choices=['sqlite', 'postgres'], default='sqlite',
+                        help='postgres uses the DB_* / DATABASE_URL settings and a throwaway test database.')
+    parser.add_argument('--redis', choices=['fakeredis', 'env', 'none'], default='fakeredis')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent client connections.')
+    parser.add_argument('--requests', type=int, default=500, help='Measured requests per endpoint.')
+    parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per endpoint first.')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='Comma-separated subset of: %(default)s')
+    parser.add_argument('--real-hashing', action='store_true', help='Hash passwords with the production hasher.')
+    parser.add_argument('--rate-limits', action='store_true', help='Keep the login/reset rate limits on.')
+    parser.add_argument('--output', help='Write results to this JSON file.')
+    parser.add_argument('--baseline', help='Compare against this results file; exit 1 on regressions.')
+    parser.add_argument('--compare', metavar='RESULTS', help='Compare RESULTS with --baseline without running.')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='Allowed slowdown before a metric counts as a regression (default: %(default)s).')
+    args = parser.parse_args()
+
+    if args.compare:
+        if not args.baseline:
+            parser.error('--compare needs --baseline')
+        sys.exit(1 if compare(load_json(args.compare), load_json(args.baseline), args.tolerance) else 0)
+
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f'unknown endpoints: {", ".join(sorted(unknown))}')
+    if args.redis == 'fakeredis':
+        try:
+            import fakeredis  # noqa: F401
+        except ImportError:
+            parser.error('--redis fakeredis needs `pip install fakeredis[lua]`; or use --redis none')
+
+    workdir = tempfile.TemporaryDirectory(prefix='auth-bench-')
+    os.environ.update(
+        DJANGO_SETTINGS_MODULE='benchmarks.settings',
+        BENCH_DATABASE=args.database,
+        BENCH_SQLITE_PATH=os.path.join(workdir.name, 'db.sqlite3'),
+        BENCH_REDIS=args.redis,
+        BENCH_FAST_HASHING='0' if args.real_hashing else '1',
+        BENCH_RATE_LIMITS='1' if args.rate_limits else '0',
+    )
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    from django.db import connection
+
+    old_name = None
+    if args.database == 'postgres':
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    else:
+        call_command('migrate', verbosity=0)
+
+    server = Server(args.server).start()
+    results = {}
+    try:
+        for endpoint in endpoints:
+            requests = build_requests(endpoint, args.warmup + args.requests)
+            drive(server.port, requests[:args.warmup], args.concurrency)
+            results[endpoint] = summarize(*drive(server.port, requests[args.warmup:], args.concurrency))
+            result = results[endpoint]
+            print(f'{endpoint:<16} {result["rps"]:>9.1f} req/s  p50 {result["p50_ms"]:>8.2f} ms  '
+                  f'p95 {result["p95_ms"]:>8.2f} ms  p99 {result["p99_ms"]:>8.2f} ms  errors {result["errors"]}')
+    finally:
+        server.stop()
+        connection.close()
+        if old_name is not None:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        workdir.cleanup()
+
+    report = {
+        'meta': {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'server': args.server,
+            'database': args.database,
+            'redis': args.redis,
+            'real_hashing': args.real_hashing,
+            'rate_limits': args.rate_limits,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+
+    failed = any(result['errors'] for result in results.values())
+    if args.baseline:
+        failed = bool(compare(report, load_json(args.baseline), args.tolerance)) or failed
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Compare Django's CommonPasswordValidator, which loads its list into a set in
+each process, with users.validators.CommonPasswordValidator, which maps a
+list built by ``manage.py build_password_list``: on Django's 20,000
+passwords, and on a list of --passwords generated ones, the size of a
+breached-password list.
+
+For each it reports the time to construct the validator (what the first
+registration or reset in a worker waits for), the anonymous memory that
+adds to the process (Linux, from /proc/self/smaps_rollup; mapped file pages
+are shared with every other worker through the page cache and reported
+apart), and the time per validate() call, half of them on listed passwords:
+
+    python -m benchmarks.password_list --passwords 10000000
+
+The in-memory set of the generated passwords is only built with --with-set
+(about 1 GB for ten million).
+"""
+import argparse
+import gc
+import gzip
+import os
+import random
+import tempfile
+import time
+
+
+def memory():
+    """Anonymous and file-backed resident bytes of this process."""
+    fields = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    return fields['Anonymous'], fields['Rss'] - fields['Anonymous']
+
+
+def measure(name, construct, listed, unlisted, lookups):
+    from django.core.exceptions import ValidationError
+
+    gc.collect()
+    anon_before, file_before = memory()
+    started = time.perf_counter()
+    validator = construct()
+    load_ms = (time.perf_counter() - started) * 1000
+    gc.collect()
+    anon_after, _ = memory()
+
+    passwords = [random.choice(listed) if i % 2 else random.choice(unlisted) for i in range(lookups)]
+    rejected = 0
+    started = time.perf_counter()
+    for password in passwords:
+        try:
+            validator.validate(password)
+        except ValidationError:
+            rejected += 1
+    lookup_us = (time.perf_counter() - started) * 1e6 / lookups
+    assert rejected == lookups // 2, rejected
+    file_after = memory()[1]
+    mb = 1024 * 1024
+    print(f'{name:<34} {load_ms:>9.1f} {(anon_after - anon_before) / mb:>9.1f} '
+          f'{(file_after - file_before) / mb:>9.1f} {lookup_us:>10.2f}')
+    return validator
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--passwords', type=int, default=10_000_000, help='Size of the generated list.')
+    parser.add_argument('--lookups', type=int, default=200_000)
+    parser.add_argument('--with-set', action='store_true', help='Also load the generated list into a set.')
+    args = parser.parse_args()
+
+    from django.conf import settings
+    settings.configure(USE_I18N=False)
+
+    from django.contrib.auth import password_validation
+
+    from users.password_list import build_password_list, read_passwords
+    from users.validators import DJANGO_PASSWORD_LIST_PATH, CommonPasswordValidator
+
+    with tempfile.TemporaryDirectory(prefix='auth-bench-') as workdir:
+        common_path = os.path.join(workdir, 'common.bin')
+        generated_path = os.path.join(workdir, 'generated.txt.gz')
+        generated_list_path = os.path.join(workdir, 'generated.bin')
+        build_password_list(read_passwords(DJANGO_PASSWORD_LIST_PATH), common_path)
+        with gzip.open(generated_path, 'wt', compresslevel=1) as f:
+            for start in range(0, args.passwords, 100_000):
+                f.write(''.join(f'pw{i}\n' for i in range(start, min(start + 100_000, args.passwords))))
+        print(f'Building a list of {args.passwords} passwords...')
+        started = time.perf_counter()
+        build_password_list(read_passwords(generated_path), generated_list_path)
+        print(f'  {os.path.getsize(generated_list_path) / 2 ** 20:.0f} MiB in {time.perf_counter() - started:.0f}s\n')
+
+        common = password_validation.CommonPasswordValidator()
+        common_listed = sorted(common.passwords)
+        unlisted = [f'Uncommon-{i}!' for i in range(10000)]
+        generated_listed = [f'pw{random.randrange(args.passwords)}' for _ in range(10000)]
+        del common
+
+        print(f'{"":<34} {"load ms":>9} {"anon MB":>9} {"file MB":>9} {"lookup us":>10}')
+        measure('Django, set of 20,000', password_validation.CommonPasswordValidator,
+                common_listed, unlisted, args.lookups)
+        measure('mapped, 20,000', lambda: CommonPasswordValidator(common_path), common_listed, unlisted, args.lookups)
+        validator = measure(f'mapped, {args.passwords:,}',
+                            lambda: CommonPasswordValidator(generated_list_path),
+                            generated_listed, unlisted, args.lookups)
+        validator.passwords.close()
+        if args.with_set:
+            measure(f'Django, set of {args.passwords:,}',
+                    lambda: password_validation.CommonPasswordValidator(generated_path),
+                    generated_listed, unlisted, args.lookups)
+
+
+if __name__ == '__main__':
+    main()
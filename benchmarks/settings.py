@@ -0,0 +1,60 @@
+"""
+Settings for ``python -m benchmarks.load``: the project settings with the
+database, Redis, hashing and rate limits chosen by the ``BENCH_*``
+environment variables the runner sets.
+"""
+import os
+import tempfile
+
+from core.settings import *  # noqa: F401,F403
+from core.settings import LAST_LOGIN_TRACKER, RATELIMITS
+
+
+DEBUG = False
+ALLOWED_HOSTS = ['127.0.0.1', 'localhost']
+
+if os.environ.get('BENCH_DATABASE', 'sqlite') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ['BENCH_SQLITE_PATH'],
+            'OPTIONS': {'timeout': 30},
+        }
+    }
+# Otherwise the project's (Postgres) DATABASES; the runner benchmarks against
+# a throwaway test database on that server.
+
+BENCH_REDIS = os.environ.get('BENCH_REDIS', 'none')
+if BENCH_REDIS == 'fakeredis':
+    from fakeredis import FakeRedisConnection
+    from fakeredis.aioredis import FakeAsyncRedisConnection
+
+    # Sync and async clients for the same URL share one in-memory server.
+    REDIS_URL = 'redis://fakeredis:6379/0'
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+                'REDIS_CLIENT_CLASS': 'core.metrics.InstrumentedRedis',
+                'CONNECTION_POOL_KWARGS': {'connection_class': FakeRedisConnection},
+            },
+        }
+    }
+    REDIS_ASYNC_CONNECTION_POOL_KWARGS = {'connection_class': FakeAsyncRedisConnection}
+elif BENCH_REDIS == 'none':
+    REDIS_URL = None
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+# 'env' keeps REDIS_URL and CACHES from the environment.
+
+if os.environ.get('BENCH_FAST_HASHING') == '1':
+    # Takes PBKDF2 out of the picture to measure everything else.
+    PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+if os.environ.get('BENCH_RATE_LIMITS') != '1':
+    RATELIMITS = {group: {} for group in RATELIMITS}
+RATELIMIT_SHARED_MEMORY_PATH = os.path.join(tempfile.gettempdir(), f'auth-bench-ratelimit-{os.getpid()}')
+
+# Flushes would land in the middle of measurements.
+LAST_LOGIN_TRACKER = dict(LAST_LOGIN_TRACKER, FLUSH_INTERVAL=0)
@@ -0,0 +1,55 @@
+"""
+Compare verification throughput of /api/auth/token/verify/ (one token per
+request) against /api/auth/token/verify/batch/.
+
+Runs in-process through Django's test client, so the numbers include the full
+middleware and DRF stack but no network:
+
+    python -m benchmarks.token_verify --tokens 2000 --batch-size 100
+"""
+import argparse
+import os
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tokens', type=int, default=2000, help='Tokens to verify per endpoint.')
+    parser.add_argument('--batch-size', type=int, default=100, help='Tokens per batch request.')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+    import django
+    django.setup()
+
+    from django.test.utils import setup_test_environment
+    from rest_framework.test import APIClient
+
+    from users.models import User
+    from users.utils import get_tokens_for_user
+
+    setup_test_environment()
+    client = APIClient()
+    # Verification never reads the user row, so an unsaved user is enough.
+    user = User(id=1, email='bench@example.com', full_name='Bench User')
+    tokens = [get_tokens_for_user(user)['access'] for _ in range(args.tokens)]
+
+    started = time.perf_counter()
+    for token in tokens:
+        response = client.post('/api/auth/token/verify/', {'token': token}, format='json')
+        assert response.status_code == 200, response.content
+    single = args.tokens / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for i in range(0, args.tokens, args.batch_size):
+        response = client.post(
+            '/api/auth/token/verify/batch/', {'tokens': tokens[i:i + args.batch_size]}, format='json')
+        assert response.status_code == 200, response.content
+    batch = args.tokens / (time.perf_counter() - started)
+
+    print(f'single endpoint: {single:10.0f} tokens/s')
+    print(f'batch endpoint:  {batch:10.0f} tokens/s  (batch size {args.batch_size}, {batch / single:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Compare OFFSET pagination with a COUNT(*) (Django's default admin
+changelist) against keyset pagination with an estimated count
+(users.pagination, used by UserAdmin and GET /api/auth/users/), at growing
+depths into a large users table.
+
+The table is filled with one set-based INSERT (generate_series on
+PostgreSQL, a recursive CTE on SQLite), then each page is read newest first,
+as the changelist does:
+
+    python -m benchmarks.user_listing --users 10000000
+    python -m benchmarks.user_listing --database postgres --users 10000000
+
+postgres uses the DB_* / DATABASE_URL settings and a throwaway test
+database. Filling 10M rows takes a few minutes.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+
+def fill(connection, count, chunk=1_000_000):
+    """Insert ``count`` users, one second apart, the newest joining now."""
+    table = connection.ops.quote_name('users_user')
+    columns = 'email, full_name, password, is_active, is_staff, is_admin, is_superuser, date_joined'
+    with connection.cursor() as cursor:
+        for start in range(0, count, chunk):
+            end = min(start + chunk, count)
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    f'INSERT INTO {table} ({columns}) '
+                    "SELECT 'user' || n || '@example.com', 'User ' || n, '!', n %% 10 <> 0, false, false, false, "
+                    "now() - (%s - n) * interval '1 second' FROM generate_series(%s, %s) n",
+                    [count, start + 1, end],
+                )
+            else:
+                cursor.execute(
+                    'WITH RECURSIVE g(n) AS (SELECT %s UNION ALL SELECT n + 1 FROM g WHERE n < %s) '
+                    f'INSERT INTO {table} ({columns}) '
+                    "SELECT 'user' || n || '@example.com', 'User ' || n, '!', n %% 10 <> 0, 0, 0, 0, "
+                    # Formatted as Django stores datetimes without microseconds.
+                    "strftime('%%Y-%%m-%%d %%H:%%M:%%S', 'now', '-' || (%s - n) || ' seconds') FROM g",
+                    [start + 1, end, count],
+                )
+            print(f'  {end} rows', flush=True)
+        cursor.execute('ANALYZE')
+
+
+def timed(function, repeat):
+    """Median milliseconds of ``repeat`` calls, and the last result."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', choices=['sqlite', 'postgres'], default='sqlite')
+    parser.add_argument('--users', type=int, default=10_000_000)
+    parser.add_argument('--page-size', type=int, default=100, help='The admin default.')
+    parser.add_argument('--repeat', type=int, default=5, help='Timings per measurement (the median is shown).')
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory(prefix='auth-bench-')
+    os.environ.update(
+        DJANGO_SETTINGS_MODULE='benchmarks.settings',
+        BENCH_DATABASE=args.database,
+        BENCH_SQLITE_PATH=os.path.join(workdir.name, 'db.sqlite3'),
+        BENCH_REDIS='none',
+    )
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    from django.db import connection
+
+    from users.models import User
+    from users.pagination import encode_cursor, estimate_count, keyset_ordering, paginate
+
+    old_name = None
+    if args.database == 'postgres':
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    else:
+        call_command('migrate', verbosity=0)
+    try:
+        print(f'Filling {args.users} users...')
+        started = time.perf_counter()
+        fill(connection, args.users)
+        print(f'  done in {time.perf_counter() - started:.0f}s\n')
+
+        queryset = User.objects.order_by('-date_joined', '-id')
+        active = queryset.filter(is_active=True)
+        ordering = keyset_ordering(queryset)
+        size = args.page_size
+        depths = sorted({0, 1000, args.users // 100, args.users // 10, args.users // 2, args.users - size})
+
+        print(f'{"rows skipped":>12} {"OFFSET ms":>10} {"keyset ms":>10}')
+        for depth in depths:
+            # The cursor a reader of the previous page holds.
+            cursor = encode_cursor(ordering, queryset[depth - 1]) if depth else None
+            offset_ms, rows = timed(lambda: list(queryset[depth:depth + size]), args.repeat)
+            keyset_ms, page = timed(lambda: paginate(queryset, cursor, size), args.repeat)
+            assert [row.id for row in page.rows] == [row.id for row in rows]
+            print(f'{depth:>12} {offset_ms:>10.2f} {keyset_ms:>10.2f}')
+
+        print(f'\n{"count":<22} {"COUNT(*) ms":>12} {"estimate ms":>12} {"estimate":>12} {"exact":>12}')
+        for name, counted in (('all users', queryset), ('is_active=True', active)):
+            count_ms, exact = timed(counted.count, args.repeat)
+            estimate_ms, (estimate, _) = timed(lambda: estimate_count(counted), args.repeat)
+            print(f'{name:<22} {count_ms:>12.2f} {estimate_ms:>12.2f} {estimate:>12} {exact:>12}')
+    finally:
+        connection.close()
+        if old_name is not None:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        workdir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Compare resolving a page of users one profile request at a time against one
+call to /api/auth/users/lookup/, answered in JSON and in MessagePack, with
+the profile cache cold and warm.
+
+Runs in-process through Django's test client on a throwaway SQLite database
+with a local-memory cache, so the numbers include the full middleware and DRF
+stack but no network (which would only widen the gap):
+
+    python -m benchmarks.user_lookup --users 2000 --page-size 200
+"""
+import argparse
+import os
+import tempfile
+import time
+
+SERVICE_KEY = 'bench-service-key'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000, help='Users to resolve, in pages.')
+    parser.add_argument('--page-size', type=int, default=200, help='Users per page (one lookup call).')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='auth-bench-') as workdir:
+        os.environ.update(
+            DJANGO_SETTINGS_MODULE='benchmarks.settings',
+            BENCH_SQLITE_PATH=os.path.join(workdir, 'db.sqlite3'),
+            SERVICE_API_KEYS=f'bench:{SERVICE_KEY}',
+        )
+        import django
+        django.setup()
+        run(args)
+
+
+def run(args):
+    from django.contrib.auth.hashers import make_password
+    from django.core.cache import caches
+    from django.core.management import call_command
+    from django.test.utils import setup_test_environment
+    from rest_framework.test import APIClient
+
+    from users.models import User
+    from users.profile_cache import profile_cache
+    from users.utils import get_tokens_for_user
+
+    setup_test_environment()
+    call_command('migrate', verbosity=0)
+    password = make_password('BenchPassword123!')
+    users = User.objects.bulk_create(
+        User(email=f'user{i}@example.com', full_name=f'User {i}', password=password) for i in range(args.users))
+    tokens = {user.id: get_tokens_for_user(user)['access'] for user in users}
+    pages = [users[i:i + args.page_size] for i in range(0, len(users), args.page_size)]
+    client = APIClient(SERVER_NAME='localhost')
+
+    def per_user(page):
+        size = 0
+        for user in page:
+            response = client.get('/api/auth/profile/', HTTP_AUTHORIZATION=f'Bearer {tokens[user.id]}')
+            assert response.status_code == 200, response.content
+            size += len(response.content)
+        return size
+
+    def lookup(accept):
+        def call(page):
+            response = client.post('/api/auth/users/lookup/', {'ids': [user.id for user in page]}, format='json',
+                                   HTTP_AUTHORIZATION=f'Service {SERVICE_KEY}', HTTP_ACCEPT=accept)
+            assert response.status_code == 200, response.content
+            return len(response.content)
+        return call
+
+    modes = {
+        'profile per user': per_user,
+        'lookup, JSON': lookup('application/json'),
+        'lookup, msgpack': lookup('application/msgpack'),
+    }
+    print(f'{len(pages)} pages of {args.page_size} users')
+    print(f'{"":<18} {"cold ms/page":>13} {"warm ms/page":>13} {"bytes/page":>11}')
+    for name, resolve in modes.items():
+        caches['default'].clear()
+        profile_cache._local.clear()
+        timings = []
+        for _ in ('cold', 'warm'):
+            started = time.perf_counter()
+            size = sum(resolve(page) for page in pages)
+            timings.append((time.perf_counter() - started) * 1000 / len(pages))
+        print(f'{name:<18} {timings[0]:>13.2f} {timings[1]:>13.2f} {size / len(pages):>11.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""
+Per-worker memory of gunicorn, from /proc/<pid>/smaps_rollup (Linux).
+
+For each process it reports RSS, PSS (shared pages split between the
+processes that map them) and USS (pages only that process maps: what
+killing it would free). With preload and gc.freeze, worker USS should drop
+by most of what the master holds.
+
+Report on a running server by its master's PID:
+
+    python -m benchmarks.worker_memory --pid $(pgrep -o gunicorn)
+
+or, with no --pid, start gunicorn.conf.py on a throwaway SQLite database
+without preload, with preload, and with preload plus gc.freeze, send each
+the same requests, and compare:
+
+    python -m benchmarks.worker_memory --workers 4 --requests 2000
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+
+CONFIGS = {
+    'no preload': {'GUNICORN_PRELOAD': 'False'},
+    'preload': {'GUNICORN_PRELOAD': 'True', 'GUNICORN_GC_FREEZE': 'False'},
+    'preload + gc.freeze': {'GUNICORN_PRELOAD': 'True', 'GUNICORN_GC_FREEZE': 'True'},
+}
+PASSWORD = 'BenchPassword123!'
+
+
+def memory(pid):
+    """
+    Returns:
+        dict: ``rss``, ``pss`` and ``uss`` of the process, in bytes.
+    """
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    return {
+        'rss': fields['Rss'],
+        'pss': fields['Pss'],
+        'uss': fields['Private_Clean'] + fields['Private_Dirty'],
+    }
+
+
+def children(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(child) for child in f.read().split()]
+
+
+def report(master_pid):
+    """Memory of the master and each of its workers."""
+    rows = [('master', master_pid, memory(master_pid))]
+    rows += [(f'worker {i}', pid, memory(pid)) for i, pid in enumerate(sorted(children(master_pid)), start=1)]
+    return rows
+
+
+def print_report(rows):
+    mb = 1024 * 1024
+    print(f'{"process":<10} {"pid":>8} {"RSS MB":>8} {"PSS MB":>8} {"USS MB":>8}')
+    for name, pid, usage in rows:
+        print(f'{name:<10} {pid:>8} {usage["rss"] / mb:>8.1f} {usage["pss"] / mb:>8.1f} {usage["uss"] / mb:>8.1f}')
+    workers = [usage for name, _, usage in rows if name != 'master']
+    if workers:
+        print(f'{"workers":<10} {"":>8} {sum(u["rss"] for u in workers) / mb:>8.1f} '
+              f'{sum(u["pss"] for u in workers) / mb:>8.1f} {sum(u["uss"] for u in workers) / mb:>8.1f}')
+    print(f'{"total":<10} {"":>8} {"":>8} {sum(u["pss"] for _, _, u in rows) / mb:>8.1f}')
+
+
+def prepare_database(path):
+    """Migrate a SQLite database and return an access token for its one user."""
+    os.environ.update(DJANGO_SETTINGS_MODULE='benchmarks.settings', BENCH_SQLITE_PATH=path, BENCH_FAST_HASHING='1')
+    import django
+    django.setup()
+    from django.core.management import call_command
+    from django.db import connection
+
+    from users.models import User
+    from users.utils import get_tokens_for_user
+
+    call_command('migrate', verbosity=0)
+    user = User.objects.create_user(email='bench@example.com', full_name='Bench User', password=PASSWORD)
+    access = get_tokens_for_user(user)['access']
+    connection.close()
+    return access
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'gunicorn did not start on port {port}')
+
+
+def send_requests(port, access, count):
+    """Log in, read the profile and verify the token, ``count`` times in turn."""
+    requests = [
+        ('POST', '/api/auth/login/', {'email': 'bench@example.com', 'password': PASSWORD}, {}),
+        ('GET', '/api/auth/profile/', None, {'Authorization': f'Bearer {access}'}),
+        ('POST', '/api/auth/token/verify/', {'token': access}, {}),
+    ]
+    for i in range(count):
+        method, path, body, headers = requests[i % len(requests)]
+        # A new connection each time, so gunicorn spreads them across workers.
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        conn.request(method, path, body=json.dumps(body) if body else None,
+                     headers={'Content-Type': 'application/json', **headers})
+        response = conn.getresponse()
+        response.read()
+        conn.close()
+        if response.status != 200:
+            raise RuntimeError(f'{method} {path} returned {response.status}')
+
+
+def run_config(name, env, args, access):
+    port = free_port()
+    env = dict(os.environ, **env, PORT=str(port), GUNICORN_WORKERS=str(args.workers))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'core.wsgi', '-c', 'gunicorn.conf.py', '--log-level', 'warning'],
+        env=env,
+    )
+    try:
+        wait_for(port)
+        send_requests(port, access, args.requests)
+        # Let the workers finish settling (and collecting) after the last request.
+        time.sleep(1)
+        print(f'\n{name}')
+        rows = report(server.pid)
+        print_report(rows)
+        return rows
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pid', type=int, help='Report on the running gunicorn master with this PID.')
+    parser.add_argument('--workers', type=int, default=4, help='Workers per configuration.')
+    parser.add_argument('--requests', type=int, default=1500, help='Requests sent to each configuration.')
+    args = parser.parse_args()
+
+    if args.pid:
+        print_report(report(args.pid))
+        return
+
+    with tempfile.TemporaryDirectory(prefix='auth-bench-') as workdir:
+        access = prepare_database(os.path.join(workdir, 'db.sqlite3'))
+        totals = {}
+        for name, env in CONFIGS.items():
+            rows = run_config(name, env, args, access)
+            workers = [usage for process, _, usage in rows if process != 'master']
+            totals[name] = (sum(u['pss'] for _, _, u in rows), sum(u['uss'] for u in workers) / len(workers))
+
+    mb = 1024 * 1024
+    print(f'\n{"configuration":<22} {"total PSS MB":>13} {"USS/worker MB":>14}')
+    for name, (pss, uss) in totals.items():
+        print(f'{name:<22} {pss / mb:>13.1f} {uss / mb:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import time
+
+from django.db.backends.postgresql import base
+from psycopg_pool import PoolTimeout
+
+from core.metrics import DB_POOL_CONNECTIONS, DB_POOL_TIMEOUTS, DB_POOL_WAIT, DB_POOL_WAITING
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    Django's PostgreSQL backend with metrics for its psycopg connection pool
+    (``OPTIONS['pool']``).
+
+    Each checkout records how long it waited for a connection, and checkouts
+    that give up after the pool's ``timeout`` are counted. After every
+    checkout and return, the pool's size, idle connections and backlog are
+    published as gauges that sum across workers.
+    """
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        started = time.perf_counter()
+        try:
+            return super().get_new_connection(conn_params)
+        except PoolTimeout:
+            DB_POOL_TIMEOUTS.labels(self.alias).inc()
+            raise
+        finally:
+            DB_POOL_WAIT.labels(self.alias).observe(time.perf_counter() - started)
+            self._publish_pool_stats(pool)
+
+    def _close(self):
+        pool = self.pool if self.connection is not None else None
+        try:
+            return super()._close()
+        finally:
+            if pool is not None:
+                self._publish_pool_stats(pool)
+
+    def _publish_pool_stats(self, pool):
+        stats = pool.get_stats()
+        DB_POOL_CONNECTIONS.labels(self.alias, 'open').set(stats.get('pool_size', 0))
+        DB_POOL_CONNECTIONS.labels(self.alias, 'idle').set(stats.get('pool_available', 0))
+        DB_POOL_CONNECTIONS.labels(self.alias, 'max').set(stats.get('pool_max', 0))
+        DB_POOL_WAITING.labels(self.alias).set(stats.get('requests_waiting', 0))
@@ -0,0 +1,180 @@
+"""
+Send reads to read replicas and writes to the primary, without serving
+anyone data older than their own writes.
+
+Replicas are the ``DATABASE_REPLICAS`` aliases (see ``DATABASE_REPLICA_URLS``).
+During a request, ``ReplicaRouter`` spreads reads across them at random until
+the request writes; from then on the whole request uses the primary.
+
+A write is also remembered for ``REPLICA_PINNING['SECONDS']`` under the keys
+it affects (``primary_pins.pin(user_id=..., email=...)``), and requests that
+look those keys up first (``primary_pins.check(...)``) read from the primary
+for that long. This covers replication lag between requests, e.g. a login
+right after registering or resetting a password.
+
+Code running outside a request (management commands, background threads)
+always uses the primary.
+"""
+import logging
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS
+
+from core.metrics import record_fallback
+from users.refresh_store import STORE_ERRORS
+
+
+logger = logging.getLogger(__name__)
+
+
+class _RoutingState:
+    __slots__ = ('pinned',)
+
+    def __init__(self):
+        self.pinned = False
+
+
+_routing_state = ContextVar('db_routing_state', default=None)
+
+
+def pin_request_to_primary():
+    """Read from the primary for the rest of the current request."""
+    state = _routing_state.get()
+    if state is not None:
+        state.pinned = True
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _routing_state.get()
+        if state is None or state.pinned or not settings.DATABASE_REPLICAS:
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        pin_request_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema by replication.
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReplicaPinningMiddleware:
+    """
+    Scopes ``ReplicaRouter``'s routing to one request. Removed from the chain
+    when no replicas are configured.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token = _routing_state.set(_RoutingState())
+        try:
+            return self.get_response(request)
+        finally:
+            _routing_state.reset(token)
+
+    async def __acall__(self, request):
+        # Sync ORM calls made through sync_to_async copy this context, so
+        # they share the state object (and a write there pins the request).
+        token = _routing_state.set(_RoutingState())
+        try:
+            return await self.get_response(request)
+        finally:
+            _routing_state.reset(token)
+
+
+class PrimaryPins:
+    """
+    Recent writes, by user ID and email, kept in the cache (Redis in
+    production) so every worker sees them.
+
+    Both methods do nothing unless replicas are configured.
+    """
+
+    prefix = 'db_pin'
+
+    @property
+    def config(self):
+        return settings.REPLICA_PINNING
+
+    @property
+    def cache(self):
+        return caches[self.config['CACHE']]
+
+    def _keys(self, user_id, email):
+        keys = []
+        if user_id is not None:
+            keys.append(f'{self.prefix}:user:{user_id}')
+        if email:
+            keys.append(f'{self.prefix}:email:{email.lower()}')
+        return keys
+
+    def pin(self, user_id=None, email=None):
+        """
+        Record a write to a user's row, so that reads looking the user up by
+        ID or email go to the primary for the pinning window.
+        """
+        if not settings.DATABASE_REPLICAS:
+            return
+        pin_request_to_primary()
+        try:
+            self.cache.set_many(dict.fromkeys(self._keys(user_id, email), 1), self.config['SECONDS'])
+        except STORE_ERRORS:
+            record_fallback('replica_pins')
+            logger.warning('Cache unavailable; reads for user %s may be stale for the replication lag', user_id)
+
+    def check(self, user_id=None, email=None):
+        """
+        Pin the current request to the primary if the user was written to
+        within the pinning window, or if that can't be determined.
+
+        Returns:
+            bool: Whether the request is now pinned.
+        """
+        if not settings.DATABASE_REPLICAS:
+            return False
+        try:
+            pinned = bool(self.cache.get_many(self._keys(user_id, email)))
+        except STORE_ERRORS:
+            record_fallback('replica_pins')
+            pinned = True
+        if pinned:
+            pin_request_to_primary()
+        return pinned
+
+    async def apin(self, user_id=None, email=None):
+        if settings.DATABASE_REPLICAS:
+            await sync_to_async(self.pin, thread_sensitive=False)(user_id, email)
+
+    async def acheck(self, user_id=None, email=None):
+        if not settings.DATABASE_REPLICAS:
+            return False
+        return await sync_to_async(self.check, thread_sensitive=False)(user_id, email)
+
+
+primary_pins = PrimaryPins()
@@ -0,0 +1,196 @@
+"""
+Per-request diagnostics: a ``Server-Timing`` breakdown of where a request's
+time went, and sampled cProfile dumps for offline analysis.
+
+Both are off by default. They can be turned on for every request in
+settings, or for a single request by sending the ``X-Debug-Token`` header
+with the value of ``REQUEST_DIAGNOSTICS['DEBUG_TOKEN']``.
+"""
+import cProfile
+import hmac
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from rest_framework import renderers
+
+from .metrics import record_phase, request_stats
+
+
+PHASES = ('db', 'redis', 'hash', 'jwt', 'serialize')
+
+
+def debug_authorized(request):
+    """Whether the request carries the configured debug token."""
+    token = settings.REQUEST_DIAGNOSTICS['DEBUG_TOKEN']
+    supplied = request.META.get('HTTP_X_DEBUG_TOKEN')
+    return bool(token and supplied) and hmac.compare_digest(supplied.encode(), token.encode())
+
+
+def server_timing(stats, total):
+    """
+    Format ``RequestStats`` as a ``Server-Timing`` header value.
+
+    Args:
+        stats: The request's ``RequestStats``.
+        total: The request's total duration in seconds.
+    """
+    entries = []
+    for phase in PHASES + tuple(sorted(set(stats.phases) - set(PHASES))):
+        if phase not in stats.phases:
+            continue
+        duration = f'dur={stats.phases[phase] * 1000:.2f}'
+        if phase == 'db':
+            entries.append(f'db;desc="{stats.queries} queries";{duration}')
+        else:
+            entries.append(f'{phase};{duration}')
+    entries.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(entries)
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """DRF's JSON renderer, timed as the request's ``serialize`` phase."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        started = time.perf_counter()
+        try:
+            return super().render(data, accepted_media_type, renderer_context)
+        finally:
+            record_phase('serialize', time.perf_counter() - started)
+
+
+class ServerTimingMiddleware:
+    """
+    Adds ``Server-Timing`` with the time spent in the database, Redis,
+    password hashing, JWT signing/verification and JSON rendering, e.g.
+    ``db;desc="1 queries";dur=0.84, hash;dur=212.40, jwt;dur=0.31, total;dur=219.02``.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def enabled(request):
+        return settings.REQUEST_DIAGNOSTICS['SERVER_TIMING'] or debug_authorized(request)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.enabled(request):
+            return self.get_response(request)
+        with request_stats() as stats:
+            started = time.perf_counter()
+            response = self.get_response(request)
+            response['Server-Timing'] = server_timing(stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled(request):
+            return await self.get_response(request)
+        with request_stats() as stats:
+            started = time.perf_counter()
+            response = await self.get_response(request)
+            response['Server-Timing'] = server_timing(stats, time.perf_counter() - started)
+        return response
+
+
+class RequestProfilingMiddleware:
+    """
+    Profiles ``PROFILE_SAMPLE_RATE`` of requests, plus any request with the
+    debug token, and writes each profile to ``PROFILE_DIR`` as a pstats file
+    (``python -m pstats <file>``, or snakeviz).
+
+    Since Python 3.12 cProfile records every thread, so the profile also
+    includes the work of requests that ran at the same time. Older Pythons
+    record only the request's own thread, so async views, ``sync_to_async``
+    calls and the hashing pool show up only as waiting. One request per
+    process is profiled at a time; others are skipped.
+    """
+
+    sync_capable = True
+    async_capable = True
+    _lock = threading.Lock()
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def sampled(request):
+        config = settings.REQUEST_DIAGNOSTICS
+        if not config['PROFILE_DIR']:
+            return False
+        return debug_authorized(request) or random.random() < config['PROFILE_SAMPLE_RATE']
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.sampled(request) or not self._lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            self.dump(profiler, request, response, time.perf_counter() - started)
+        finally:
+            self._lock.release()
+        return response
+
+    async def __acall__(self, request):
+        if not self.sampled(request) or not self._lock.acquire(blocking=False):
+            return await self.get_response(request)
+        try:
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                response = await self.get_response(request)
+            finally:
+                profiler.disable()
+            self.dump(profiler, request, response, time.perf_counter() - started)
+        finally:
+            self._lock.release()
+        return response
+
+    @staticmethod
+    def dump(profiler, request, response, duration):
+        """
+        Write the profile as
+        ``<UTC time>-<method>-<path>-<status>-<ms>ms-<pid>-<id>.prof``.
+
+        Returns:
+            str: The file's path.
+        """
+        directory = settings.REQUEST_DIAGNOSTICS['PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        path = re.sub(r'[^A-Za-z0-9]+', '_', request.path).strip('_')[:80] or 'root'
+        name = '-'.join([
+            datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S'),
+            request.method,
+            path,
+            str(response.status_code),
+            f'{duration * 1000:.0f}ms',
+            str(os.getpid()),
+            uuid.uuid4().hex[:8],
+        ])
+        filename = os.path.join(directory, f'{name}.prof')
+        profiler.dump_stats(filename)
+        return filename
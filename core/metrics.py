@@ -0,0 +1,308 @@
+"""
+Prometheus metrics for the service.
+
+Metric objects are module-level and cheap to update. Under a multi-worker
+server, set ``PROMETHEUS_MULTIPROC_DIR`` to an empty, writable directory
+before the workers start (entrypoint.sh does). Each worker then writes its
+samples there, and ``/metrics`` aggregates every worker's samples rather than
+reporting whichever process happened to answer the scrape.
+"""
+import atexit
+import hmac
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import redis
+import redis.asyncio
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess)
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5)
+HTTP_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Time to produce a response, by route and status.',
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS)
+REQUEST_DB_QUERIES = Histogram(
+    'http_request_db_queries', 'Database queries executed per request.',
+    ['route'], buckets=(0, 1, 2, 3, 4, 5, 7, 10, 15, 20, 30, 50))
+PASSWORD_HASH_DURATION = Histogram(
+    'password_hash_duration_seconds', 'Time spent hashing or verifying a password.',
+    ['operation'], buckets=LATENCY_BUCKETS)
+JWT_DURATION = Histogram(
+    'jwt_duration_seconds', 'Time spent signing or verifying a JWT.',
+    ['operation'], buckets=FAST_BUCKETS)
+REDIS_COMMAND_DURATION = Histogram(
+    'redis_command_duration_seconds', 'Redis round-trip time by command (PIPELINE for a whole pipeline).',
+    ['command'], buckets=FAST_BUCKETS)
+RATELIMIT_REJECTIONS = Counter(
+    'ratelimit_rejections_total', 'Requests refused by a rate limit.',
+    ['group', 'scope'])
+REDIS_FALLBACKS = Counter(
+    'redis_fallbacks_total', 'Operations that fell back from Redis to a local or database store.',
+    ['component'])
+# Connection pool state (core/db/postgresql). The gauges are summed over the
+# live workers, so db_pool_connections{state="max"} is the most connections
+# the host's workers can open between them.
+DB_POOL_WAIT = Histogram(
+    'db_pool_wait_seconds', 'Time spent waiting for a pooled database connection.',
+    ['alias'], buckets=FAST_BUCKETS + (1.0, 2.5, 5.0, 10.0))
+DB_POOL_TIMEOUTS = Counter(
+    'db_pool_timeouts_total', 'Checkouts that gave up waiting for a pooled database connection.',
+    ['alias'])
+DB_POOL_CONNECTIONS = Gauge(
+    'db_pool_connections', 'Pooled database connections: open, idle, and the configured maximum.',
+    ['alias', 'state'], multiprocess_mode='livesum')
+DB_POOL_WAITING = Gauge(
+    'db_pool_waiting_requests', 'Requests queued for a pooled database connection.',
+    ['alias'], multiprocess_mode='livesum')
+# Password hashing pools (users/hashing.py), by pool name. Saturation is
+# the running and queued tasks over password_hashing_pool_tasks{state="max"}.
+HASHING_POOL_WAIT = Histogram(
+    'password_hashing_pool_wait_seconds', 'Time a hash waited in its pool\'s queue before running.',
+    ['pool'], buckets=FAST_BUCKETS + (1.0, 2.5, 5.0, 10.0))
+HASHING_POOL_REJECTIONS = Counter(
+    'password_hashing_pool_rejections_total', 'Hashes refused because every worker was busy and the queue full.',
+    ['pool'])
+HASHING_POOL_TASKS = Gauge(
+    'password_hashing_pool_tasks', 'Hashes running and queued, and the most the pool accepts at once.',
+    ['pool', 'state'], multiprocess_mode='livesum')
+
+
+class RequestStats:
+    """Database queries and time per phase (``db``, ``redis``, ``hash``, ...) for one request."""
+
+    __slots__ = ('queries', 'phases')
+
+    def __init__(self):
+        self.queries = 0
+        self.phases = {}
+
+
+_request_stats = ContextVar('request_stats', default=None)
+
+
+@contextmanager
+def request_stats():
+    """
+    Collect ``RequestStats`` for the code inside the block, or join the
+    collection already running for this request.
+
+    The stats travel in a context variable, so work done on
+    ``sync_to_async`` threads and the hashing pool is attributed to the
+    request that started it.
+    """
+    stats = _request_stats.get()
+    if stats is not None:
+        yield stats
+        return
+    stats = RequestStats()
+    token = _request_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _request_stats.reset(token)
+
+
+def record_phase(phase, seconds):
+    """Add ``seconds`` to ``phase`` of the current request, if any."""
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.phases[phase] = stats.phases.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def timed(metric, phase):
+    """
+    Time the block into a histogram and a request phase.
+
+    Args:
+        metric: A labelled histogram, e.g. ``JWT_DURATION.labels('sign')``.
+        phase: The request phase the time counts towards, e.g. ``'jwt'``.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metric.observe(elapsed)
+        record_phase(phase, elapsed)
+
+
+def record_fallback(component):
+    """Count one fallback from Redis in ``component`` (e.g. ``'reset_tokens'``)."""
+    REDIS_FALLBACKS.labels(component).inc()
+
+
+def record_rate_limit_rejection(key):
+    """
+    Count a rate-limit rejection.
+
+    Args:
+        key: The limit key that refused the request, e.g. ``'login:ip:1.2.3.4'``.
+    """
+    group, _, rest = key.partition(':')
+    RATELIMIT_REJECTIONS.labels(group, rest.partition(':')[0]).inc()
+
+
+def _observe_query(execute, sql, params, many, context):
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    stats.queries += 1
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record_phase('db', time.perf_counter() - started)
+
+
+def _install_query_counter(sender, connection, **kwargs):
+    if _observe_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_observe_query)
+
+
+connection_created.connect(_install_query_counter, dispatch_uid='metrics_count_queries')
+
+
+class MetricsMiddleware:
+    """
+    Records latency and the number of database queries for every request,
+    labelled by URL route rather than path so cardinality stays bounded.
+
+    Queries are counted with ``request_stats()``, so queries run on
+    ``sync_to_async`` threads are still attributed to the request.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Connections opened before this module was imported missed the signal.
+        for connection in connections.all(initialized_only=True):
+            _install_query_counter(None, connection)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with request_stats() as stats:
+            started = time.perf_counter()
+            response = self.get_response(request)
+            self._observe(request, response, time.perf_counter() - started, stats.queries)
+        return response
+
+    async def __acall__(self, request):
+        with request_stats() as stats:
+            started = time.perf_counter()
+            response = await self.get_response(request)
+            self._observe(request, response, time.perf_counter() - started, stats.queries)
+        return response
+
+    @staticmethod
+    def _observe(request, response, duration, queries):
+        match = getattr(request, 'resolver_match', None)
+        # Router-generated routes are regexes; drop the anchors.
+        route = match.route.replace('^', '').rstrip('$') if match is not None else 'unmatched'
+        method = request.method if request.method in HTTP_METHODS else 'other'
+        REQUEST_DURATION.labels(method, route, str(response.status_code)).observe(duration)
+        REQUEST_DB_QUERIES.labels(route).observe(queries)
+
+
+class InstrumentedRedis(redis.Redis):
+    """``redis.Redis`` that times every command. Use as django-redis's ``REDIS_CLIENT_CLASS``."""
+
+    def execute_command(self, *args, **options):
+        with timed(REDIS_COMMAND_DURATION.labels(str(args[0]).upper()), 'redis'):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error=True):
+        with timed(REDIS_COMMAND_DURATION.labels('PIPELINE'), 'redis'):
+            return super().execute(raise_on_error)
+
+
+class InstrumentedAsyncRedis(redis.asyncio.Redis):
+    """``redis.asyncio.Redis`` that times every command."""
+
+    async def execute_command(self, *args, **options):
+        with timed(REDIS_COMMAND_DURATION.labels(str(args[0]).upper()), 'redis'):
+            return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedAsyncPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class InstrumentedAsyncPipeline(redis.asyncio.client.Pipeline):
+    async def execute(self, raise_on_error=True):
+        with timed(REDIS_COMMAND_DURATION.labels('PIPELINE'), 'redis'):
+            return await super().execute(raise_on_error)
+
+
+def _mark_process_dead():
+    multiprocess.mark_process_dead(os.getpid())
+
+
+def _mark_dead_workers(path):
+    # Workers killed outright (uvicorn kills those that stop answering its
+    # health checks) never run their exit hook; their live gauges would keep
+    # being summed until the directory is cleared.
+    for name in os.listdir(path):
+        if not name.startswith('gauge_live') or not name.endswith('.db'):
+            continue
+        pid = int(name[:-len('.db')].rsplit('_', 1)[1])
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            multiprocess.mark_process_dead(pid, path)
+        except PermissionError:
+            pass
+
+
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    # gunicorn.conf.py marks its workers dead from the master (child_exit);
+    # nothing does under uvicorn, so each process does it as it exits.
+    atexit.register(_mark_process_dead)
+
+
+def _registry():
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        _mark_dead_workers(path)
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path)
+        return registry
+    return REGISTRY
+
+
+def metrics_view(request):
+    """
+    Serve every metric in the Prometheus text format. Scrapes must send
+    ``METRICS_TOKEN`` as a bearer token; without one configured the metrics
+    are only served when ``DEBUG`` is on.
+    """
+    token = settings.METRICS_TOKEN
+    if not token:
+        if not settings.DEBUG:
+            raise Http404
+    else:
+        header = request.META.get('HTTP_AUTHORIZATION', '')
+        if not hmac.compare_digest(header.encode(), f'Bearer {token}'.encode()):
+            return HttpResponse(status=401, headers={'WWW-Authenticate': 'Bearer'})
+    return HttpResponse(generate_latest(_registry()), content_type=CONTENT_TYPE_LATEST)
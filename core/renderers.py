@@ -0,0 +1,47 @@
+"""
+MessagePack for internal service-to-service endpoints.
+
+Smaller and faster to decode than JSON for the lists of small objects those
+endpoints return. Clients opt in with ``Accept: application/msgpack`` (or
+``?format=msgpack``) and may send ``Content-Type: application/msgpack``.
+"""
+import time
+
+import msgpack
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework import parsers, renderers
+from rest_framework.exceptions import ParseError
+
+from .metrics import record_phase
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    """Renders with msgpack, timed as the request's ``serialize`` phase."""
+
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    # Dates, decimals, UUIDs and lazy translations (in error messages) are
+    # packed as the strings JSON would use.
+    _default = DjangoJSONEncoder().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        started = time.perf_counter()
+        try:
+            return msgpack.packb(data, default=self._default)
+        finally:
+            record_phase('serialize', time.perf_counter() - started)
+
+
+class MessagePackParser(parsers.BaseParser):
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except ValueError as e:
+            raise ParseError(f'MessagePack parse error - {str(e) or type(e).__name__}')
@@ -0,0 +1,114 @@
+"""
+Serve the OpenAPI schema generated at build time.
+
+``manage.py generate_openapi_schema`` writes the schema into
+``OPENAPI_SCHEMA_DIR`` before ``collectstatic`` runs. collectstatic then
+gives it a content-hashed name, and WhiteNoise serves it with immutable cache
+headers. The views here point at, or return, that file instead of asking
+drf-spectacular to introspect every view on each request. Without a
+generated schema (e.g. in development) they fall back to drf-spectacular.
+"""
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.http import HttpResponse
+from django.templatetags.static import static
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from drf_spectacular.utils import extend_schema
+from drf_spectacular.views import SCHEMA_KWARGS, SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
+
+
+# Static names of the generated schema, by format.
+SCHEMA_FILES = {
+    'yaml': 'openapi/schema.yaml',
+    'json': 'openapi/schema.json',
+}
+CONTENT_TYPES = {
+    'yaml': 'application/vnd.oai.openapi; charset=utf-8',
+    'json': 'application/vnd.oai.openapi+json; charset=utf-8',
+}
+
+
+@lru_cache
+def prebuilt_schema(fmt):
+    """
+    Find the generated schema in the given format.
+
+    Returns:
+        tuple: ``(url, body, etag)``, or None if no schema was generated
+        before collectstatic.
+    """
+    name = SCHEMA_FILES[fmt]
+    if settings.DEBUG:
+        path = finders.find(name)
+        if path is None:
+            return None
+        with open(path, 'rb') as f:
+            body = f.read()
+        url = static(name)
+    else:
+        try:
+            stored_name = staticfiles_storage.stored_name(name)
+        except ValueError:
+            # Not in the collectstatic manifest.
+            return None
+        if not staticfiles_storage.exists(stored_name):
+            return None
+        with staticfiles_storage.open(stored_name) as f:
+            body = f.read()
+        url = staticfiles_storage.url(name)
+    # The hashed name already identifies the content.
+    return url, body, '"%s"' % url.rsplit('/', 1)[-1]
+
+
+def _format(request):
+    requested = request.GET.get('format') or request.META.get('HTTP_ACCEPT', '')
+    return 'json' if 'json' in requested else 'yaml'
+
+
+class SchemaView(SpectacularAPIView):
+    # Returns the generated schema with an ETag: YAML by default, JSON for
+    # ?format=json or a JSON Accept header. This URL isn't versioned, so
+    # clients revalidate after OPENAPI_SCHEMA_MAX_AGE seconds; only the hashed
+    # static URL is cacheable forever. The docstring is the schema's own
+    # description of this endpoint.
+    __doc__ = SpectacularAPIView.__doc__
+
+    @extend_schema(**SCHEMA_KWARGS)
+    def get(self, request, *args, **kwargs):
+        prebuilt = None
+        if not request.GET.get('lang') and not request.GET.get('version'):
+            prebuilt = prebuilt_schema(_format(request))
+        if prebuilt is None:
+            return super().get(request, *args, **kwargs)
+        url, body, etag = prebuilt
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponse(status=304)
+        else:
+            response = HttpResponse(body, content_type=CONTENT_TYPES[_format(request)])
+        response['ETag'] = etag
+        response['Link'] = f'<{url}>; rel="canonical"'
+        patch_cache_control(response, public=True, max_age=settings.OPENAPI_SCHEMA_MAX_AGE)
+        return response
+
+
+class PrebuiltSchemaUrlMixin:
+    """Point a docs UI at the immutable, hashed schema file when there is one."""
+
+    def _get_schema_url(self, request):
+        if not request.GET.get('lang') and not request.GET.get('version'):
+            prebuilt = prebuilt_schema('json')
+            if prebuilt is not None:
+                return prebuilt[0]
+        return super()._get_schema_url(request)
+
+
+class SwaggerView(PrebuiltSchemaUrlMixin, SpectacularSwaggerView):
+    pass
+
+
+class RedocView(PrebuiltSchemaUrlMixin, SpectacularRedocView):
+    pass
@@ -52,6 +52,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
+    'core.diagnostics.ServerTimingMiddleware',
+    'core.diagnostics.RequestProfilingMiddleware',
+    'core.db.routers.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -90,7 +94,7 @@ WSGI_APPLICATION = 'core.wsgi.application'
 DATABASE_URL = os.getenv('DATABASE_URL')
 if DATABASE_URL:
     DATABASES = {
-        'default': dj_database_url.parse(DATABASE_URL, engine='django.db.backends.postgresql')
+        'default': dj_database_url.parse(DATABASE_URL, engine='core.db.postgresql')
 
     }
 else:
@@ -100,7 +104,7 @@ else:
         #     'NAME': BASE_DIR / 'db.sqlite3',
         # }
         'default': {
-            'ENGINE': 'django.db.backends.postgresql',
+            'ENGINE': 'core.db.postgresql',
             'NAME': os.getenv('DB_NAME'),
             'USER': os.getenv('DB_USER'),
             'PASSWORD': os.getenv('DB_PASS'),
@@ -109,7 +113,54 @@ else:
         }
     }
 
+# Read replicas, as comma-separated database URLs. Reads are spread across
+# them and writes go to the primary (core/db/routers.py).
+DATABASE_REPLICAS = []
+for i, url in enumerate(filter(None, os.getenv('DATABASE_REPLICA_URLS', '').split(',')), start=1):
+    alias = f'replica{i}'
+    DATABASES[alias] = dj_database_url.parse(url.strip(), engine='core.db.postgresql')
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['core.db.routers.ReplicaRouter'] if DATABASE_REPLICAS else []
+# After a user's row is written, requests that look the user up read from the
+# primary for this long, so replication lag never shows them stale data.
+REPLICA_PINNING = {
+    'CACHE': 'default',
+    'SECONDS': int(os.getenv('DB_REPLICA_PIN_SECONDS', 15)),
+}
+
+# Each worker process keeps its own psycopg connection pool, so a host opens
+# up to workers x DB_POOL_MAX_SIZE connections. Keep that (summed over every
+# host) below Postgres' max_connections, leaving room for migrations and
+# admin sessions. core.db.postgresql exports the pool's wait time and
+# saturation as db_pool_* metrics.
+DB_POOL = os.getenv('DB_POOL', 'True') == 'True'
+DB_POOL_OPTIONS = {
+    'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+    'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+    # Seconds a request waits for a free connection before failing.
+    'timeout': float(os.getenv('DB_POOL_TIMEOUT_SECONDS', 5)),
+    'max_idle': float(os.getenv('DB_POOL_MAX_IDLE_SECONDS', 300)),
+    'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME_SECONDS', 1800)),
+}
+for database in DATABASES.values():
+    if DB_POOL:
+        # The pool keeps connections open; Django requires CONN_MAX_AGE = 0
+        # with it and uses CONN_HEALTH_CHECKS to check connections on checkout.
+        database.setdefault('OPTIONS', {})['pool'] = DB_POOL_OPTIONS
+        database['CONN_MAX_AGE'] = 0
+    else:
+        database['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', 60))
+    database['CONN_HEALTH_CHECKS'] = True
+
 REDIS_URL = os.getenv('REDIS_URL')
+# Fail fast when Redis is down; callers fall back and the circuit breaker
+# stops retrying for a while.
+REDIS_CONNECT_TIMEOUT = float(os.getenv('REDIS_CONNECT_TIMEOUT_SECONDS', 0.5))
+REDIS_TIMEOUT = float(os.getenv('REDIS_TIMEOUT_SECONDS', 0.5))
+# Extra ConnectionPool arguments for the redis.asyncio client (users/async_redis.py),
+# like django-redis's CONNECTION_POOL_KWARGS.
+REDIS_ASYNC_CONNECTION_POOL_KWARGS = {}
 
 if REDIS_URL:
     CACHES = {
@@ -118,6 +169,9 @@ if REDIS_URL:
             "LOCATION": REDIS_URL,
             "OPTIONS": {
                 "CLIENT_CLASS": "django_redis.client.DefaultClient",
+                "REDIS_CLIENT_CLASS": "core.metrics.InstrumentedRedis",
+                "SOCKET_CONNECT_TIMEOUT": REDIS_CONNECT_TIMEOUT,
+                "SOCKET_TIMEOUT": REDIS_TIMEOUT,
             }
         }
     }
@@ -147,7 +201,7 @@ AUTH_PASSWORD_VALIDATORS = [
         'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
     },
     {
-        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
+        'NAME': 'users.validators.CommonPasswordValidator',
     },
     {
         'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
@@ -168,7 +222,67 @@ USE_TZ = True
 
 AUTH_USER_MODEL = 'users.User'
 
-RATELIMIT_USE_CACHE = 'default'
+# Password hashing runs on a bounded per-process pool (see users/hashing.py).
+# Requests that arrive while every worker is busy and the queue is full get a
+# 503 straight away.
+PASSWORD_HASHING_POOLS = {
+    'default': {
+        'MAX_WORKERS': int(os.getenv('PASSWORD_HASHING_WORKERS', 2)),
+        'MAX_QUEUE': int(os.getenv('PASSWORD_HASHING_QUEUE_SIZE', 16)),
+    },
+}
+
+# Rate limits, as "<count>/<period>" with period s, m, h or d (optionally
+# with a multiplier, e.g. "100/10s"). Checked atomically in one Redis round
+# trip; without Redis, in a shared-memory table all workers on the host see.
+RATELIMITS = {
+    'login': {
+        'ip': os.getenv('LOGIN_RATE_LIMIT_IP', '5/m'),
+        'account': os.getenv('LOGIN_RATE_LIMIT_ACCOUNT', '10/m'),
+        'global': os.getenv('LOGIN_RATE_LIMIT_GLOBAL', '200/s'),
+    },
+    'reset-password': {
+        'ip': os.getenv('RESET_PASSWORD_RATE_LIMIT_IP', '3/m'),
+        'global': os.getenv('RESET_PASSWORD_RATE_LIMIT_GLOBAL', '50/s'),
+    },
+}
+RATELIMIT_SHARED_MEMORY_PATH = os.getenv(
+    'RATELIMIT_SHARED_MEMORY_PATH',
+    '/dev/shm/auth_service_ratelimit' if os.path.isdir('/dev/shm') else str(BASE_DIR / '.ratelimit'),
+)
+RATELIMIT_SHARED_MEMORY_SLOTS = 8192
+
+# Serialized profiles, keyed by user id and version (see users/profile_cache.py).
+PROFILE_CACHE = {
+    'CACHE': 'default',
+    'TIMEOUT': int(os.getenv('PROFILE_CACHE_TIMEOUT_SECONDS', 3600)),
+    'LOCAL_TTL': float(os.getenv('PROFILE_CACHE_LOCAL_TTL_SECONDS', 5)),
+    'LOCAL_MAX_ENTRIES': 10000,
+}
+
+# Logins are recorded in Redis (or per process) and written to
+# User.last_login in batches (see users/activity.py).
+LAST_LOGIN_TRACKER = {
+    'FLUSH_INTERVAL': float(os.getenv('LAST_LOGIN_FLUSH_INTERVAL_SECONDS', 30)),
+    'BATCH_SIZE': 1000,
+}
+
+# The password list users.validators.CommonPasswordValidator maps, built by
+# `manage.py build_password_list` (from Django's common passwords by default;
+# point this at a larger list, such as breached-password hashes, built the
+# same way).
+COMMON_PASSWORDS_PATH = os.getenv('COMMON_PASSWORDS_PATH', str(BASE_DIR / 'generated' / 'common-passwords.bin'))
+
+PASSWORD_RESET_EXPIRY_SECONDS = int(os.getenv('PASSWORD_RESET_EXPIRY_SECONDS', 600))
+
+# After FAILURE_THRESHOLD consecutive errors a dependency is skipped for
+# RESET_TIMEOUT seconds (see users/breaker.py).
+CIRCUIT_BREAKERS = {
+    'redis': {
+        'FAILURE_THRESHOLD': int(os.getenv('REDIS_BREAKER_FAILURE_THRESHOLD', 3)),
+        'RESET_TIMEOUT': float(os.getenv('REDIS_BREAKER_RESET_SECONDS', 30)),
+    },
+}
 
 
 # Static files (CSS, JavaScript, Images)
@@ -177,6 +291,13 @@ RATELIMIT_USE_CACHE = 'default'
 STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# Build-time outputs collected as static files, such as the OpenAPI schema
+# from `manage.py generate_openapi_schema` (see core/schema.py).
+OPENAPI_SCHEMA_DIR = BASE_DIR / 'generated_static'
+STATICFILES_DIRS = [OPENAPI_SCHEMA_DIR] if OPENAPI_SCHEMA_DIR.is_dir() else []
+# Cache lifetime of /api/schema/; the hashed static URL is immutable.
+OPENAPI_SCHEMA_MAX_AGE = int(os.getenv('OPENAPI_SCHEMA_MAX_AGE', 300))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -185,11 +306,15 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.ClaimsJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.diagnostics.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 SPECTACULAR_SETTINGS = {
@@ -201,7 +326,11 @@ SPECTACULAR_SETTINGS = {
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=int(os.getenv('ACCESS_TOKEN_LIFETIME_MINUTES', 5))),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=int(os.getenv('REFRESH_TOKEN_LIFETIME_DAYS', 1))),
-    'ROTATE_REFRESH_TOKENS': False,
+    # Rotation and reuse detection are tracked by users.refresh_store in the
+    # cache, so simplejwt's database blacklist stays off. Every worker must
+    # see the same store, or a refresh landing on another worker looks like a
+    # replay and logs the user out, so they are on by default only with Redis.
+    'ROTATE_REFRESH_TOKENS': os.getenv('REFRESH_TOKEN_ROTATION', str(bool(REDIS_URL))) == 'True',
     'BLACKLIST_AFTER_ROTATION': False,
     'UPDATE_LAST_LOGIN': False,
 
@@ -211,4 +340,74 @@ SIMPLE_JWT = {
     'AUTH_HEADER_NAME': 'HTTP_AUTHORIZATION',
     'USER_ID_FIELD': 'id',
     'USER_ID_CLAIM': 'user_id',
+    'TOKEN_USER_CLASS': 'users.authentication.ClaimsUser',
+    'TOKEN_OBTAIN_SERIALIZER': 'users.serializers.UserTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'users.serializers.UserTokenRefreshSerializer',
+    'TOKEN_VERIFY_SERIALIZER': 'users.serializers.UserTokenVerifySerializer',
+}
+
+REFRESH_TOKEN_STORE = {
+    'CACHE': 'default',
+    # Revoked token families are mirrored into a per-process Bloom filter,
+    # synced from the cache at most every SYNC_INTERVAL seconds. The filter
+    # starts at BLOOM_CAPACITY and is rebuilt twice the size of the live
+    # revocation log whenever it fills up.
+    'BLOOM_CAPACITY': int(os.getenv('REFRESH_REVOCATION_BLOOM_CAPACITY', 100000)),
+    'BLOOM_ERROR_RATE': 0.001,
+    'SYNC_INTERVAL': float(os.getenv('REFRESH_REVOCATION_SYNC_SECONDS', 1)),
+}
+
+# Per-user token generation counters ("log out everywhere"). Each process
+# trusts its local copy of a counter for LOCAL_TTL seconds.
+TOKEN_GENERATIONS = {
+    'CACHE': 'default',
+    'LOCAL_TTL': float(os.getenv('TOKEN_GENERATION_LOCAL_TTL_SECONDS', 5)),
+    'LOCAL_MAX_ENTRIES': 10000,
+}
+
+# Asymmetric signing. When JWT_KEYS_DIR is set, tokens are signed with the
+# private key named by JWT_ACTIVE_KID (default: the last kid in sort order)
+# and every key in the directory is published at /.well-known/jwks.json.
+# Publish a new key at least JWKS_CACHE_MAX_AGE seconds before activating it.
+JWT_KEYS_DIR = os.getenv('JWT_KEYS_DIR')
+JWT_ACTIVE_KID = os.getenv('JWT_ACTIVE_KID')
+# Tokens signed with SECRET_KEY before JWT_KEYS_DIR was set are rejected,
+# logging everyone out, unless this is on. Turn it on when switching and
+# off again once REFRESH_TOKEN_LIFETIME has passed; refreshing an HS256
+# token returns key-ring tokens.
+JWT_ACCEPT_HS256 = os.getenv('JWT_ACCEPT_HS256') == 'True'
+JWKS_CACHE_MAX_AGE = int(os.getenv('JWKS_CACHE_MAX_AGE', 86400))
+
+# Most tokens accepted by /api/auth/token/verify/batch/ in one request.
+TOKEN_VERIFY_BATCH_MAX_SIZE = int(os.getenv('TOKEN_VERIFY_BATCH_MAX_SIZE', 100))
+
+# Rows fetched per server-side cursor round trip (and encoded per write) by
+# the user export endpoint and command.
+USER_EXPORT_CHUNK_SIZE = int(os.getenv('USER_EXPORT_CHUNK_SIZE', 2000))
+
+# Keys other services authenticate with ("Authorization: Service <key>") on
+# internal endpoints such as /api/auth/users/lookup/, given as
+# SERVICE_API_KEYS=name:key,name:key. Give each service its own key.
+SERVICE_API_KEYS = dict(
+    entry.strip().split(':', 1) for entry in os.getenv('SERVICE_API_KEYS', '').split(',') if ':' in entry
+)
+
+# Most ids plus emails accepted by /api/auth/users/lookup/ in one request.
+USER_LOOKUP_MAX_SIZE = int(os.getenv('USER_LOOKUP_MAX_SIZE', 500))
+
+# Prometheus metrics at /metrics (core/metrics.py). Scrapes must send
+# "Authorization: Bearer <METRICS_TOKEN>"; unless DEBUG is on, /metrics is a
+# 404 while METRICS_TOKEN is unset. Multi-worker servers also need
+# PROMETHEUS_MULTIPROC_DIR in the environment; see entrypoint.sh.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Per-request diagnostics (core/diagnostics.py). SERVER_TIMING adds a
+# Server-Timing header to every response. PROFILE_SAMPLE_RATE is the fraction
+# of requests whose cProfile dump is written to PROFILE_DIR. A request with
+# "X-Debug-Token: <DEBUG_TOKEN>" gets both.
+REQUEST_DIAGNOSTICS = {
+    'SERVER_TIMING': os.getenv('SERVER_TIMING', 'False') == 'True',
+    'DEBUG_TOKEN': os.getenv('DEBUG_TOKEN'),
+    'PROFILE_DIR': os.getenv('REQUEST_PROFILE_DIR'),
+    'PROFILE_SAMPLE_RATE': float(os.getenv('REQUEST_PROFILE_SAMPLE_RATE', 0)),
 }
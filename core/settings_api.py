@@ -0,0 +1,42 @@
+"""
+Settings for API nodes: workers that serve only the auth API.
+
+Admin, sessions, messages, static files and the schema/docs views are left
+out, along with the middleware that only they need. Bearer-token requests
+go through security headers, CORS and URL normalisation, plus the metrics
+and diagnostics hooks. Run API workers with
+``DJANGO_SETTINGS_MODULE=core.settings_api``. Admin and docs stay on workers
+running the full ``core.settings`` profile, which is also the one to run
+migrations with.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import REST_FRAMEWORK
+
+
+INSTALLED_APPS = [
+    'rest_framework',
+    'rest_framework_simplejwt',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'corsheaders',
+    'users',
+]
+
+MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
+    'core.diagnostics.ServerTimingMiddleware',
+    'core.diagnostics.RequestProfilingMiddleware',
+    'core.db.routers.ReplicaPinningMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'corsheaders.middleware.CorsMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+
+ROOT_URLCONF = 'core.urls_api'
+
+# Every response is JSON; nothing renders templates or asks for a schema.
+TEMPLATES = []
+REST_FRAMEWORK = {
+    key: value for key, value in REST_FRAMEWORK.items() if key != 'DEFAULT_SCHEMA_CLASS'
+}
+REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = ['core.diagnostics.JSONRenderer']
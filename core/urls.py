@@ -17,14 +17,17 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
-from drf_spectacular.views import (
-    SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView)
+from core.metrics import metrics_view
+from core.schema import RedocView, SchemaView, SwaggerView
+from users.views import jwks
 
 urlpatterns = [
-    path('', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
+    path('', SwaggerView.as_view(url_name='schema'), name='swagger-ui'),
     path('admin/', admin.site.urls),
+    path('.well-known/jwks.json', jwks, name='jwks'),
+    path('metrics', metrics_view, name='metrics'),
     path('api/auth/', include('users.urls')),
-    path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
-    path('api/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
-    path('api/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
+    path('api/schema/', SchemaView.as_view(), name='schema'),
+    path('api/docs/', SwaggerView.as_view(url_name='schema'), name='swagger-ui'),
+    path('api/redoc/', RedocView.as_view(url_name='schema'), name='redoc'),
 ]
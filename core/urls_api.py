@@ -0,0 +1,14 @@
+"""
+URL configuration for API nodes (``core.settings_api``): the auth API, plus
+the JWKS document other services verify tokens with and the metrics endpoint.
+"""
+from django.urls import include, path
+
+from core.metrics import metrics_view
+from users.views import jwks
+
+urlpatterns = [
+    path('.well-known/jwks.json', jwks, name='jwks'),
+    path('metrics', metrics_view, name='metrics'),
+    path('api/auth/', include('users.urls')),
+]
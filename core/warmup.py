@@ -0,0 +1,58 @@
+"""
+Load everything a request would otherwise load lazily on first use.
+
+gunicorn.conf.py calls ``warm_up()`` in the master after preloading the app,
+so every worker inherits these modules, objects and signing keys through
+copy-on-write pages instead of building its own copy on its first request.
+Nothing here may open a database or Redis connection: sockets must not be
+shared across the fork.
+"""
+from importlib import import_module
+
+from django.conf import settings
+
+
+MODULES = [
+    'users.views',
+    'users.serializers',
+    'users.authentication',
+    'rest_framework_simplejwt.tokens',
+    'jsonschema',
+]
+
+
+def warm_up():
+    """Import and initialize the request path, without touching the network."""
+    from django.contrib.auth.hashers import get_hashers
+    from django.contrib.auth.password_validation import get_default_password_validators
+    from django.urls import get_resolver
+    from rest_framework.settings import api_settings
+    from rest_framework_simplejwt import state
+    from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+    for name in MODULES:
+        import_module(name)
+
+    # URL patterns, and every view module they import.
+    get_resolver().url_patterns
+    get_resolver().reverse_dict
+
+    # Hasher and validator instances (CommonPasswordValidator maps its
+    # password list when constructed).
+    get_hashers()
+    get_default_password_validators()
+
+    # DRF and simplejwt import their configured classes on first access.
+    for setting in ('DEFAULT_RENDERER_CLASSES', 'DEFAULT_PARSER_CLASSES', 'DEFAULT_AUTHENTICATION_CLASSES',
+                    'DEFAULT_PERMISSION_CLASSES', 'DEFAULT_THROTTLE_CLASSES'):
+        getattr(api_settings, setting)
+    for setting in ('AUTH_TOKEN_CLASSES', 'TOKEN_USER_CLASS', 'USER_AUTHENTICATION_RULE'):
+        getattr(jwt_settings, setting)
+
+    # Sign and verify once so that signing keys are parsed and the JWT
+    # algorithms loaded. The inner backend skips the request metrics.
+    backend = getattr(state.token_backend, 'backend', state.token_backend)
+    backend.decode(backend.encode({'warm_up': True}))
+
+    if 'drf_spectacular' in settings.INSTALLED_APPS:
+        import_module('drf_spectacular.views')
@@ -4,5 +4,18 @@ set -e
 # Run migrations on container start
 python manage.py migrate --noinput
 
-# Start Gunicorn bound to $PORT
-exec gunicorn core.wsgi --bind 0.0.0.0:${PORT} --workers 3 --log-file -
\ No newline at end of file
+# Workers write Prometheus samples here so /metrics can aggregate them; stale
+# files from a previous run would be counted too.
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus-multiproc}"
+rm -rf "${PROMETHEUS_MULTIPROC_DIR}"
+mkdir -p "${PROMETHEUS_MULTIPROC_DIR}"
+
+# Start the server bound to $PORT. The auth endpoints are async, so the
+# default is uvicorn on the ASGI app: each worker process serves many
+# concurrent connections from one event loop. SERVER=gunicorn runs the WSGI
+# app instead, preloaded and sized by gunicorn.conf.py.
+if [ "${SERVER:-uvicorn}" = "gunicorn" ]; then
+    exec gunicorn core.wsgi -c gunicorn.conf.py
+fi
+exec uvicorn core.asgi:application --host 0.0.0.0 --port ${PORT} --workers ${WEB_CONCURRENCY:-3} \
+    --backlog ${UVICORN_BACKLOG:-4096} --proxy-headers --no-server-header
@@ -0,0 +1,97 @@
+"""
+gunicorn settings for the WSGI app (``SERVER=gunicorn`` in entrypoint.sh):
+
+    gunicorn core.wsgi -c gunicorn.conf.py
+
+The app is imported once in the master, warmed up (core/warmup.py) and its
+objects frozen out of the garbage collector before the workers are forked.
+Workers then share those pages with the master instead of each holding a
+copy. Touching an object still copies its page, but collections skip frozen
+objects, so a worker no longer copies everything the first time it
+collects. Measure the effect with ``python -m benchmarks.worker_memory``.
+
+Workers and threads default to what the machine (or container) can take;
+GUNICORN_WORKERS / WEB_CONCURRENCY and GUNICORN_THREADS override them.
+"""
+import gc
+import math
+import os
+
+
+def _cgroup_value(path):
+    try:
+        with open(path) as f:
+            return f.read().split()
+    except OSError:
+        return None
+
+
+def cpu_count():
+    """CPUs this process may use, honouring affinity and a cgroup v2 CPU quota."""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    quota = _cgroup_value('/sys/fs/cgroup/cpu.max')
+    if quota and quota[0] != 'max':
+        cpus = min(cpus, max(1, math.ceil(int(quota[0]) / int(quota[1]))))
+    return cpus
+
+
+def memory_bytes():
+    """Memory available to this process: the cgroup v2 limit, or physical memory."""
+    limit = _cgroup_value('/sys/fs/cgroup/memory.max')
+    if limit and limit[0] != 'max':
+        return int(limit[0])
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def default_workers():
+    """
+    ``2 * CPUs + 1``, capped so that the workers' private memory fits in
+    what's left after the master's.
+    """
+    budget = int(os.getenv('GUNICORN_WORKER_MEMORY_MB', 96)) * 1024 * 1024
+    reserve = int(os.getenv('GUNICORN_MEMORY_RESERVE_MB', 256)) * 1024 * 1024
+    by_memory = max(1, (memory_bytes() - reserve) // budget)
+    return max(1, min(2 * cpu_count() + 1, by_memory))
+
+
+bind = [f'0.0.0.0:{os.getenv("PORT", "8000")}']
+workers = int(os.getenv('GUNICORN_WORKERS') or os.getenv('WEB_CONCURRENCY') or default_workers())
+# Requests mostly wait on Postgres, Redis and the hashing pool, so a few
+# threads per worker keep the CPU busy without multiplying processes.
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True') == 'True'
+freeze_gc = preload_app and os.getenv('GUNICORN_GC_FREEZE', 'True') == 'True'
+errorlog = '-'
+
+if freeze_gc:
+    # Collections in the master would free objects between long-lived ones
+    # and leave holes that later allocations fill, dirtying shared pages. The
+    # master only imports and forks, so it doesn't need the collector.
+    gc.disable()
+
+
+def when_ready(server):
+    # Runs in the master after the app is preloaded and before the first fork.
+    if preload_app:
+        from core.warmup import warm_up
+        warm_up()
+
+
+def pre_fork(server, worker):
+    if freeze_gc:
+        # Move everything allocated so far to the permanent generation, where
+        # the workers' collections never touch its reference counts.
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if freeze_gc:
+        gc.enable()
+
+
+def child_exit(server, worker):
+    # Keep /metrics from summing gauges of workers that no longer exist.
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,189 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import DatabaseError, connections, router
+from django_redis import get_redis_connection
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError
+
+from core.metrics import record_fallback
+
+from .breaker import redis_breaker
+from .models import User
+
+
+logger = logging.getLogger(__name__)
+
+REDIS_ERRORS = (ConnectionInterrupted, RedisError)
+
+
+class LastLoginTracker:
+    """
+    Records logins without writing the user row on every one.
+
+    ``record()`` stores the login time in a Redis hash shared by every worker
+    (or, while Redis is unavailable, in this process's buffer). ``flush()``
+    drains both and applies them to ``User.last_login`` with one UPDATE per
+    ``BATCH_SIZE`` users; a background thread flushes every
+    ``FLUSH_INTERVAL`` seconds, and ``manage.py flush_last_login`` does it on
+    demand. A flush never moves ``last_login`` backwards.
+    """
+
+    key = 'last_login:pending'
+
+    def __init__(self, breaker=redis_breaker):
+        self.breaker = breaker
+        self._lock = threading.Lock()
+        self._buffer = {}
+        self._pid = None
+
+    @property
+    def config(self):
+        return settings.LAST_LOGIN_TRACKER
+
+    def _redis(self):
+        if not self.breaker.allow():
+            return None
+        try:
+            return get_redis_connection('default')
+        except NotImplementedError:
+            # The default cache isn't Redis.
+            return None
+
+    def record(self, user_id, when=None):
+        """
+        Note that a user logged in.
+
+        Args:
+            user_id: The user's ID.
+            when: Unix timestamp of the login; defaults to now.
+        """
+        when = time.time() if when is None else when
+        self._ensure_flusher()
+        redis_conn = self._redis()
+        if redis_conn is not None:
+            try:
+                redis_conn.hset(self.key, str(user_id), repr(when))
+                self.breaker.record_success()
+                return
+            except REDIS_ERRORS:
+                self.breaker.record_failure()
+                record_fallback('last_login')
+                logger.warning('Redis unavailable; buffering last login for user %s in process', user_id)
+        self._buffer_local({str(user_id): when})
+
+    def _buffer_local(self, pending):
+        with self._lock:
+            for user_id, when in pending.items():
+                if when > self._buffer.get(user_id, 0):
+                    self._buffer[user_id] = when
+
+    def _drain(self):
+        with self._lock:
+            pending, self._buffer = self._buffer, {}
+        redis_conn = self._redis()
+        if redis_conn is not None:
+            try:
+                pipe = redis_conn.pipeline(transaction=True)
+                pipe.hgetall(self.key)
+                pipe.delete(self.key)
+                shared = pipe.execute()[0]
+                self.breaker.record_success()
+            except REDIS_ERRORS:
+                self.breaker.record_failure()
+                record_fallback('last_login')
+                logger.warning('Redis unavailable; flushing only this process\'s last logins')
+            else:
+                for user_id, when in shared.items():
+                    user_id, when = user_id.decode(), float(when)
+                    if when > pending.get(user_id, 0):
+                        pending[user_id] = when
+        return pending
+
+    def flush(self):
+        """
+        Write every pending login time to the database.
+
+        Returns:
+            int: The number of users whose login times were flushed.
+        """
+        pending = self._drain()
+        if not pending:
+            return 0
+        rows = sorted((int(user_id), datetime.fromtimestamp(when, tz=timezone.utc)) for user_id, when in pending.items())
+        batch_size = self.config['BATCH_SIZE']
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            try:
+                self._update(batch)
+            except DatabaseError:
+                # Keep what's left for the next flush.
+                self._buffer_local({str(user_id): when.timestamp() for user_id, when in rows[start:]})
+                raise
+        return len(rows)
+
+    def _update(self, rows):
+        connection = connections[router.db_for_write(User)]
+        table = connection.ops.quote_name(User._meta.db_table)
+        if connection.vendor == 'postgresql':
+            values = ', '.join(['(%s::bigint, %s::timestamptz)'] * len(rows))
+            sql = (
+                f'UPDATE {table} AS u SET last_login = v.last_login '
+                f'FROM (VALUES {values}) AS v (id, last_login) '
+                f'WHERE u.id = v.id AND (u.last_login IS NULL OR u.last_login < v.last_login)'
+            )
+            params = [value for row in rows for value in row]
+        else:
+            # Portable equivalent: one UPDATE with a CASE over the batch.
+            cases = ' '.join(['WHEN %s THEN %s'] * len(rows))
+            placeholders = ', '.join(['%s'] * len(rows))
+            new_value = f'CASE id {cases} END'
+            sql = (
+                f'UPDATE {table} SET last_login = {new_value} '
+                f'WHERE id IN ({placeholders}) AND (last_login IS NULL OR last_login < {new_value})'
+            )
+            params = [
+                connection.ops.adapt_datetimefield_value(value) if isinstance(value, datetime) else value
+                for row in rows for value in row
+            ]
+            params = params + [row[0] for row in rows] + params
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def _ensure_flusher(self):
+        # Like the hashing pool, each forked worker needs its own thread.
+        interval = self.config['FLUSH_INTERVAL']
+        if not interval or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        thread = threading.Thread(target=self._run_flusher, args=(interval,), name='last-login-flusher', daemon=True)
+        thread.start()
+
+    def _run_flusher(self, interval):
+        atexit.register(self._flush_quietly)
+        while True:
+            time.sleep(interval)
+            self._flush_quietly()
+            connections.close_all()
+
+    def _flush_quietly(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Failed to flush last login times')
+
+
+last_login_tracker = LastLoginTracker()
+
+
+def record_login(sender, user, **kwargs):
+    """``user_logged_in`` receiver that replaces Django's ``update_last_login``."""
+    last_login_tracker.record(user.pk)
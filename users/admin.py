@@ -1,3 +1,103 @@
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import Q
 
-# Register your models here.
+from core.db.routers import primary_pins
+
+from .generations import token_generations
+from .models import User, UserManager
+from .pagination import estimate_count, paginate
+from .profile_cache import profile_cache
+
+
+CURSOR_VAR = 'cursor'
+
+
+class KeysetChangeList(ChangeList):
+    """
+    A changelist paged with users.pagination: the previous/next links carry
+    a cursor instead of a page number, so every page costs the same, and the
+    total is estimated on large tables instead of counted.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        self.cursor = request.GET.get(CURSOR_VAR)
+        super().__init__(request, *args, **kwargs)
+        # Keep the search form from carrying the cursor into a new search.
+        self.params.pop(CURSOR_VAR, None)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # Sorting and filtering start again from the first page.
+        return super().get_query_string(new_params, [*(remove or ()), CURSOR_VAR])
+
+    def get_results(self, request):
+        try:
+            page = paginate(self.queryset, self.cursor, self.list_per_page)
+        except ValueError as e:
+            # A malformed or stale cursor, or an ordering keysets can't follow.
+            raise IncorrectLookupParameters(e) from e
+        self.result_count, self.result_count_exact = estimate_count(self.queryset)
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.result_list = page.rows
+        self.can_show_all = False
+        # There are no page numbers; admin/users/user/pagination.html links
+        # the cursors instead.
+        self.multi_page = False
+        self.paginator = None
+        self.next_url = page.next_cursor and self.get_query_string({CURSOR_VAR: page.next_cursor})
+        self.previous_url = page.previous_cursor and self.get_query_string({CURSOR_VAR: page.previous_cursor})
+
+
+@admin.register(User)
+class UserAdmin(admin.ModelAdmin):
+    list_display = ('email', 'full_name', 'is_active', 'is_staff', 'date_joined', 'last_login')
+    list_filter = ('is_active', 'is_staff')
+    # Columns an index can page through.
+    sortable_by = ('email', 'date_joined')
+    ordering = ('-date_joined',)
+    search_fields = ('email',)
+    search_help_text = 'Start of the email address, or a user id.'
+    show_full_result_count = False
+    fields = (
+        'email', 'full_name', 'is_active', 'is_staff', 'is_admin', 'is_superuser', 'groups', 'user_permissions',
+        'date_joined', 'last_login',
+    )
+    readonly_fields = ('date_joined', 'last_login')
+    filter_horizontal = ('groups', 'user_permissions')
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        # A case-sensitive prefix match can use the email index; the default
+        # icontains search reads the whole table.
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        prefix = Q(email__startswith=UserManager.normalize_email(term))
+        if term.isdigit():
+            return queryset.filter(prefix | Q(id=int(term))), False
+        return queryset.filter(prefix), False
+
+    def has_add_permission(self, request):
+        # Users sign up through the API or import_users; this form can't set
+        # a password.
+        return False
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        primary_pins.pin(obj.id, obj.email)
+        profile_cache.bump(obj.id)
+        changed = set(form.changed_data)
+        if 'is_active' in changed and not obj.is_active or changed & {'is_staff', 'is_superuser'}:
+            # Access tokens carry these flags, so revoke the ones already
+            # issued rather than let them keep the old privileges.
+            token_generations.bump(obj.id)
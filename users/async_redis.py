@@ -0,0 +1,46 @@
+import asyncio
+import weakref
+
+from asgiref.sync import AsyncToSync
+from django.conf import settings
+
+from core.metrics import InstrumentedAsyncRedis
+
+
+# redis.asyncio connections belong to the event loop that opened them.
+_clients = weakref.WeakKeyDictionary()
+
+
+def in_temporary_loop():
+    """
+    Whether the running event loop is one ``async_to_sync`` made for a single
+    call, as it is for every async view served over WSGI. A client opened in
+    it would be dropped with its connections when the call returns, so
+    callers use their synchronous path there instead, whose django-redis
+    pool the process keeps.
+    """
+    return asyncio.get_running_loop() in AsyncToSync.loop_thread_executors
+
+
+def get_async_redis():
+    """
+    Return a ``redis.asyncio`` client for ``REDIS_URL`` bound to the running
+    event loop, or None if Redis isn't configured.
+
+    Async views use this instead of django-redis, whose client is synchronous.
+    It talks to the same database with the same raw keys as
+    ``get_redis_connection()``. Check ``in_temporary_loop()`` first.
+    """
+    if not settings.REDIS_URL:
+        return None
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = InstrumentedAsyncRedis.from_url(
+            settings.REDIS_URL,
+            socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+            socket_timeout=settings.REDIS_TIMEOUT,
+            **settings.REDIS_ASYNC_CONNECTION_POOL_KWARGS,
+        )
+        _clients[loop] = client
+    return client
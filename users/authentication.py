@@ -0,0 +1,151 @@
+import hmac
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.permissions import BasePermission
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from core.db.routers import primary_pins
+
+from .tokens import USER_CLAIMS_VERSION, USER_CLAIMS_VERSION_CLAIM, check_revocation
+
+
+class ClaimsUser(TokenUser):
+    """
+    A request.user built from access-token claims.
+
+    Reading the fields embedded by ``users.tokens.add_user_claims`` costs
+    nothing; anything else (or ``instance``) loads the ``User`` row on first
+    use and caches it for the rest of the request.
+    """
+
+    @cached_property
+    def id(self):
+        return int(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def email(self):
+        return self.token.get('email', '')
+
+    @cached_property
+    def username(self):
+        return self.email
+
+    @cached_property
+    def full_name(self):
+        return self.token.get('full_name', '')
+
+    @cached_property
+    def is_active(self):
+        return self.token.get('is_active', False)
+
+    @cached_property
+    def instance(self):
+        User = get_user_model()
+        primary_pins.check(self.id)
+        try:
+            return User.objects.get(**{api_settings.USER_ID_FIELD: self.id})
+        except User.DoesNotExist as e:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found') from e
+
+    def __str__(self):
+        return self.email
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self.instance, attr)
+
+
+def get_model_user(user):
+    """
+    Return the ``User`` row behind ``user``, loading it if ``user`` is a
+    ``ClaimsUser``.
+    """
+    return user.instance if isinstance(user, ClaimsUser) else user
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that builds request.user from the token's claims
+    instead of fetching the user row on every request.
+
+    Tokens issued before the claims were embedded (or with a different claims
+    version) fall back to simplejwt's database lookup. Revoked tokens are
+    rejected either way.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            check_revocation(validated_token)
+        except TokenError as e:
+            raise AuthenticationFailed(e.args[0], code='token_revoked') from e
+
+        if validated_token.get(USER_CLAIMS_VERSION_CLAIM) != USER_CLAIMS_VERSION:
+            primary_pins.check(validated_token.get(api_settings.USER_ID_CLAIM))
+            return super().get_user(validated_token)
+
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        user = api_settings.TOKEN_USER_CLASS(validated_token)
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
+
+
+class ServicePrincipal:
+    """request.user for a request authenticated with a service key."""
+
+    is_authenticated = True
+    is_anonymous = False
+    is_active = True
+    is_staff = False
+    id = pk = None
+
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return f'service:{self.name}'
+
+
+class ServiceKeyAuthentication(BaseAuthentication):
+    """
+    Authenticates other services with ``Authorization: Service <key>``,
+    where the key is one of ``SERVICE_API_KEYS``.
+    """
+
+    keyword = 'Service'
+
+    def authenticate(self, request):
+        header = get_authorization_header(request).split()
+        if not header or header[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(header) != 2:
+            raise AuthenticationFailed(_('Invalid service key header.'), code='bad_authorization_header')
+        name = None
+        # Compare against every key so the time taken doesn't depend on which
+        # one matched.
+        for candidate, key in settings.SERVICE_API_KEYS.items():
+            if hmac.compare_digest(header[1], key.encode()):
+                name = candidate
+        if name is None:
+            raise AuthenticationFailed(_('Invalid service key.'), code='invalid_service_key')
+        return ServicePrincipal(name), None
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+
+class IsService(BasePermission):
+    """Allows only requests authenticated with a service key."""
+
+    def has_permission(self, request, view):
+        return isinstance(request.user, ServicePrincipal)
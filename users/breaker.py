@@ -0,0 +1,56 @@
+import threading
+import time
+
+from django.conf import settings
+
+
+class CircuitBreaker:
+    """
+    Remembers that a dependency is down so callers can skip it instead of
+    paying a connection timeout on every request.
+
+    After ``FAILURE_THRESHOLD`` consecutive failures the breaker opens and
+    ``allow()`` returns False. Once ``RESET_TIMEOUT`` seconds have passed a
+    single trial call is let through; success closes the breaker again,
+    failure re-opens it for another timeout. State is per process.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def config(self):
+        return settings.CIRCUIT_BREAKERS[self.name]
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.config['RESET_TIMEOUT']:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.config['FAILURE_THRESHOLD']:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+redis_breaker = CircuitBreaker('redis')
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Warning, register
+from rest_framework_simplejwt.settings import api_settings
+
+
+@register()
+def check_shared_token_store(app_configs, **kwargs):
+    """Refresh rotation needs a cache that every worker shares."""
+    if api_settings.ROTATE_REFRESH_TOKENS and isinstance(caches[settings.REFRESH_TOKEN_STORE['CACHE']], LocMemCache):
+        return [Warning(
+            'Refresh token rotation is on with a per-process cache.',
+            hint='With more than one worker, refreshes handled by another worker are taken for replays and log '
+                 'users out. Set REDIS_URL, or REFRESH_TOKEN_ROTATION=False.',
+            id='users.W001',
+        )]
+    return []
@@ -0,0 +1,22 @@
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class ServiceUnavailable(APIException):
+    """
+    A dependency is overloaded or down. Views report these as-is instead of
+    folding them into a 400.
+    """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Service temporarily unavailable. Please try again shortly.'
+    default_code = 'service_unavailable'
+
+
+class HashingPoolSaturated(ServiceUnavailable):
+    default_detail = 'Server is busy. Please try again shortly.'
+    default_code = 'hashing_pool_saturated'
+
+
+class TokenStoreUnavailable(ServiceUnavailable):
+    default_detail = 'Token store unavailable. Please try again shortly.'
+    default_code = 'token_store_unavailable'
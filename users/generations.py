@@ -0,0 +1,119 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from core.metrics import record_fallback
+
+from .exceptions import TokenStoreUnavailable
+from .refresh_store import STORE_ERRORS
+
+
+logger = logging.getLogger(__name__)
+
+GENERATION_CLAIM = 'gen'
+
+
+class TokenGenerationStore:
+    """
+    Per-user token generation counters for "log out everywhere".
+
+    Tokens embed the user's generation at issue time. Bumping the counter
+    revokes every token issued before, in one write, no matter how many there
+    are. Counters live in the cache (Redis in production; with the per-process
+    fallback cache a bump reaches only its own worker) and are read through
+    a small per-process cache that is trusted for ``LOCAL_TTL`` seconds, so
+    authenticating a request costs no database query and rarely a network hop.
+    """
+
+    prefix = 'token_gen'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = OrderedDict()
+
+    @property
+    def config(self):
+        return settings.TOKEN_GENERATIONS
+
+    @property
+    def cache(self):
+        return caches[self.config['CACHE']]
+
+    def _key(self, user_id):
+        return f'{self.prefix}:{user_id}'
+
+    def _remember(self, user_id, generation):
+        with self._lock:
+            self._local[user_id] = (generation, time.monotonic())
+            self._local.move_to_end(user_id)
+            while len(self._local) > self.config['LOCAL_MAX_ENTRIES']:
+                self._local.popitem(last=False)
+
+    def current(self, user_id, fresh=False):
+        """
+        Return the user's current generation (0 if never bumped).
+
+        Tokens being issued must read the counter itself (``fresh``): a copy
+        up to ``LOCAL_TTL`` old could miss a bump made on another worker, and
+        the new tokens would be revoked once it expired.
+
+        If the cache is unreachable, checking a token falls back to the last
+        value this process saw, as the refresh store falls back to the
+        revocation filter it last synced: no bump can land during the outage,
+        since it writes the same store. With no value to fall back on (or
+        when ``fresh``) it fails closed, as the refresh store does.
+
+        Raises:
+            TokenStoreUnavailable: If the cache is unreachable and there is
+                nothing to fall back on.
+        """
+        user_id = str(user_id)
+        entry = None if fresh else self._local.get(user_id)
+        if entry is not None and time.monotonic() - entry[1] < self.config['LOCAL_TTL']:
+            return entry[0]
+        try:
+            generation = self.cache.get(self._key(user_id)) or 0
+        except STORE_ERRORS as e:
+            record_fallback('token_generations')
+            if entry is None:
+                raise TokenStoreUnavailable() from e
+            logger.warning('Token store unavailable; using cached token generation for user %s', user_id)
+            return entry[0]
+        self._remember(user_id, generation)
+        return generation
+
+    def bump(self, user_id):
+        """
+        Revoke every token issued to the user so far.
+
+        Returns:
+            int: The new generation.
+        """
+        user_id = str(user_id)
+        key = self._key(user_id)
+        try:
+            # No expiry: tokens issued at the current generation can outlive
+            # any TTL set here, and a counter that expired would restart at 1
+            # and accept the tokens stamped with 1 again.
+            self.cache.add(key, 0, None)
+            generation = self.cache.incr(key)
+        except STORE_ERRORS as e:
+            raise TokenStoreUnavailable() from e
+        self._remember(user_id, generation)
+        return generation
+
+    def check(self, token):
+        """Raise ``TokenError`` if the token predates its user's generation."""
+        user_id = token.get(api_settings.USER_ID_CLAIM)
+        if user_id is not None and token.get(GENERATION_CLAIM, 0) < self.current(user_id):
+            raise TokenError(_('Token has been revoked'))
+
+
+token_generations = TokenGenerationStore()
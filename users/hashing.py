@@ -0,0 +1,223 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+from core.metrics import (
+    HASHING_POOL_REJECTIONS, HASHING_POOL_TASKS, HASHING_POOL_WAIT, PASSWORD_HASH_DURATION, timed)
+
+from .exceptions import HashingPoolSaturated
+
+
+class HashingExecutor:
+    """
+    A bounded thread pool for password hashing.
+
+    PBKDF2 runs inside OpenSSL with the GIL released, so threads are enough to
+    take hashing off the request thread. At most ``max_workers`` hashes run at
+    once and at most ``max_queue`` more may wait; anything beyond that is
+    rejected immediately with ``HashingPoolSaturated`` instead of queueing
+    behind a login burst.
+
+    Queue wait, rejections and the running and queued tasks are exported as
+    ``password_hashing_pool_*`` metrics (core/metrics.py).
+    """
+
+    def __init__(self, name, max_workers, max_queue):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._executor = None
+        self._pid = None
+        self._slots = None
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'cancelled': 0,
+            'rejected': 0,
+            'in_flight': 0,
+            'wait_seconds_total': 0.0,
+            'run_seconds_total': 0.0,
+        }
+
+    def _get_executor(self):
+        # A forked worker inherits the parent's executor object but none of its
+        # threads, so build a fresh pool the first time each process uses it.
+        pid = os.getpid()
+        if self._executor is None or self._pid != pid:
+            with self._lock:
+                if self._executor is None or self._pid != pid:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix=f'hashing-{self.name}',
+                    )
+                    self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queue)
+                    self._pid = pid
+                    self._reset_stats()
+                    HASHING_POOL_TASKS.labels(self.name, 'max').set(self.max_workers + self.max_queue)
+                    self._publish()
+        return self._executor
+
+    def _record(self, key, value=1):
+        with self._lock:
+            self._stats[key] += value
+
+    def _publish(self):
+        # Called with the lock held.
+        in_flight = self._stats['in_flight']
+        HASHING_POOL_TASKS.labels(self.name, 'running').set(min(in_flight, self.max_workers))
+        HASHING_POOL_TASKS.labels(self.name, 'queued').set(max(0, in_flight - self.max_workers))
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedule ``fn`` on the pool and return a ``concurrent.futures.Future``.
+
+        Raises:
+            HashingPoolSaturated: If every worker is busy and the queue is full.
+        """
+        executor = self._get_executor()
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            self._record('rejected')
+            HASHING_POOL_REJECTIONS.labels(self.name).inc()
+            raise HashingPoolSaturated()
+        with self._lock:
+            self._stats['submitted'] += 1
+            self._stats['in_flight'] += 1
+            self._publish()
+        enqueued_at = time.perf_counter()
+        # Carry the caller's context (e.g. per-request timing) onto the pool thread.
+        context = contextvars.copy_context()
+
+        def task():
+            started_at = time.perf_counter()
+            self._record('wait_seconds_total', started_at - enqueued_at)
+            HASHING_POOL_WAIT.labels(self.name).observe(started_at - enqueued_at)
+            self._local.in_pool = True
+            try:
+                return context.run(fn, *args, **kwargs)
+            finally:
+                self._local.in_pool = False
+                self._record('run_seconds_total', time.perf_counter() - started_at)
+
+        def done(future):
+            slots.release()
+            with self._lock:
+                self._stats['in_flight'] -= 1
+                # exception() raises CancelledError for a cancelled future.
+                if future.cancelled():
+                    self._stats['cancelled'] += 1
+                else:
+                    self._stats['failed' if future.exception() else 'completed'] += 1
+                self._publish()
+
+        try:
+            future = executor.submit(task)
+        except RuntimeError:
+            slots.release()
+            with self._lock:
+                self._stats['in_flight'] -= 1
+                self._publish()
+            raise
+        future.add_done_callback(done)
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        """Run ``fn`` on the pool and block until it returns."""
+        if getattr(self._local, 'in_pool', False):
+            # Already on a hashing thread; queueing again could deadlock.
+            return fn(*args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    async def arun(self, fn, *args, **kwargs):
+        """Run ``fn`` on the pool without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def stats(self):
+        """
+        Return a snapshot of this pool's counters.
+
+        Returns:
+            dict: Submitted/completed/failed/cancelled/rejected totals, the number of
+            tasks currently queued or running, and cumulative queue-wait and
+            run time in seconds.
+        """
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot.update(name=self.name, max_workers=self.max_workers, max_queue=self.max_queue)
+        return snapshot
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+            self._executor = None
+            self._pid = None
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name='default'):
+    """
+    Return the named hashing pool, creating it from ``PASSWORD_HASHING_POOLS``.
+    """
+    executor = _executors.get(name)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(name)
+            if executor is None:
+                config = getattr(settings, 'PASSWORD_HASHING_POOLS', {}).get(name, {})
+                executor = HashingExecutor(
+                    name,
+                    max_workers=config.get('MAX_WORKERS', 2),
+                    max_queue=config.get('MAX_QUEUE', 16),
+                )
+                _executors[name] = executor
+    return executor
+
+
+def _make_password(password):
+    with timed(PASSWORD_HASH_DURATION.labels('make'), 'hash'):
+        return hashers.make_password(password)
+
+
+def _verify_password(password, encoded):
+    with timed(PASSWORD_HASH_DURATION.labels('verify'), 'hash'):
+        return hashers.verify_password(password, encoded)
+
+
+def make_password(password):
+    return get_executor().run(_make_password, password)
+
+
+def verify_password(password, encoded):
+    """
+    Verify ``password`` against ``encoded`` on the hashing pool.
+
+    Returns:
+        tuple: ``(is_correct, must_update)`` as returned by Django's
+        ``verify_password``.
+    """
+    return get_executor().run(_verify_password, password, encoded)
+
+
+async def amake_password(password):
+    return await get_executor().arun(_make_password, password)
+
+
+async def averify_password(password, encoded):
+    """See verify_password()."""
+    return await get_executor().arun(_verify_password, password, encoded)
@@ -0,0 +1,316 @@
+"""
+Bulk user import (``manage.py import_users``).
+
+Rows are read from CSV or JSON Lines in batches. Plain-text passwords are
+hashed on a process pool while the previous batch is written. Each batch is
+loaded in one transaction: on PostgreSQL with COPY into a temporary table and
+a single ``INSERT ... ON CONFLICT (email) DO NOTHING``, so the unique index on
+email decides which rows are duplicates. Elsewhere (SQLite in development)
+existing emails are looked up first and the rest go through
+``bulk_create(ignore_conflicts=True)``. Re-running a batch is harmless either
+way, which is what makes the checkpoints safe: a batch that committed just
+before a crash is retried and its rows come back as duplicates.
+"""
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import connection, transaction
+
+from .models import User, UserManager
+
+
+FIELDS = ('email', 'full_name', 'password', 'password_hash', 'is_active')
+TRUE_VALUES = {'1', 'true', 't', 'yes', 'y'}
+FALSE_VALUES = {'0', 'false', 'f', 'no', 'n'}
+DUPLICATE = 'duplicate email'
+# Longer values don't fit their columns, and would fail the whole batch.
+MAX_LENGTHS = {
+    'email': User._meta.get_field('email').max_length,
+    'full_name': User._meta.get_field('full_name').max_length,
+    'password_hash': User._meta.get_field('password').max_length,
+}
+
+
+class InvalidRecord:
+    """An input row that couldn't be read, rejected with ``reason``."""
+
+    __slots__ = ('reason',)
+
+    def __init__(self, reason):
+        self.reason = reason
+
+
+def read_records(stream, fmt):
+    """Yield one dict per input row, or an ``InvalidRecord`` for a JSON line that isn't an object."""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield InvalidRecord(f'invalid JSON: {e}')
+            continue
+        if isinstance(record, dict):
+            yield record
+        else:
+            yield InvalidRecord('not a JSON object')
+
+
+def hash_passwords(passwords):
+    """Hash a chunk of passwords with the default hasher (in a pool process)."""
+    return [make_password(password) for password in passwords]
+
+
+def _init_hashing_process():
+    # Spawned (rather than forked) processes need the settings loaded.
+    import django
+    django.setup()
+
+
+def _parse_bool(value, default=True):
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError(f'not a boolean: {value!r}')
+
+
+class ImportStats:
+    """Counters for an import, saved in the checkpoint so that a resumed run keeps counting."""
+
+    __slots__ = ('records', 'inserted', 'duplicates', 'rejected', 'hash_seconds', 'load_seconds')
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values.get(name, 0))
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Batch:
+    __slots__ = ('end', 'rows', 'pending', 'rejects')
+
+    def __init__(self, end):
+        # end: records consumed once this batch is written; rows: prepared
+        # rows whose password may still be None; pending: (indexes, future)
+        # pairs that fill those passwords in; rejects: (record number, email,
+        # reason), counted when the batch is written.
+        self.end = end
+        self.rows = []
+        self.pending = []
+        self.rejects = []
+
+
+class UserImporter:
+    """
+    Args:
+        batch_size: Rows per transaction.
+        workers: Hashing processes. 0 hashes in this process.
+        checkpoint: Path of a JSON file recording progress after every batch;
+            an existing one is resumed from.
+        rejects: Open text file for rejected rows and duplicates (CSV of
+            record number, email, reason), or None.
+        progress: Called with the ``ImportStats`` after every batch.
+    """
+
+    def __init__(self, batch_size=1000, workers=None, checkpoint=None, rejects=None, progress=None):
+        self.batch_size = batch_size
+        self.workers = os.cpu_count() if workers is None else workers
+        self.checkpoint = checkpoint
+        self.rejects = csv.writer(rejects) if rejects is not None else None
+        self.progress = progress
+        self.stats = ImportStats()
+        self.resumed_from = 0
+        self._executor = None
+
+    def run(self, records, source):
+        """
+        Import ``records`` (dicts with the keys in FIELDS), skipping those
+        already recorded in the checkpoint for ``source``.
+
+        Returns:
+            ImportStats: Totals, including any resumed run.
+        """
+        position = self.resumed_from = self._resume(source)
+        records = iter(records)
+        for _ in range(position):
+            if next(records, None) is None:
+                break
+        pool = ProcessPoolExecutor(self.workers, initializer=_init_hashing_process) if self.workers else None
+        with pool or nullcontext():
+            self._executor = pool
+            previous = None
+            while True:
+                chunk = [record for _, record in zip(range(self.batch_size), records)]
+                if not chunk:
+                    break
+                # Hash this batch while the previous one is written.
+                batch = self._prepare(chunk, position)
+                position = batch.end
+                if previous is not None:
+                    self._write(previous, source)
+                previous = batch
+            if previous is not None:
+                self._write(previous, source)
+        return self.stats
+
+    def _resume(self, source):
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return 0
+        with open(self.checkpoint) as f:
+            state = json.load(f)
+        if state['source'] != source:
+            raise ValueError(f'Checkpoint {self.checkpoint} is for {state["source"]}, not {source}.')
+        self.stats = ImportStats(**state['stats'])
+        return self.stats.records
+
+    def _save_checkpoint(self, source):
+        if not self.checkpoint:
+            return
+        temporary = f'{self.checkpoint}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'source': source, 'stats': self.stats.as_dict()}, f)
+        os.replace(temporary, self.checkpoint)
+
+    def _prepare(self, chunk, position):
+        batch = Batch(position + len(chunk))
+        rows = batch.rows
+        plain = []
+        seen = set()
+        for number, record in enumerate(chunk, start=position + 1):
+            if isinstance(record, InvalidRecord):
+                batch.rejects.append((number, '', record.reason))
+                continue
+            email = UserManager.normalize_email(str(record.get('email') or ''))
+            try:
+                validate_email(email)
+                is_active = _parse_bool(record.get('is_active'))
+            except (ValidationError, ValueError) as e:
+                batch.rejects.append((number, email, getattr(e, 'message', None) or str(e)))
+                continue
+            full_name = str(record.get('full_name') or '')
+            encoded = str(record.get('password_hash') or '')
+            too_long = [name for name, value in (('email', email), ('full_name', full_name), ('password_hash', encoded))
+                        if len(value) > MAX_LENGTHS[name]]
+            if too_long:
+                batch.rejects.append((number, email, f'{too_long[0]} longer than {MAX_LENGTHS[too_long[0]]} characters'))
+                continue
+            if encoded:
+                try:
+                    identify_hasher(encoded)
+                except ValueError:
+                    batch.rejects.append((number, email, 'unrecognized password hash'))
+                    continue
+            elif not record.get('password'):
+                batch.rejects.append((number, email, 'no password or password_hash'))
+                continue
+            if email in seen:
+                batch.rejects.append((number, email, DUPLICATE))
+                continue
+            seen.add(email)
+            if not encoded:
+                plain.append((len(rows), record['password']))
+            rows.append([number, email, full_name, encoded, is_active])
+
+        if plain and self._executor is not None:
+            size = -(-len(plain) // self.workers)
+            for i in range(0, len(plain), size):
+                part = plain[i:i + size]
+                future = self._executor.submit(hash_passwords, [password for _, password in part])
+                batch.pending.append(([index for index, _ in part], future))
+        elif plain:
+            started = time.perf_counter()
+            hashed = hash_passwords([password for _, password in plain])
+            self.stats.hash_seconds += time.perf_counter() - started
+            for (index, _), encoded in zip(plain, hashed):
+                rows[index][3] = encoded
+        return batch
+
+    def _write(self, batch, source):
+        started = time.perf_counter()
+        for indexes, future in batch.pending:
+            for index, encoded in zip(indexes, future.result()):
+                batch.rows[index][3] = encoded
+        loading = time.perf_counter()
+        self.stats.hash_seconds += loading - started
+
+        if batch.rows:
+            with transaction.atomic():
+                if connection.vendor == 'postgresql':
+                    inserted = self._copy(batch.rows)
+                else:
+                    inserted = self._bulk_create(batch.rows)
+            batch.rejects += [(number, email, DUPLICATE) for number, email, *_ in batch.rows if email not in inserted]
+            self.stats.inserted += len(inserted)
+        for reject in sorted(batch.rejects):
+            if reject[2] == DUPLICATE:
+                self.stats.duplicates += 1
+            else:
+                self.stats.rejected += 1
+            if self.rejects is not None:
+                self.rejects.writerow(reject)
+        self.stats.records = batch.end
+        self.stats.load_seconds += time.perf_counter() - loading
+        self._save_checkpoint(source)
+        if self.progress is not None:
+            self.progress(self.stats)
+
+    def _copy(self, rows):
+        """Load rows with COPY; returns the emails that were inserted."""
+        table = connection.ops.quote_name(User._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE IF NOT EXISTS import_users_batch ('
+                'email varchar(254), full_name varchar(255), password varchar(128), is_active boolean'
+                ') ON COMMIT DELETE ROWS'
+            )
+            with cursor.copy('COPY import_users_batch (email, full_name, password, is_active) FROM STDIN') as copy:
+                for _, email, full_name, password, is_active in rows:
+                    copy.write_row((email, full_name, password, is_active))
+            cursor.execute(
+                f'INSERT INTO {table} '
+                '(email, full_name, password, is_active, is_staff, is_admin, is_superuser, date_joined) '
+                'SELECT email, full_name, password, is_active, false, false, false, now() '
+                'FROM import_users_batch ON CONFLICT (email) DO NOTHING RETURNING email'
+            )
+            return {email for email, in cursor.fetchall()}
+
+    def _bulk_create(self, rows):
+        """Load rows with bulk_create; returns the emails that were inserted."""
+        emails = [row[1] for row in rows]
+        existing = set(User.objects.filter(email__in=emails).values_list('email', flat=True))
+        User.objects.bulk_create(
+            [User(email=email, full_name=full_name, password=password, is_active=is_active)
+             for _, email, full_name, password, is_active in rows if email not in existing],
+            ignore_conflicts=True,
+        )
+        return set(emails) - existing
+
+
+def open_input(path, fmt=None):
+    """
+    Returns:
+        tuple: ``(stream, format)``; ``-`` is stdin.
+    """
+    if fmt is None:
+        fmt = 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+    if path == '-':
+        return sys.stdin, fmt
+    return open(path, newline='', encoding='utf-8'), fmt
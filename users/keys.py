@@ -0,0 +1,250 @@
+import hashlib
+import json
+from functools import cached_property
+from pathlib import Path
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from jwt.algorithms import ECAlgorithm, OKPAlgorithm, RSAAlgorithm
+from rest_framework_simplejwt import state
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.exceptions import TokenBackendError, TokenBackendExpiredToken
+from rest_framework_simplejwt.settings import api_settings
+
+from core.metrics import JWT_DURATION, timed
+
+
+PRIVATE_KEY_SUFFIX = '.pem'
+PUBLIC_KEY_SUFFIX = '.pub.pem'
+
+
+def algorithm_for_key(key):
+    """
+    Pick the JWS algorithm for a key.
+
+    Args:
+        key: A cryptography private or public key.
+
+    Returns:
+        str: ``RS256``, ``ES256`` or ``EdDSA``.
+    """
+    if isinstance(key, (rsa.RSAPrivateKey, rsa.RSAPublicKey)):
+        return 'RS256'
+    if isinstance(key, (ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey)):
+        return 'ES256'
+    if isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+        return 'EdDSA'
+    raise ValueError(f'Unsupported signing key type: {type(key).__name__}')
+
+
+class SigningKey:
+    """
+    One ``kid``-tagged entry of the key ring. ``private_key`` is None for
+    retired keys that are kept only to verify tokens still in circulation.
+    """
+
+    _jwk_encoders = {
+        'RS256': RSAAlgorithm,
+        'ES256': ECAlgorithm,
+        'EdDSA': OKPAlgorithm,
+    }
+
+    def __init__(self, kid, public_key, private_key=None):
+        self.kid = kid
+        self.public_key = public_key
+        self.private_key = private_key
+        self.algorithm = algorithm_for_key(public_key)
+
+    def to_jwk(self):
+        jwk = self._jwk_encoders[self.algorithm].to_jwk(self.public_key, as_dict=True)
+        jwk.update(kid=self.kid, alg=self.algorithm, use='sig')
+        return jwk
+
+
+class KeyRing:
+    """
+    The set of keys tokens may be signed or verified with. New tokens are
+    signed with the active key; any key in the ring verifies tokens whose
+    header carries its ``kid``.
+    """
+
+    def __init__(self, keys, active_kid=None):
+        self.keys = {key.kid: key for key in keys}
+        signing_kids = sorted(kid for kid, key in self.keys.items() if key.private_key is not None)
+        if active_kid is None and signing_kids:
+            active_kid = signing_kids[-1]
+        if active_kid not in signing_kids:
+            raise ValueError(f'No private key for active kid {active_kid!r}')
+        self.active = self.keys[active_kid]
+
+    @classmethod
+    def from_directory(cls, path, active_kid=None):
+        """
+        Load every key in ``path``. ``<kid>.pem`` files hold private keys and
+        ``<kid>.pub.pem`` files hold public keys of retired signing keys.
+        """
+        keys = []
+        for file in sorted(Path(path).glob(f'*{PRIVATE_KEY_SUFFIX}')):
+            data = file.read_bytes()
+            if file.name.endswith(PUBLIC_KEY_SUFFIX):
+                kid = file.name[:-len(PUBLIC_KEY_SUFFIX)]
+                keys.append(SigningKey(kid, serialization.load_pem_public_key(data)))
+            else:
+                kid = file.name[:-len(PRIVATE_KEY_SUFFIX)]
+                private_key = serialization.load_pem_private_key(data, password=None)
+                keys.append(SigningKey(kid, private_key.public_key(), private_key))
+        return cls(keys, active_kid)
+
+    def get(self, kid):
+        return self.keys.get(kid)
+
+    @cached_property
+    def jwks(self):
+        """
+        The public JWKS document and its ETag, built once per process.
+
+        Returns:
+            tuple: ``(body_bytes, etag)``.
+        """
+        document = {'keys': [key.to_jwk() for key in self.keys.values()]}
+        body = json.dumps(document, separators=(',', ':'), sort_keys=True).encode()
+        return body, hashlib.sha256(body).hexdigest()[:32]
+
+
+class KeyRingTokenBackend(TokenBackend):
+    """
+    simplejwt token backend that signs with the key ring's active key, stamps
+    its ``kid`` into the JOSE header, and verifies by looking the ``kid`` up.
+    Keys are parsed once when the ring is loaded, not per token.
+
+    Tokens without a ``kid``, signed before the switch to the key ring, are
+    verified by ``legacy_backend`` if one is given and rejected otherwise.
+    """
+
+    def __init__(self, key_ring, legacy_backend=None, **kwargs):
+        super().__init__(key_ring.active.algorithm, **kwargs)
+        self.key_ring = key_ring
+        self.legacy_backend = legacy_backend
+
+    def encode(self, payload):
+        jwt_payload = payload.copy()
+        if self.audience is not None:
+            jwt_payload['aud'] = self.audience
+        if self.issuer is not None:
+            jwt_payload['iss'] = self.issuer
+
+        active = self.key_ring.active
+        return jwt.encode(
+            jwt_payload,
+            active.private_key,
+            algorithm=active.algorithm,
+            headers={'kid': active.kid},
+            json_encoder=self.json_encoder,
+        )
+
+    @staticmethod
+    def get_kid(token):
+        try:
+            return jwt.get_unverified_header(token).get('kid')
+        except jwt.InvalidTokenError as e:
+            raise TokenBackendError(_('Token is invalid')) from e
+
+    def get_signing_key(self, token):
+        key = self.key_ring.get(self.get_kid(token))
+        if key is None:
+            raise TokenBackendError(_('Token is invalid'))
+        return key
+
+    def decode(self, token, verify=True):
+        if self.legacy_backend is not None and self.get_kid(token) is None:
+            return self.legacy_backend.decode(token, verify)
+        key = self.get_signing_key(token)
+        try:
+            return jwt.decode(
+                token,
+                key.public_key,
+                algorithms=[key.algorithm],
+                audience=self.audience,
+                issuer=self.issuer,
+                leeway=self.get_leeway(),
+                options={
+                    'verify_aud': self.audience is not None,
+                    'verify_signature': verify,
+                },
+            )
+        except jwt.ExpiredSignatureError as e:
+            raise TokenBackendExpiredToken(_('Token is expired')) from e
+        except jwt.InvalidTokenError as e:
+            raise TokenBackendError(_('Token is invalid')) from e
+
+
+class TimedTokenBackend:
+    """
+    Wraps a simplejwt token backend and records how long signing and
+    verification take. Everything else is delegated to the wrapped backend.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def encode(self, payload):
+        with timed(JWT_DURATION.labels('sign'), 'jwt'):
+            return self.backend.encode(payload)
+
+    def decode(self, token, verify=True):
+        with timed(JWT_DURATION.labels('verify'), 'jwt'):
+            return self.backend.decode(token, verify)
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+
+_key_ring = None
+
+
+def get_key_ring():
+    """
+    Return the key ring configured by ``JWT_KEYS_DIR``/``JWT_ACTIVE_KID``, or
+    None when tokens are still signed with the shared HMAC secret.
+    """
+    global _key_ring
+    if _key_ring is None and getattr(settings, 'JWT_KEYS_DIR', None):
+        _key_ring = KeyRing.from_directory(settings.JWT_KEYS_DIR, getattr(settings, 'JWT_ACTIVE_KID', None))
+    return _key_ring
+
+
+def install_token_backend():
+    """
+    Make simplejwt sign and verify with the key ring, if one is configured
+    (still verifying HS256 tokens while ``JWT_ACCEPT_HS256`` is on), and
+    time both. Every simplejwt token class resolves
+    ``rest_framework_simplejwt.state.token_backend`` lazily, so replacing it
+    once at startup covers login, refresh and verify alike.
+    """
+    key_ring = get_key_ring()
+    if key_ring is not None:
+        legacy_backend = None
+        if getattr(settings, 'JWT_ACCEPT_HS256', False):
+            legacy_backend = TokenBackend(
+                'HS256',
+                api_settings.SIGNING_KEY,
+                audience=api_settings.AUDIENCE,
+                issuer=api_settings.ISSUER,
+                leeway=api_settings.LEEWAY,
+                json_encoder=api_settings.JSON_ENCODER,
+            )
+        backend = KeyRingTokenBackend(
+            key_ring,
+            legacy_backend,
+            audience=api_settings.AUDIENCE,
+            issuer=api_settings.ISSUER,
+            leeway=api_settings.LEEWAY,
+            json_encoder=api_settings.JSON_ENCODER,
+        )
+    else:
+        backend = state.token_backend
+    if not isinstance(backend, TimedTokenBackend):
+        state.token_backend = TimedTokenBackend(backend)
@@ -0,0 +1,43 @@
+import itertools
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users.password_list import RUN_SIZE, build_password_list, read_passwords, read_sha1_hashes
+from users.validators import DJANGO_PASSWORD_LIST_PATH
+
+
+class Command(BaseCommand):
+    help = (
+        'Build the password list that users.validators.CommonPasswordValidator maps, at '
+        'COMMON_PASSWORDS_PATH, from lists of passwords and of SHA-1 password hashes (such as '
+        'the Have I Been Pwned dump). Without inputs, Django\'s list of common passwords is used.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('passwords', nargs='*', help='Files of passwords, one per line (optionally gzipped).')
+        parser.add_argument('--sha1', action='append', default=[], metavar='PATH',
+                            help='A file of SHA-1 hex digests, one per line, optionally followed by ":count". '
+                                 'May be repeated.')
+        parser.add_argument('--output', default=settings.COMMON_PASSWORDS_PATH,
+                            help='File to write (default: COMMON_PASSWORDS_PATH).')
+        parser.add_argument('--run-size', type=int, default=RUN_SIZE,
+                            help='Hashes sorted in memory at a time, about 36 bytes each.')
+
+    def handle(self, *args, **options):
+        passwords = options['passwords']
+        if not passwords and not options['sha1']:
+            passwords = [DJANGO_PASSWORD_LIST_PATH]
+        hashes = itertools.chain(*map(read_passwords, passwords), *map(read_sha1_hashes, options['sha1']))
+        started = time.perf_counter()
+        try:
+            count = build_password_list(hashes, options['output'], run_size=options['run_size'],
+                                        as_typed=bool(options['sha1']))
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+        size = os.path.getsize(options['output'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {count} passwords to {options["output"]} ({size / 2 ** 20:.1f} MiB) '
+            f'in {time.perf_counter() - started:.1f}s'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from users.activity import last_login_tracker
+
+
+class Command(BaseCommand):
+    help = 'Write pending login times to User.last_login.'
+
+    def handle(self, *args, **options):
+        count = last_login_tracker.flush()
+        self.stdout.write(self.style.SUCCESS(f'Updated last_login for {count} users'))
@@ -0,0 +1,33 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+from drf_spectacular.settings import spectacular_settings
+
+from core.schema import SCHEMA_FILES
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate the OpenAPI schema into OPENAPI_SCHEMA_DIR. Run it before collectstatic '
+        'so that the schema is served as a hashed static file.'
+    )
+
+    renderers = {
+        'yaml': OpenApiYamlRenderer,
+        'json': OpenApiJsonRenderer,
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', default=settings.OPENAPI_SCHEMA_DIR,
+                            help='Directory to write to (default: OPENAPI_SCHEMA_DIR).')
+
+    def handle(self, *args, **options):
+        generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+        schema = generator.get_schema(request=None, public=True)
+        for fmt, name in SCHEMA_FILES.items():
+            path = Path(options['output_dir']) / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(self.renderers[fmt]().render(schema, renderer_context={}))
+            self.stdout.write(self.style.SUCCESS(f'Wrote {path}'))
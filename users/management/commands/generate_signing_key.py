@@ -0,0 +1,40 @@
+from datetime import date
+from pathlib import Path
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users.keys import PRIVATE_KEY_SUFFIX
+
+
+class Command(BaseCommand):
+    help = 'Generate a kid-tagged JWT signing key in JWT_KEYS_DIR.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kid', help='Key id. Defaults to today\'s date.')
+        parser.add_argument('--algorithm', choices=['RS256', 'EdDSA'], default='EdDSA')
+        parser.add_argument('--directory', default=settings.JWT_KEYS_DIR)
+
+    def handle(self, *args, **options):
+        if not options['directory']:
+            raise CommandError('Set JWT_KEYS_DIR or pass --directory.')
+        kid = options['kid'] or date.today().isoformat()
+        path = Path(options['directory']) / f'{kid}{PRIVATE_KEY_SUFFIX}'
+        if path.exists():
+            raise CommandError(f'{path} already exists.')
+
+        if options['algorithm'] == 'RS256':
+            key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        else:
+            key = ed25519.Ed25519PrivateKey.generate()
+        pem = key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption(),
+        )
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch(mode=0o600)
+        path.write_bytes(pem)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {options["algorithm"]} key {kid} to {path}'))
@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.importer import UserImporter, open_input, read_records
+
+
+class Command(BaseCommand):
+    help = (
+        'Import users from CSV or JSON Lines with the columns email, full_name, password or '
+        'password_hash (in a format Django\'s hashers recognize), and optionally is_active. '
+        'Emails that already exist are skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Input file, or - for stdin.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Input format (default: jsonl for .jsonl/.ndjson files, otherwise csv).')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per transaction.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Password hashing processes; 0 hashes in this process (default: CPU count).')
+        parser.add_argument('--checkpoint',
+                            help='Record progress in this file after every batch, and resume from it if it exists.')
+        parser.add_argument('--rejects', help='Append rejected and duplicate rows to this CSV file.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if options['checkpoint'] and path == '-':
+            raise CommandError("--checkpoint needs an input file; stdin can't be resumed.")
+        stream, fmt = open_input(path, options['format'])
+        rejects = open(options['rejects'], 'a', newline='') if options['rejects'] else None
+        started = time.perf_counter()
+
+        def progress(stats):
+            elapsed = time.perf_counter() - started
+            rate = (stats.records - importer.resumed_from) / elapsed if elapsed else 0
+            self.stderr.write(f'{stats.records} rows, {stats.inserted} inserted ({rate:.0f} rows/s)')
+
+        importer = UserImporter(
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            checkpoint=options['checkpoint'],
+            rejects=rejects,
+            progress=progress if options['verbosity'] > 1 else None,
+        )
+        try:
+            stats = importer.run(read_records(stream, fmt), source=path if path == '-' else os.path.abspath(path))
+        except ValueError as e:
+            raise CommandError(e)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            if rejects is not None:
+                rejects.close()
+
+        elapsed = time.perf_counter() - started
+        processed = stats.records - importer.resumed_from
+        if importer.resumed_from:
+            self.stdout.write(f'Resumed after row {importer.resumed_from}.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {stats.inserted} users from {stats.records} rows: '
+            f'{stats.duplicates} duplicate emails, {stats.rejected} rejected.'
+        ))
+        self.stdout.write(
+            f'{processed} rows in {elapsed:.1f}s ({processed / elapsed if elapsed else 0:.0f} rows/s); '
+            f'waiting on hashing {stats.hash_seconds:.1f}s, writing {stats.load_seconds:.1f}s in total.'
+        )
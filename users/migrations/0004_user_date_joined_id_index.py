@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-17 07:01
+
+from django.db import migrations, models
+
+
+INDEX = models.Index(fields=['date_joined', 'id'], name='users_user_joined_id_idx')
+
+
+# On PostgreSQL the index is built CONCURRENTLY, so a large users table
+# stays writable while it builds.
+def add_index(apps, schema_editor):
+    model = apps.get_model('users', 'User')
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.add_index(model, INDEX, concurrently=True)
+    else:
+        schema_editor.add_index(model, INDEX)
+
+
+def remove_index(apps, schema_editor):
+    model = apps.get_model('users', 'User')
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.remove_index(model, INDEX, concurrently=True)
+    else:
+        schema_editor.remove_index(model, INDEX)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('users', '0003_last_login_without_auto_now'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[migrations.AddIndex(model_name='user', index=INDEX)],
+            database_operations=[migrations.RunPython(add_index, remove_index)],
+        ),
+    ]
@@ -2,6 +2,8 @@ from django.db import models
 from django.contrib.auth.models import (
     AbstractBaseUser, BaseUserManager, PermissionsMixin)
 
+from . import hashing
+
 
 # Create your models here.
 
@@ -20,6 +22,20 @@ class UserManager(BaseUserManager):
         user.save(using=self._db)
         return user
 
+    async def acreate_user(self, email, password=None, **extra_fields):
+        if not email:
+            raise ValueError('Users must have an email address')
+        if not password:
+            raise ValueError('Users must have a password')
+        extra_fields.pop('email', None)
+        user = self.model(
+            email=self.normalize_email(email),
+            **extra_fields
+        )
+        await user.aset_password(password)
+        await user.asave(using=self._db)
+        return user
+
     def create_superuser(self, email, password):
         user = self.create_user(
             email=self.normalize_email(email),
@@ -54,15 +70,58 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_admin = models.BooleanField(default=False)
     is_superuser = models.BooleanField(default=False)
     date_joined = models.DateTimeField(auto_now_add=True)
-    last_login = models.DateTimeField(auto_now=True)
+    # Written in batches by users.activity, not on every save.
+    last_login = models.DateTimeField(null=True, blank=True)
 
     USERNAME_FIELD = 'email'
     EMAIL_FIELD = 'email'
 
     objects = UserManager()
 
+    class Meta:
+        indexes = [
+            # Keyset pagination by join date (users.pagination). Email prefix
+            # search uses the unique index's varchar_pattern_ops twin that
+            # Django adds on PostgreSQL.
+            models.Index(fields=['date_joined', 'id'], name='users_user_joined_id_idx'),
+        ]
+
     def clean(self):
         setattr(self, self.USERNAME_FIELD, UserManager.normalize_email(self.get_username()))
 
+    # Password hashing goes through the bounded pool in users.hashing so a
+    # burst of logins can't tie up every request thread.
+    def set_password(self, raw_password):
+        self.password = hashing.make_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        is_correct, must_update = hashing.verify_password(raw_password, self.password)
+        if is_correct and must_update:
+            self.set_password(raw_password)
+            # Password hash upgrades shouldn't be considered password changes.
+            self._password = None
+            self.save(update_fields=['password'])
+        return is_correct
+
+    async def aset_password(self, raw_password):
+        self.password = await hashing.amake_password(raw_password)
+        self._password = raw_password
+
+    async def acheck_password(self, raw_password):
+        is_correct, must_update = await hashing.averify_password(raw_password, self.password)
+        if is_correct and must_update:
+            await self.aset_password(raw_password)
+            self._password = None
+            await self.asave(update_fields=['password'])
+        return is_correct
 
 
+class PasswordResetToken(models.Model):
+    """
+    Database fallback for password reset tokens, used when Redis is not
+    configured or is down (see users.reset_tokens).
+    """
+    token_hash = models.CharField(max_length=64, primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    expires_at = models.DateTimeField(db_index=True)
@@ -0,0 +1,254 @@
+"""
+Keyset pagination for large user tables, shared by ``UserAdmin`` and
+``GET /api/auth/users/``.
+
+OFFSET pagination reads and discards every row before the page, and the
+page count needs a ``COUNT(*)``; both grow with the table. Here a page
+continues from the sort key of the last row seen instead: the cursor
+carries that key, and the next page is ``WHERE (date_joined, id) <
+(cursor) ORDER BY date_joined DESC, id DESC LIMIT n``, one index range scan
+however deep the page. Counts are estimated from the planner's statistics.
+
+Orderings are made total by ending them with the primary key (or another
+unique column), in the direction of the first column so that a two-column
+index such as ``(date_joined, id)`` can serve them.
+"""
+import base64
+import json
+from datetime import date, time
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import F, Q
+from django.db.models.expressions import OrderBy
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+# Below this many rows (by the estimate) the exact count is cheap enough.
+EXACT_COUNT_BELOW = 10000
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+    __slots__ = ('rows', 'next_cursor', 'previous_cursor')
+
+    def __init__(self, rows, next_cursor, previous_cursor):
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+
+def keyset_ordering(queryset):
+    """
+    The queryset's ordering as ``[(field name, descending), ...]``, cut or
+    extended to end on a unique column.
+
+    Raises:
+        ValueError: If the ordering uses an expression, a related or
+            nullable field.
+    """
+    opts = queryset.model._meta
+    ordering = []
+    for part in queryset.query.order_by or opts.ordering or ['pk']:
+        if isinstance(part, str):
+            name, descending = part.lstrip('-'), part.startswith('-')
+        elif isinstance(part, OrderBy) and isinstance(part.expression, F):
+            name, descending = part.expression.name, part.descending
+        else:
+            raise ValueError(f'Cannot paginate on {part!r}.')
+        field = opts.pk if name == 'pk' else opts.get_field(name)
+        if field.null or field.is_relation:
+            raise ValueError(f'Cannot paginate on {name}.')
+        if any(field.attname == seen for seen, _ in ordering):
+            continue
+        if field.primary_key and ordering:
+            # Tie-break in the direction of the sort.
+            descending = ordering[0][1]
+        ordering.append((field.attname, descending))
+        if field.unique:
+            return ordering
+    ordering.append((opts.pk.attname, ordering[0][1]))
+    return ordering
+
+
+def _ordering_names(ordering):
+    return [f'-{name}' if descending else name for name, descending in ordering]
+
+
+def encode_cursor(ordering, row, backwards=False):
+    values = [row[name] if isinstance(row, dict) else getattr(row, name) for name, _ in ordering]
+    # Full precision: DjangoJSONEncoder would round datetimes to milliseconds.
+    values = [value.isoformat() if isinstance(value, (date, time)) else value for value in values]
+    payload = {'o': _ordering_names(ordering), 'v': values}
+    if backwards:
+        payload['b'] = 1
+    data = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor, ordering, model):
+    """
+    Returns:
+        tuple: ``(values, backwards)``.
+
+    Raises:
+        InvalidCursor: If the cursor is malformed or was issued for another
+            ordering.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if payload['o'] != _ordering_names(ordering) or len(payload['v']) != len(ordering):
+            raise InvalidCursor('The cursor is for a different ordering.')
+        values = [model._meta.get_field(name).to_python(value) for (name, _), value in zip(ordering, payload['v'])]
+    except InvalidCursor:
+        raise
+    except (ValueError, TypeError, KeyError, ValidationError) as e:
+        # ValueError covers bad base64, UTF-8 and JSON.
+        raise InvalidCursor('Invalid cursor.') from e
+    return values, bool(payload.get('b'))
+
+
+def _after(ordering, values, backwards):
+    """Rows that sort after ``values`` (before, if ``backwards``)."""
+    keyset = Q()
+    equal = {}
+    for (name, descending), value in zip(ordering, values):
+        lookup = 'lt' if descending != backwards else 'gt'
+        keyset |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    # Redundant, but it gives the planner the index range to start from.
+    name, descending = ordering[0]
+    return Q(**{f'{name}__{"lte" if descending != backwards else "gte"}': values[0]}) & keyset
+
+
+def paginate(queryset, cursor, page_size):
+    """
+    One page of ``queryset`` in its (completed) ordering.
+
+    Args:
+        cursor: ``next_cursor`` or ``previous_cursor`` of another page of
+            the same ordering, or None for the first page.
+
+    Returns:
+        KeysetPage: The rows, and cursors for the next and previous pages
+        (None at either end).
+    """
+    ordering = keyset_ordering(queryset)
+    queryset = queryset.order_by(*_ordering_names(ordering))
+    values, backwards = decode_cursor(cursor, ordering, queryset.model) if cursor else (None, False)
+    if values is not None:
+        queryset = queryset.filter(_after(ordering, values, backwards))
+    if backwards:
+        queryset = queryset.reverse()
+    rows = list(queryset[:page_size + 1])
+    more = len(rows) > page_size
+    del rows[page_size:]
+    if backwards:
+        rows.reverse()
+    if not rows:
+        return KeysetPage(rows, None, None)
+    has_next = more if not backwards else values is not None
+    has_previous = more if backwards else values is not None
+    return KeysetPage(
+        rows,
+        encode_cursor(ordering, rows[-1]) if has_next else None,
+        encode_cursor(ordering, rows[0], backwards=True) if has_previous else None,
+    )
+
+
+def estimate_count(queryset):
+    """
+    Count the rows, or estimate them from PostgreSQL's statistics: for the
+    whole table ``pg_class.reltuples`` (kept up to date by autovacuum's
+    ANALYZE), and for a filtered queryset the planner's row estimate.
+
+    Returns:
+        tuple: ``(count, exact)``.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        if not queryset.query.has_filters():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                               [queryset.model._meta.db_table])
+                estimate = cursor.fetchone()[0]
+        else:
+            plan = json.loads(queryset.order_by().explain(format='json'))
+            # A one-element list, which Django may have unwrapped.
+            estimate = (plan[0] if isinstance(plan, list) else plan)['Plan']['Plan Rows']
+        # reltuples is -1 until the table is first analyzed.
+        if estimate >= EXACT_COUNT_BELOW:
+            return int(estimate), False
+    return queryset.count(), True
+
+
+class KeysetPagination(BasePagination):
+    """
+    DRF pagination with the cursors above: ``?cursor=`` is the ``next`` or
+    ``previous`` link of another page and ``?page_size=`` sets the page size.
+    The view's queryset sets the ordering.
+    """
+
+    page_size = 50
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        try:
+            self.page = paginate(queryset, request.query_params.get(self.cursor_query_param),
+                                 self.get_page_size(request))
+        except InvalidCursor as e:
+            raise NotFound(str(e))
+        self.count, self.count_exact = estimate_count(queryset)
+        return self.page.rows
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'count_exact': self.count_exact,
+            'next': self._link(self.page.next_cursor),
+            'previous': self._link(self.page.previous_cursor),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['count', 'count_exact', 'results'],
+            'properties': {
+                'count': {'type': 'integer', 'description': 'Exact, or estimated if count_exact is false.'},
+                'count_exact': {'type': 'boolean'},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {'name': self.cursor_query_param, 'required': False, 'in': 'query',
+             'description': 'The next or previous link of another page.', 'schema': {'type': 'string'}},
+            {'name': self.page_size_query_param, 'required': False, 'in': 'query',
+             'description': f'Results per page (at most {self.max_page_size}).', 'schema': {'type': 'integer'}},
+        ]
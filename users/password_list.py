@@ -0,0 +1,255 @@
+"""
+A prebuilt, memory-mapped set of common or breached passwords
+(``manage.py build_password_list``, read by
+``users.validators.CommonPasswordValidator``).
+
+Django's ``CommonPasswordValidator`` decompresses its list into a Python set
+in every worker. Here the list is a file of sorted 64-bit password hashes,
+the first 8 bytes of the SHA-1 of each password, so breached-password dumps
+published as SHA-1 hashes can be loaded without the passwords. Workers
+``mmap`` the file read-only and share its pages through the page cache, so
+a worker's memory doesn't grow with the list, and opening it reads only the
+header. A lookup is a binary search within one bucket of a prefix index
+(about 16 hashes per bucket), in C via ``bisect`` over a ``memoryview``.
+
+Plain-text lists are stored lowercased and stripped, as Django compares
+them; SHA-1 lists can only be stored as given, and a flag in the header
+tells readers to check the password as typed too.
+
+With 64-bit hashes a password that isn't listed matches by chance with
+probability ``len(list) / 2**64`` (about 5e-13 for ten million passwords).
+
+File layout, little-endian::
+
+    magic (8 bytes) | hash count (u64) | bucket bits (u64) | flags (u64)
+    bucket starts ((2**bits + 1) x u64) | sorted, distinct hashes (count x u64)
+
+Bucket ``b`` holds the hashes whose top ``bits`` bits are ``b``, from
+``starts[b]`` to ``starts[b + 1]``.
+"""
+import array
+import bisect
+import gzip
+import hashlib
+import heapq
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+
+MAGIC = b'PWLIST1\0'
+HEADER = struct.Struct('<8sQQQ')
+# Some hashes are of passwords as typed rather than normalized.
+AS_TYPED = 1
+# Hashes sorted in memory at once while building, about 36 bytes each.
+RUN_SIZE = 5_000_000
+# Aim for this many hashes per bucket.
+BUCKET_SIZE = 16
+
+
+_unpack_key = struct.Struct('>Q').unpack_from
+
+
+def password_hash(password):
+    """The 64-bit key of a password: the first 8 bytes of its SHA-1."""
+    return _unpack_key(hashlib.sha1(password.encode()).digest())[0]
+
+
+def _check_byteorder():
+    # The hashes are read through memoryview.cast('Q'), in native order.
+    if sys.byteorder != 'little':
+        raise ValueError('Password lists can only be read on little-endian machines.')
+
+
+class PasswordList:
+    """
+    A read-only set of password hashes backed by a buffer in the format
+    above, usually a ``mmap`` of the file (see ``open()``).
+
+    ``password_hash(password) in password_list`` tests membership.
+    """
+
+    def __init__(self, buffer):
+        _check_byteorder()
+        if len(buffer) < HEADER.size:
+            raise ValueError('Not a password list: the file is truncated.')
+        magic, count, bits, flags = HEADER.unpack_from(buffer)
+        buckets = (1 << bits) + 1
+        if magic != MAGIC or len(buffer) != HEADER.size + (buckets + count) * 8:
+            raise ValueError('Not a password list, or a truncated one.')
+        view = memoryview(buffer)
+        self._buffer = buffer
+        self._view = view
+        self._starts = view[HEADER.size:HEADER.size + buckets * 8].cast('Q')
+        self._hashes = view[HEADER.size + buckets * 8:].cast('Q')
+        self._shift = 64 - bits
+        self.as_typed = bool(flags & AS_TYPED)
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as f:
+            # The mapping outlives the descriptor, and survives a fork.
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(buffer, 'madvise'):
+            # Lookups touch one or two pages anywhere in the file; reading
+            # ahead would only evict other pages.
+            buffer.madvise(mmap.MADV_RANDOM)
+        return cls(buffer)
+
+    def __contains__(self, key):
+        starts, hashes = self._starts, self._hashes
+        bucket = key >> self._shift
+        end = starts[bucket + 1]
+        i = bisect.bisect_left(hashes, key, starts[bucket], end)
+        return i < end and hashes[i] == key
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def close(self):
+        self._starts.release()
+        self._hashes.release()
+        self._view.release()
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+
+def read_passwords(path):
+    """
+    Yield the hashes of a list of passwords, one per line (gzipped if the
+    name ends in .gz), lowercased and stripped as Django's
+    ``CommonPasswordValidator`` does. Lines that aren't UTF-8 can't match a
+    password and are skipped.
+    """
+    opener = gzip.open if str(path).endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        for line in f:
+            try:
+                password = line.decode().strip().lower()
+            except UnicodeDecodeError:
+                continue
+            if password:
+                yield password_hash(password)
+
+
+def read_sha1_hashes(path):
+    """
+    Yield the keys of a list of SHA-1 password hashes, one hex digest per
+    line, optionally followed by ``:count`` (the Have I Been Pwned format).
+
+    Raises:
+        ValueError: If a line isn't a SHA-1 hex digest.
+    """
+    opener = gzip.open if str(path).endswith('.gz') else open
+    with opener(path, 'rt', encoding='ascii') as f:
+        for number, line in enumerate(f, 1):
+            digest = line.split(':', 1)[0].strip()
+            if not digest:
+                continue
+            if len(digest) != 40:
+                raise ValueError(f'{path}, line {number}: not a SHA-1 hex digest.')
+            yield int(digest[:16], 16)
+
+
+def _spill(run, directory):
+    f = tempfile.TemporaryFile(dir=directory)
+    array.array('Q', run).tofile(f)
+    f.seek(0)
+    return f
+
+
+def _read_run(f, block=65536):
+    while True:
+        keys = array.array('Q')
+        try:
+            keys.fromfile(f, block)
+        except EOFError:
+            # Raised after reading what was left.
+            yield from keys
+            return
+        yield from keys
+
+
+def _sorted_runs(hashes, run_size, directory, spilled):
+    """
+    Sort ``hashes`` in runs of ``run_size``, spilling all but the last to
+    disk.
+
+    Returns:
+        tuple: ``(runs, total)``, the runs as iterables of sorted keys.
+    """
+    run = []
+    total = 0
+    for key in hashes:
+        run.append(key)
+        if len(run) >= run_size:
+            run.sort()
+            spilled.append(_spill(run, directory))
+            total += len(run)
+            run = []
+    run.sort()
+    return [*map(_read_run, spilled), run], total + len(run)
+
+
+def _distinct(keys):
+    previous = None
+    for key in keys:
+        if key != previous:
+            yield key
+            previous = key
+
+
+def build_password_list(hashes, path, run_size=RUN_SIZE, as_typed=False):
+    """
+    Write the distinct ``hashes`` (from ``read_passwords()`` and
+    ``read_sha1_hashes()``) to ``path`` as a password list, sorting up to
+    ``run_size`` of them in memory at a time. ``as_typed`` marks a list with
+    hashes from ``read_sha1_hashes()``.
+
+    The file is written beside ``path`` and renamed over it, so workers that
+    have the old list mapped keep reading it until they reopen.
+
+    Returns:
+        int: The number of distinct hashes written.
+    """
+    _check_byteorder()
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    spilled = []
+    try:
+        runs, total = _sorted_runs(hashes, run_size, directory, spilled)
+        # Sized for the total; duplicates only make the buckets smaller.
+        bits = min(28, (total // BUCKET_SIZE).bit_length())
+        counts = array.array('Q', bytes(((1 << bits) + 1) * 8))
+        shift = 64 - bits
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.password-list-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.seek(HEADER.size + len(counts) * 8)
+                count = 0
+                batch = array.array('Q')
+                for key in _distinct(heapq.merge(*runs)):
+                    counts[(key >> shift) + 1] += 1
+                    batch.append(key)
+                    if len(batch) >= 65536:
+                        batch.tofile(f)
+                        count += len(batch)
+                        del batch[:]
+                batch.tofile(f)
+                count += len(batch)
+                for i in range(1, len(counts)):
+                    counts[i] += counts[i - 1]
+                f.seek(0)
+                f.write(HEADER.pack(MAGIC, count, bits, AS_TYPED if as_typed else 0))
+                counts.tofile(f)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    finally:
+        for f in spilled:
+            f.close()
+    return count
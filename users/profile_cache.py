@@ -0,0 +1,184 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+
+from core.metrics import record_fallback
+
+from .refresh_store import STORE_ERRORS
+
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileCache:
+    """
+    Serialized profiles keyed by user id and profile version.
+
+    Each user has a version counter in the cache (Redis in production) that
+    ``bump()`` increments whenever their profile changes; entries are stored
+    under ``profile:<id>:<version>`` along with a strong ETag, so a bump makes
+    older entries unreachable without deleting them. A per-process LRU in
+    front is trusted for ``LOCAL_TTL`` seconds, so polling a profile usually
+    costs neither a network hop nor serialization. Other processes see a bump
+    within ``LOCAL_TTL``.
+    """
+
+    prefix = 'profile'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = OrderedDict()
+
+    @property
+    def config(self):
+        return settings.PROFILE_CACHE
+
+    @property
+    def cache(self):
+        return caches[self.config['CACHE']]
+
+    def _version_key(self, user_id):
+        return f'{self.prefix}:version:{user_id}'
+
+    def _entry_key(self, user_id, version):
+        return f'{self.prefix}:{user_id}:{version}'
+
+    @staticmethod
+    def etag(data):
+        body = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True, separators=(',', ':'))
+        return '"%s"' % hashlib.sha256(body.encode()).hexdigest()[:32]
+
+    def _remember(self, user_id, entry):
+        with self._lock:
+            self._local[user_id] = (entry, time.monotonic())
+            self._local.move_to_end(user_id)
+            while len(self._local) > self.config['LOCAL_MAX_ENTRIES']:
+                self._local.popitem(last=False)
+
+    def get(self, user_id, build):
+        """
+        Return a user's cached profile, building and caching it on a miss.
+
+        Args:
+            user_id: The user's ID.
+            build: Called as ``build(changed)`` on a miss and must return the
+                serialized profile. ``changed`` is True if the profile has been
+                updated since the cache started tracking it, i.e. values
+                copied into older tokens may be stale.
+
+        Returns:
+            tuple: ``(etag, data)``.
+        """
+        user_id = str(user_id)
+        local = self._local.get(user_id)
+        if local is not None and time.monotonic() - local[1] < self.config['LOCAL_TTL']:
+            return local[0][1:]
+        try:
+            version = self.cache.get(self._version_key(user_id)) or 0
+            entry = self.cache.get(self._entry_key(user_id, version))
+        except STORE_ERRORS:
+            record_fallback('profile_cache')
+            logger.warning('Cache unavailable; building profile for user %s', user_id)
+            data = build(True)
+            return self.etag(data), data
+        if entry is None:
+            data = build(version > 0)
+            entry = (version, self.etag(data), data)
+            try:
+                self.cache.set(self._entry_key(user_id, version), entry, self.config['TIMEOUT'])
+            except STORE_ERRORS:
+                pass
+        self._remember(user_id, entry)
+        return entry[1:]
+
+    def get_many(self, user_ids, build):
+        """
+        Like get() for many users at once, in two cache round trips.
+
+        Args:
+            user_ids: The users' IDs.
+            build: Called once as ``build(missing)`` with the IDs that missed
+                (possibly none) and must return ``{user_id: profile}`` for
+                those it found, built from the current rows.
+
+        Returns:
+            dict: ``{user_id: profile}`` for every user that was cached or
+            built, keyed as in ``user_ids``.
+        """
+        now = time.monotonic()
+        found = {}
+        remote = []
+        for user_id in user_ids:
+            local = self._local.get(str(user_id))
+            if local is not None and now - local[1] < self.config['LOCAL_TTL']:
+                found[user_id] = local[0][2]
+            else:
+                remote.append(user_id)
+        if not remote:
+            build([])
+            return found
+
+        try:
+            versions = self.cache.get_many([self._version_key(user_id) for user_id in remote])
+            versions = {user_id: versions.get(self._version_key(user_id)) or 0 for user_id in remote}
+            entries = self.cache.get_many([self._entry_key(user_id, version) for user_id, version in versions.items()])
+        except STORE_ERRORS:
+            record_fallback('profile_cache')
+            logger.warning('Cache unavailable; building %s profiles', len(remote))
+            found.update(build(remote))
+            return found
+
+        missing = []
+        for user_id, version in versions.items():
+            entry = entries.get(self._entry_key(user_id, version))
+            if entry is None:
+                missing.append(user_id)
+            else:
+                found[user_id] = entry[2]
+                self._remember(str(user_id), entry)
+        built = build(missing)
+        new_entries = {}
+        for user_id, data in built.items():
+            entry = (versions[user_id], self.etag(data), data)
+            new_entries[self._entry_key(user_id, entry[0])] = entry
+            self._remember(str(user_id), entry)
+        found.update(built)
+        if new_entries:
+            try:
+                self.cache.set_many(new_entries, self.config['TIMEOUT'])
+            except STORE_ERRORS:
+                pass
+        return found
+
+    async def aget(self, user_id, build):
+        """See get(). Local hits are served without leaving the event loop."""
+        local = self._local.get(str(user_id))
+        if local is not None and time.monotonic() - local[1] < self.config['LOCAL_TTL']:
+            return local[0][1:]
+        # build() may query the database, so stay on the request's DB thread.
+        return await sync_to_async(self.get)(user_id, build)
+
+    def bump(self, user_id):
+        """Invalidate the user's cached profile everywhere."""
+        user_id = str(user_id)
+        with self._lock:
+            self._local.pop(user_id, None)
+        key = self._version_key(user_id)
+        try:
+            self.cache.add(key, 0, None)
+            self.cache.incr(key)
+        except STORE_ERRORS:
+            record_fallback('profile_cache')
+            logger.warning('Cache unavailable; profile for user %s may be stale for up to %ss',
+                           user_id, self.config['TIMEOUT'])
+
+
+profile_cache = ProfileCache()
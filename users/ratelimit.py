@@ -0,0 +1,305 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django_redis import get_redis_connection
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError
+
+from core.metrics import record_fallback, record_rate_limit_rejection
+
+from .async_redis import get_async_redis, in_temporary_loop
+from .breaker import redis_breaker
+
+
+# GCRA over every key in one round trip. Nothing is written unless all keys
+# allow the request, so a request rejected by one limit doesn't use up the
+# others.
+#   KEYS: one per limit.
+#   ARGV: emission interval and period (both ms) for each key, in order.
+# Returns {allowed (1/0), retry after (ms), 1-based index of the limiting key}.
+GCRA_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local new_tats = {}
+for i, key in ipairs(KEYS) do
+    local interval = tonumber(ARGV[2 * i - 1])
+    local period = tonumber(ARGV[2 * i])
+    local tat = tonumber(redis.call('GET', key)) or now
+    if tat < now then
+        tat = now
+    end
+    local new_tat = tat + interval
+    local allow_at = new_tat - period
+    if now < allow_at then
+        return {0, allow_at - now, i}
+    end
+    new_tats[i] = new_tat
+end
+for i, key in ipairs(KEYS) do
+    redis.call('SET', key, string.format('%.0f', new_tats[i]), 'PX', new_tats[i] - now)
+end
+return {1, 0, 0}
+"""
+
+RATE_RE = re.compile(r'^(\d+)/(\d*)([smhd])$')
+PERIOD_SECONDS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """
+    Parse a rate such as ``5/m`` or ``100/10s``.
+
+    Returns:
+        tuple: ``(emission_interval, period)`` in seconds.
+    """
+    match = RATE_RE.match(rate)
+    if match is None:
+        raise ValueError(f'Invalid rate {rate!r}')
+    count, multiplier, unit = match.groups()
+    period = int(multiplier or 1) * PERIOD_SECONDS[unit]
+    return period / int(count), period
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    retry_after: float = 0.0
+    key: Optional[str] = None
+
+
+class SharedMemoryTable:
+    """
+    GCRA state in a memory-mapped file, shared by every worker on the host.
+
+    Used when Redis isn't configured or can't be reached, so a host's workers
+    still enforce one limit between them instead of one each. The table is a
+    fixed-size open-addressing hash of (key hash, TAT) slots guarded by an
+    exclusive ``flock``; expired slots are reused, and if a key's
+    neighbourhood is full the oldest entry is evicted.
+    """
+
+    slot = struct.Struct('<Qd')
+    probe_length = 32
+
+    def __init__(self, path, slots=8192):
+        self.path = path
+        self.slots = slots
+        self._pid = None
+        self._fd = None
+        self._mmap = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        # flock() locks are per open file description, so each process needs
+        # its own descriptor; one inherited across fork wouldn't exclude.
+        if self._pid != os.getpid():
+            size = self.slots * self.slot.size
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._mmap = mmap.mmap(fd, size)
+            self._fd = fd
+            self._pid = os.getpid()
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+
+    def _find(self, key_hash, now, taken):
+        start = key_hash % self.slots
+        candidate = None
+        oldest = None
+        for i in range(self.probe_length):
+            index = (start + i) % self.slots
+            stored_hash, tat = self.slot.unpack_from(self._mmap, index * self.slot.size)
+            if stored_hash == key_hash:
+                return index, tat
+            if index in taken:
+                continue
+            if candidate is None and (stored_hash == 0 or tat <= now):
+                candidate = index
+            if oldest is None or tat < oldest[1]:
+                oldest = (index, tat)
+        return (candidate if candidate is not None else oldest[0]), now
+
+    def check(self, limits):
+        with self._lock:
+            self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                updates = []
+                for key, interval, period in limits:
+                    key_hash = self._hash(key)
+                    index, tat = self._find(key_hash, now, {update[0] for update in updates})
+                    new_tat = max(tat, now) + interval
+                    allow_at = new_tat - period
+                    if now < allow_at:
+                        return RateLimitResult(False, allow_at - now, key)
+                    updates.append((index, key_hash, new_tat))
+                for index, key_hash, new_tat in updates:
+                    self.slot.pack_into(self._mmap, index * self.slot.size, key_hash, new_tat)
+                return RateLimitResult(True)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def reset(self):
+        with self._lock:
+            self._open()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                self._mmap[:] = bytes(len(self._mmap))
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class RateLimiter:
+    """
+    Multi-key GCRA rate limiter: one Redis round trip (a Lua script) checks
+    and updates every limit on a request atomically. Falls back to a
+    host-wide shared-memory table when Redis is unavailable, and skips Redis
+    entirely while the Redis circuit breaker is open.
+    """
+
+    prefix = 'ratelimit'
+
+    def __init__(self):
+        self._script = None
+        self._async_script = None
+        self._shared = None
+
+    @property
+    def shared(self):
+        if self._shared is None:
+            self._shared = SharedMemoryTable(
+                settings.RATELIMIT_SHARED_MEMORY_PATH, settings.RATELIMIT_SHARED_MEMORY_SLOTS)
+        return self._shared
+
+    def _script_args(self, limits):
+        keys = [f'{self.prefix}:{key}' for key, _, _ in limits]
+        args = []
+        for _, interval, period in limits:
+            # At least 1ms: a rate over 1000/s would otherwise add nothing to
+            # the TAT and set its key with PX 0, which Redis rejects.
+            args += [max(1, int(interval * 1000)), max(1, int(period * 1000))]
+        return keys, args
+
+    @staticmethod
+    def _script_result(limits, allowed, retry_after, index):
+        if allowed:
+            return RateLimitResult(True)
+        return RateLimitResult(False, retry_after / 1000, limits[index - 1][0])
+
+    def _check_redis(self, limits):
+        redis_conn = get_redis_connection('default')
+        if self._script is None:
+            self._script = redis_conn.register_script(GCRA_SCRIPT)
+        keys, args = self._script_args(limits)
+        return self._script_result(limits, *self._script(keys=keys, args=args, client=redis_conn))
+
+    def check(self, limits):
+        """
+        Count one request against every limit, all or nothing.
+
+        Args:
+            limits: ``(key, rate)`` pairs, e.g. ``('login:ip:1.2.3.4', '5/m')``.
+                Pairs with an empty rate are skipped.
+
+        Returns:
+            RateLimitResult: Whether the request is allowed and, if not, the
+            key that refused it and how many seconds until it would pass.
+        """
+        limits = [(key, *parse_rate(rate)) for key, rate in limits if rate]
+        if not limits:
+            return RateLimitResult(True)
+        if redis_breaker.allow():
+            try:
+                result = self._check_redis(limits)
+            except NotImplementedError:
+                # The default cache isn't Redis.
+                pass
+            except (ConnectionInterrupted, RedisError):
+                redis_breaker.record_failure()
+                record_fallback('ratelimit')
+            else:
+                redis_breaker.record_success()
+                return result
+        return self.shared.check(limits)
+
+    async def acheck(self, limits):
+        """Like ``check()``, but talks to Redis without blocking the event loop."""
+        if in_temporary_loop():
+            return await sync_to_async(self.check, thread_sensitive=False)(limits)
+        limits = [(key, *parse_rate(rate)) for key, rate in limits if rate]
+        if not limits:
+            return RateLimitResult(True)
+        redis_conn = get_async_redis()
+        if redis_conn is not None and redis_breaker.allow():
+            if self._async_script is None:
+                # Clients are per event loop, so the script is called with
+                # the current one rather than the one it was registered on.
+                self._async_script = redis_conn.register_script(GCRA_SCRIPT)
+            try:
+                keys, args = self._script_args(limits)
+                result = self._script_result(
+                    limits, *await self._async_script(keys=keys, args=args, client=redis_conn))
+            except RedisError:
+                redis_breaker.record_failure()
+                record_fallback('ratelimit')
+            else:
+                redis_breaker.record_success()
+                return result
+        # The fallback holds its lock for microseconds; not worth a thread hop.
+        return self.shared.check(limits)
+
+    def reset(self):
+        """Clear the shared-memory fallback table."""
+        self.shared.reset()
+
+
+rate_limiter = RateLimiter()
+
+
+def _request_limits(request, group, account):
+    rates = settings.RATELIMITS[group]
+    limits = [
+        (f'{group}:ip:{request.META.get("REMOTE_ADDR", "")}', rates.get('ip')),
+        (f'{group}:global', rates.get('global')),
+    ]
+    if account:
+        limits.append((f'{group}:account:{str(account).strip().lower()}', rates.get('account')))
+    return limits
+
+
+def _counted(result):
+    if not result.allowed:
+        record_rate_limit_rejection(result.key)
+    return result
+
+
+def check_rate_limit(request, group, account=None):
+    """
+    Apply the ``RATELIMITS[group]`` limits to a request.
+
+    Args:
+        request: The incoming request; limits are keyed on its client IP.
+        group: The name of the limit group in settings, e.g. ``'login'``.
+        account: The account the request targets, if known.
+
+    Returns:
+        RateLimitResult
+    """
+    return _counted(rate_limiter.check(_request_limits(request, group, account)))
+
+
+async def acheck_rate_limit(request, group, account=None):
+    """See check_rate_limit()."""
+    return _counted(await rate_limiter.acheck(_request_limits(request, group, account)))
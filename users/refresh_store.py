@@ -0,0 +1,220 @@
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from core.metrics import record_fallback
+
+from .bloom import BloomFilter
+from .exceptions import TokenStoreUnavailable
+
+
+logger = logging.getLogger(__name__)
+
+FAMILY_CLAIM = 'fam'
+STORE_ERRORS = (ConnectionInterrupted, RedisError)
+SYNC_CHUNK_SIZE = 1000
+
+
+class RefreshTokenStore:
+    """
+    Refresh-token rotation with reuse detection, kept in the cache (Redis in
+    production) instead of simplejwt's OutstandingToken/BlacklistedToken
+    tables.
+
+    Every refresh token belongs to a family started at login. The store keeps
+    one key per live refresh JTI, expiring with the token. Rotating consumes the
+    presented JTI and issues a new one in the same family; presenting a JTI
+    that was already consumed means the token was replayed, so the whole family
+    is revoked, including access tokens that carry its ``fam`` claim.
+
+    Revoked families are also appended to a numbered log in the cache that each
+    process mirrors into a local Bloom filter, so asking whether a family is
+    revoked answers without a network hop unless the filter says "maybe" or
+    couldn't be synced.
+    """
+
+    prefix = 'refresh'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._synced_seq = 0
+        self._synced_at = None
+        # Whether the filter has caught up with the whole live log. A later
+        # sync that fails leaves it holding everything up to _synced_seq.
+        self._complete = False
+
+    @property
+    def config(self):
+        return settings.REFRESH_TOKEN_STORE
+
+    @property
+    def cache(self):
+        return caches[self.config['CACHE']]
+
+    def _jti_key(self, jti):
+        return f'{self.prefix}:jti:{jti}'
+
+    def _family_key(self, family):
+        return f'{self.prefix}:family:{family}'
+
+    def _log_key(self, seq):
+        return f'{self.prefix}:revocation:{seq}'
+
+    @property
+    def _log_seq_key(self):
+        return f'{self.prefix}:revocations'
+
+    def issue(self, token):
+        """
+        Record a new refresh token, starting a family if it doesn't have one.
+
+        Args:
+            token: An unsigned refresh token; its ``fam`` claim is set in place.
+
+        Returns:
+            The same token.
+        """
+        family = token.get(FAMILY_CLAIM) or uuid.uuid4().hex
+        token[FAMILY_CLAIM] = family
+        timeout = max(1, token['exp'] - int(time.time()))
+        try:
+            self.cache.set(self._jti_key(token[api_settings.JTI_CLAIM]), family, timeout)
+        except STORE_ERRORS as e:
+            raise TokenStoreUnavailable() from e
+        return token
+
+    def check(self, token):
+        """Raise ``TokenError`` if the token's family has been revoked."""
+        family = token.get(FAMILY_CLAIM)
+        if family is not None and self.is_revoked(family):
+            raise TokenError(_('Token has been revoked'))
+
+    def rotate(self, token):
+        """
+        Consume a refresh token's JTI and turn the token into its successor.
+
+        Tokens issued before families existed start a new family rather than
+        being rejected.
+
+        Raises:
+            TokenError: If the family is revoked, or the JTI was already used
+                (in which case the family is revoked too).
+        """
+        self.check(token)
+        family = token.get(FAMILY_CLAIM)
+        if family is not None:
+            try:
+                consumed = self.cache.delete(self._jti_key(token[api_settings.JTI_CLAIM]))
+            except STORE_ERRORS as e:
+                raise TokenStoreUnavailable() from e
+            if not consumed:
+                logger.warning('Refresh token reuse detected; revoking family %s', family)
+                self.revoke(family)
+                raise TokenError(_('Token has already been used'))
+
+        token.set_jti()
+        token.set_exp()
+        token.set_iat()
+        return self.issue(token)
+
+    def revoke(self, family):
+        """Revoke every refresh and access token in ``family``."""
+        timeout = int(api_settings.REFRESH_TOKEN_LIFETIME.total_seconds())
+        try:
+            self.cache.set(self._family_key(family), 1, timeout)
+            self.cache.add(self._log_seq_key, 0, None)
+            seq = self.cache.incr(self._log_seq_key)
+            self.cache.set(self._log_key(seq), family, timeout)
+        except STORE_ERRORS as e:
+            raise TokenStoreUnavailable() from e
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(family)
+
+    def is_revoked(self, family):
+        """
+        Whether ``family`` has been revoked. Like token generations, this
+        trusts what the process last synced while the cache is unreachable,
+        and fails closed when that can't answer.
+
+        Raises:
+            TokenStoreUnavailable: If the filter can't rule the family out and
+                the cache is unreachable.
+        """
+        self.sync()
+        # Until the filter has caught up with the live log, a miss proves nothing.
+        if self._complete and family not in self._bloom:
+            return False
+        try:
+            return self.cache.get(self._family_key(family)) is not None
+        except STORE_ERRORS as e:
+            record_fallback('refresh_store')
+            raise TokenStoreUnavailable() from e
+
+    def _first_live_seq(self, seq):
+        """
+        The number of the oldest log entry that hasn't expired, by binary
+        search. Entries share one timeout, so they expire in the order they
+        were numbered.
+        """
+        low, high = 1, seq + 1
+        while low < high:
+            middle = (low + high) // 2
+            if self.cache.get(self._log_key(middle)) is None:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def sync(self, force=False):
+        """
+        Pull revocations logged since the last sync into the local filter.
+        Runs at most once per ``SYNC_INTERVAL`` seconds unless forced.
+
+        The first sync, and a filter that has filled up, load the whole live
+        log into a new filter sized for it. Until the first one succeeds,
+        ``is_revoked()`` asks the cache.
+        """
+        if not force and self._synced_at is not None and time.monotonic() - self._synced_at < self.config['SYNC_INTERVAL']:
+            return
+        with self._lock:
+            if not force and self._synced_at is not None and time.monotonic() - self._synced_at < self.config['SYNC_INTERVAL']:
+                return
+            self._synced_at = time.monotonic()
+            try:
+                seq = self.cache.get(self._log_seq_key) or 0
+                bloom = self._bloom
+                if seq < self._synced_seq:
+                    # The log was wiped (e.g. Redis flushed); start over.
+                    bloom = None
+                    self._synced_seq = 0
+                if bloom is None or bloom.is_full:
+                    first = self._first_live_seq(seq)
+                    capacity = max(self.config['BLOOM_CAPACITY'], 2 * (seq - first + 1))
+                    bloom = BloomFilter(capacity, self.config['BLOOM_ERROR_RATE'])
+                else:
+                    first = self._synced_seq + 1
+                for start in range(first, seq + 1, SYNC_CHUNK_SIZE):
+                    keys = [self._log_key(n) for n in range(start, min(start + SYNC_CHUNK_SIZE, seq + 1))]
+                    for family in self.cache.get_many(keys).values():
+                        bloom.add(family)
+            except STORE_ERRORS:
+                record_fallback('refresh_store')
+                logger.warning('Token store unavailable; revocation filter not synced')
+            else:
+                self._bloom = bloom
+                self._synced_seq = seq
+                self._complete = True
+
+
+refresh_store = RefreshTokenStore()
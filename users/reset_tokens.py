@@ -0,0 +1,191 @@
+import hashlib
+import logging
+import secrets
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from django_redis import get_redis_connection
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError, ResponseError
+
+from core.metrics import record_fallback
+
+from .async_redis import get_async_redis, in_temporary_loop
+from .breaker import redis_breaker
+from .models import PasswordResetToken
+
+
+logger = logging.getLogger(__name__)
+
+REDIS_ERRORS = (ConnectionInterrupted, RedisError)
+
+
+class PasswordResetTokenStore:
+    """
+    Single-use password reset tokens.
+
+    Tokens live in Redis when it is configured and reachable; issuing is one
+    SET and redeeming is one atomic GETDEL (or a MULTI/EXEC GET+DEL pipeline
+    on Redis older than 6.2), so a token can't be redeemed twice. While the
+    Redis circuit breaker is open, or when Redis isn't configured, tokens go
+    to the ``PasswordResetToken`` table instead, which every worker shares.
+    Only a SHA-256 of the token is stored there.
+    """
+
+    key_prefix = 'password_reset_'
+
+    def __init__(self, breaker=redis_breaker):
+        self.breaker = breaker
+        self._getdel_supported = True
+
+    @property
+    def expiry_seconds(self):
+        return settings.PASSWORD_RESET_EXPIRY_SECONDS
+
+    def _redis(self):
+        if not self.breaker.allow():
+            return None
+        try:
+            return get_redis_connection('default')
+        except NotImplementedError:
+            # The default cache isn't Redis.
+            return None
+
+    @staticmethod
+    def _hash(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def _getdel(self, redis_conn, key):
+        if self._getdel_supported:
+            try:
+                return redis_conn.getdel(key)
+            except ResponseError:
+                self._getdel_supported = False
+        pipe = redis_conn.pipeline(transaction=True)
+        pipe.get(key)
+        pipe.delete(key)
+        return pipe.execute()[0]
+
+    def _new_row(self, token, user_id, now):
+        return PasswordResetToken(
+            token_hash=self._hash(token),
+            user_id=user_id,
+            expires_at=now + timedelta(seconds=self.expiry_seconds),
+        )
+
+    def create(self, user_id):
+        """
+        Issue a reset token for a user.
+
+        Args:
+            user_id: The ID of the user requesting the reset.
+
+        Returns:
+            str: The token.
+        """
+        token = secrets.token_urlsafe(32)
+        redis_conn = self._redis()
+        if redis_conn is not None:
+            try:
+                redis_conn.set(f'{self.key_prefix}{token}', str(user_id), ex=self.expiry_seconds)
+                self.breaker.record_success()
+                return token
+            except REDIS_ERRORS:
+                self.breaker.record_failure()
+                record_fallback('reset_tokens')
+                logger.warning('Redis unavailable; storing password reset token in the database')
+
+        now = timezone.now()
+        PasswordResetToken.objects.filter(expires_at__lte=now).delete()
+        self._new_row(token, user_id, now).save(force_insert=True)
+        return token
+
+    async def acreate(self, user_id):
+        """See create()."""
+        if in_temporary_loop():
+            return await sync_to_async(self.create)(user_id)
+        token = secrets.token_urlsafe(32)
+        redis_conn = get_async_redis()
+        if redis_conn is not None and self.breaker.allow():
+            try:
+                await redis_conn.set(f'{self.key_prefix}{token}', str(user_id), ex=self.expiry_seconds)
+                self.breaker.record_success()
+                return token
+            except RedisError:
+                self.breaker.record_failure()
+                record_fallback('reset_tokens')
+                logger.warning('Redis unavailable; storing password reset token in the database')
+
+        now = timezone.now()
+        await PasswordResetToken.objects.filter(expires_at__lte=now).adelete()
+        await self._new_row(token, user_id, now).asave(force_insert=True)
+        return token
+
+    def consume(self, token):
+        """
+        Redeem a reset token. Each token can be redeemed once.
+
+        Args:
+            token: The token to redeem.
+
+        Returns:
+            str: The user ID if the token was valid, None otherwise.
+        """
+        redis_conn = self._redis()
+        if redis_conn is not None:
+            try:
+                user_id = self._getdel(redis_conn, f'{self.key_prefix}{token}')
+                self.breaker.record_success()
+                if user_id:
+                    return user_id.decode()
+            except REDIS_ERRORS:
+                self.breaker.record_failure()
+                record_fallback('reset_tokens')
+                logger.warning('Redis unavailable; checking password reset token in the database')
+
+        # The token may have been issued while Redis was down.
+        token_hash = self._hash(token)
+        user_id = PasswordResetToken.objects.filter(
+            token_hash=token_hash, expires_at__gt=timezone.now()).values_list('user_id', flat=True).first()
+        if user_id is None:
+            return None
+        # Only the request whose DELETE removes the row gets to use it.
+        deleted, _ = PasswordResetToken.objects.filter(token_hash=token_hash).delete()
+        return str(user_id) if deleted else None
+
+    async def aconsume(self, token):
+        """See consume()."""
+        if in_temporary_loop():
+            return await sync_to_async(self.consume)(token)
+        redis_conn = get_async_redis()
+        if redis_conn is not None and self.breaker.allow():
+            key = f'{self.key_prefix}{token}'
+            try:
+                if self._getdel_supported:
+                    try:
+                        user_id = await redis_conn.getdel(key)
+                    except ResponseError:
+                        self._getdel_supported = False
+                if not self._getdel_supported:
+                    async with redis_conn.pipeline(transaction=True) as pipe:
+                        user_id = (await pipe.get(key).delete(key).execute())[0]
+                self.breaker.record_success()
+                if user_id:
+                    return user_id.decode()
+            except RedisError:
+                self.breaker.record_failure()
+                record_fallback('reset_tokens')
+                logger.warning('Redis unavailable; checking password reset token in the database')
+
+        token_hash = self._hash(token)
+        user_id = await PasswordResetToken.objects.filter(
+            token_hash=token_hash, expires_at__gt=timezone.now()).values_list('user_id', flat=True).afirst()
+        if user_id is None:
+            return None
+        deleted, _ = await PasswordResetToken.objects.filter(token_hash=token_hash).adelete()
+        return str(user_id) if deleted else None
+
+
+reset_token_store = PasswordResetTokenStore()
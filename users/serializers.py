@@ -1,11 +1,68 @@
-from django.contrib.auth import authenticate
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in
 from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
 from jsonschema.exceptions import ValidationError
 
-from rest_framework import serializers
+from rest_framework import ISO_8601, serializers
+from rest_framework.exceptions import NotFound, ValidationError as DRFValidationError
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer, TokenRefreshSerializer, TokenVerifySerializer)
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import UntypedToken
 
+from core.db.routers import primary_pins
+
+from .exceptions import TokenStoreUnavailable
+from .exporter import FIELDS as EXPORT_FIELDS, FORMATS as EXPORT_FORMATS
 from .models import User
-from .utils import get_tokens_for_user, generate_password_reset_token, verify_password_reset_token
+from .generations import token_generations
+from .profile_cache import profile_cache
+from .refresh_store import FAMILY_CLAIM, refresh_store
+from .tokens import UserRefreshToken, add_user_claims, check_revocation
+from .utils import (
+    agenerate_password_reset_token, aget_tokens_for_user, averify_password_reset_token, get_tokens_for_user,
+    generate_password_reset_token, lookup_users, verify_password_reset_token, verify_tokens)
+
+
+class AsyncSerializerMixin:
+    """
+    ``ais_valid()`` and ``asave()`` for async views.
+
+    They mirror ``is_valid()`` and ``save()`` but await ``avalidate()`` and
+    ``acreate()``, so validation and saving that wait on the database, Redis
+    or the hashing pool don't block the event loop. ``avalidate()`` defaults
+    to calling ``validate()``, which is fine when it does no I/O.
+    """
+
+    async def ais_valid(self, raise_exception=False):
+        if not hasattr(self, '_validated_data'):
+            try:
+                is_empty_value, data = self.validate_empty_values(self.initial_data)
+                if not is_empty_value:
+                    data = self.to_internal_value(data)
+                    self.run_validators(data)
+                    data = await self.avalidate(data)
+                self._validated_data = data
+            except (DRFValidationError, DjangoValidationError) as exc:
+                self._validated_data = {}
+                self._errors = serializers.as_serializer_error(exc)
+            else:
+                self._errors = {}
+
+        if self._errors and raise_exception:
+            raise DRFValidationError(self.errors)
+        return not bool(self._errors)
+
+    async def avalidate(self, attrs):
+        return self.validate(attrs)
+
+    async def asave(self, **kwargs):
+        self.instance = await self.acreate({**self.validated_data, **kwargs})
+        return self.instance
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
@@ -26,11 +83,15 @@ class UserProfileSerializer(serializers.ModelSerializer):
     def update(self, instance, validated_data):
         instance.email = validated_data.get('email', instance.email)
         instance.full_name = validated_data.get('full_name', instance.full_name)
-        instance.save()
+        # Only the edited fields: last_login is written by users.activity and
+        # may have moved on since the instance was loaded.
+        instance.save(update_fields=['email', 'full_name'])
+        primary_pins.pin(instance.id, instance.email)
+        profile_cache.bump(instance.id)
         return instance
 
 
-class RegistrationSerializer(serializers.ModelSerializer):
+class RegistrationSerializer(AsyncSerializerMixin, serializers.ModelSerializer):
     password2 = serializers.CharField(max_length=128, write_only=True)
 
     class Meta:
@@ -39,15 +100,15 @@ class RegistrationSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'password': {'write_only': True, 'required': True},
             'password2': {'write_only': True, 'required': True},
+            # Duplicates are caught by the unique index on insert (see
+            # create()), saving a query on every registration.
+            'email': {'validators': []},
         }
 
     def validate(self, data):
-        email = data.get('email')
         password = data.get('password')
         password2 = data.get('password2')
 
-        if email and User.objects.filter(email=email).exists():
-            raise serializers.ValidationError("This email is already in use.")
         if not password or not password2:
             raise serializers.ValidationError("Please set both passwords.")
         if password != password2:
@@ -67,7 +128,25 @@ class RegistrationSerializer(serializers.ModelSerializer):
         email = validated_data.get('email')
 
         # Create and return the user instance (not a dict)
-        user = User.objects.create_user(email=email, password=password, **{k: v for k, v in validated_data.items() if k != 'email'})
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(email=email, password=password, **{k: v for k, v in validated_data.items() if k != 'email'})
+        except IntegrityError:
+            raise serializers.ValidationError("This email is already in use.")
+        primary_pins.pin(user.id, user.email)
+        return user
+
+    async def acreate(self, validated_data):
+        validated_data.pop('password2', None)
+        password = validated_data.pop('password')
+        email = validated_data.pop('email')
+        # Async views run in autocommit mode, so a failed insert needs no
+        # savepoint to roll back to.
+        try:
+            user = await User.objects.acreate_user(email=email, password=password, **validated_data)
+        except IntegrityError:
+            raise serializers.ValidationError("This email is already in use.")
+        await primary_pins.apin(user.id, user.email)
         return user
 
     def to_representation(self, instance):
@@ -79,7 +158,7 @@ class RegistrationSerializer(serializers.ModelSerializer):
         }
 
 
-class LoginSerializer(serializers.Serializer):
+class LoginSerializer(AsyncSerializerMixin, serializers.Serializer):
     email = serializers.EmailField(required=True)
     password = serializers.CharField(max_length=128, write_only=True, required=True)
     jwt_token = serializers.DictField(read_only=True)
@@ -91,43 +170,88 @@ class LoginSerializer(serializers.Serializer):
             raise serializers.ValidationError("Email is required.")
         if password is None:
             raise serializers.ValidationError("Password is required.")
-        # Use 'username' and include request for compatibility with common auth backends
-        user = authenticate(self.context.get('request'), username=email, password=password)
-
-        if user is None:
-            if User.objects.filter(email=email).exists():
-                raise serializers.ValidationError("Invalid password.")
-            else:
-                raise serializers.ValidationError("Invalid credentials.")
+        primary_pins.check(email=email)
+        # One lookup serves both the password check and the error message.
+        try:
+            user = User.objects.get_by_natural_key(email)
+        except User.DoesNotExist:
+            # Hash anyway so unknown emails take as long as wrong passwords.
+            User().set_password(password)
+            raise serializers.ValidationError("Invalid credentials.")
+        if not (user.check_password(password) and user.is_active):
+            raise serializers.ValidationError("Invalid password.")
+        user_logged_in.send(sender=user.__class__, request=self.context.get('request'), user=user)
         login_data = get_tokens_for_user(user)
         data['user'] = user
         data['jwt_token'] = login_data
         return data
 
+    async def avalidate(self, data):
+        email = data.get('email', None)
+        password = data.pop('password', None)
+        if email is None:
+            raise serializers.ValidationError("Email is required.")
+        if password is None:
+            raise serializers.ValidationError("Password is required.")
+        await primary_pins.acheck(email=email)
+        try:
+            user = await User.objects.aget_by_natural_key(email)
+        except User.DoesNotExist:
+            await User().aset_password(password)
+            raise serializers.ValidationError("Invalid credentials.")
+        if not (await user.acheck_password(password) and user.is_active):
+            raise serializers.ValidationError("Invalid password.")
+        await user_logged_in.asend(sender=user.__class__, request=self.context.get('request'), user=user)
+        data['user'] = user
+        data['jwt_token'] = await aget_tokens_for_user(user)
+        return data
+
 
-class ForgotPasswordSerializer(serializers.Serializer):
+class ForgotPasswordSerializer(AsyncSerializerMixin, serializers.Serializer):
     email = serializers.EmailField(required=True)
 
     def validate(self, data):
         email = data.get('email', None)
         if email is None:
             raise serializers.ValidationError("Email is required.")
-        if not User.objects.filter(email=email).exists():
-            raise serializers.ValidationError("This email is not registered.")
+        primary_pins.check(email=email)
+        user = User.objects.filter(email=email).values('id', 'email').first()
+        if user is None:
+            raise NotFound("User not found")
+        data['user'] = user
+        return data
+
+    async def avalidate(self, data):
+        email = data.get('email', None)
+        if email is None:
+            raise serializers.ValidationError("Email is required.")
+        await primary_pins.acheck(email=email)
+        user = await User.objects.filter(email=email).values('id', 'email').afirst()
+        if user is None:
+            raise NotFound("User not found")
+        data['user'] = user
         return data
 
     def create(self, validated_data):
-        email = validated_data.get('email', None)
-        user = User.objects.get(email=email)
-        token = generate_password_reset_token(user.id)
+        user = validated_data['user']
+        token = generate_password_reset_token(user['id'])
         return {
-            'user_id': user.id,
-            'email': user.email,
+            'user_id': user['id'],
+            'email': user['email'],
             'token': token
         }
 
+    async def acreate(self, validated_data):
+        user = validated_data['user']
+        token = await agenerate_password_reset_token(user['id'])
+        return {
+            'user_id': user['id'],
+            'email': user['email'],
+            'token': token
+        }
 
-class ResetPasswordSerializer(serializers.Serializer):
+
+class ResetPasswordSerializer(AsyncSerializerMixin, serializers.Serializer):
     token = serializers.CharField(required=True)
     new_password = serializers.CharField(max_length=128, required=True)
     new_password2 = serializers.CharField(max_length=128, required=True)
@@ -149,13 +273,42 @@ class ResetPasswordSerializer(serializers.Serializer):
         )
         return data
 
+    async def avalidate(self, data):
+        token = data.get('token', None)
+        if token is None:
+            raise serializers.ValidationError("Token is required.")
+        user_id = await averify_password_reset_token(token)
+        if user_id is None:
+            raise serializers.ValidationError("Invalid or expired token.")
+        if data['new_password'] != data['new_password2']:
+            raise serializers.ValidationError("Passwords don't match.")
+        validate_password(data['new_password'], user=User(id=user_id))
+        data['user_id'] = user_id
+        return data
+
+    @staticmethod
+    def _revoke_tokens(user_id):
+        """
+        End the sessions opened with the old password. Runs before the
+        password changes, so that if they can't be revoked it stays as it was.
+        """
+        try:
+            token_generations.bump(user_id)
+        except TokenStoreUnavailable as e:
+            # The reset token was already spent in validation.
+            raise TokenStoreUnavailable(
+                'Password not changed: the token store is unavailable. Please request a new reset link shortly.'
+            ) from e
+
     def create(self, validated_data):
         new_password = validated_data.pop('new_password', None)
         validated_data.pop('new_password2', None)
         try:
             user = User.objects.get(id=validated_data.get('user_id', None))
+            self._revoke_tokens(user.id)
             user.set_password(new_password)
-            user.save()
+            user.save(update_fields=['password'])
+            primary_pins.pin(user.id, user.email)
 
         except User.DoesNotExist:
             return serializers.ValidationError("User not found.")
@@ -164,3 +317,157 @@ class ResetPasswordSerializer(serializers.Serializer):
             'user_id': validated_data.get('user_id', None),
             'message': 'Password reset successful.'
         }
+
+    async def acreate(self, validated_data):
+        try:
+            user = await User.objects.aget(id=validated_data['user_id'])
+        except User.DoesNotExist:
+            raise serializers.ValidationError("User not found.")
+        await sync_to_async(self._revoke_tokens, thread_sensitive=False)(user.id)
+        await user.aset_password(validated_data['new_password'])
+        await user.asave(update_fields=['password'])
+        await primary_pins.apin(user.id, user.email)
+        return {
+            'user_id': validated_data['user_id'],
+            'message': 'Password reset successful.'
+        }
+
+
+class UserTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = UserRefreshToken
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        # UPDATE_LAST_LOGIN stays off; the last-login tracker batches writes.
+        user_logged_in.send(sender=self.user.__class__, request=self.context.get('request'), user=self.user)
+        return data
+
+
+class UserTokenRefreshSerializer(AsyncSerializerMixin, TokenRefreshSerializer):
+    """
+    Refreshes through the refresh store: the presented token is consumed and
+    replaced (when ROTATE_REFRESH_TOKENS is on), replays revoke the token's
+    family, and the user claims are re-read from the user row.
+    """
+    token_class = UserRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        check_revocation(refresh)
+        primary_pins.check(refresh.payload.get(api_settings.USER_ID_CLAIM))
+
+        try:
+            user = User.objects.get(**{api_settings.USER_ID_FIELD: refresh.payload.get(api_settings.USER_ID_CLAIM)})
+        except User.DoesNotExist:
+            user = None
+        if not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        add_user_claims(refresh, user)
+
+        data = {}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            refresh_store.rotate(refresh)
+            data['refresh'] = str(refresh)
+        data['access'] = str(refresh.access_token)
+        return data
+
+    async def avalidate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        # The token stores use the synchronous cache client but never the
+        # database, so any thread will do.
+        await sync_to_async(check_revocation, thread_sensitive=False)(refresh)
+        await primary_pins.acheck(refresh.payload.get(api_settings.USER_ID_CLAIM))
+
+        try:
+            user = await User.objects.aget(**{api_settings.USER_ID_FIELD: refresh.payload.get(api_settings.USER_ID_CLAIM)})
+        except User.DoesNotExist:
+            user = None
+        if not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        add_user_claims(refresh, user)
+
+        data = {}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            await sync_to_async(refresh_store.rotate, thread_sensitive=False)(refresh)
+            data['refresh'] = str(refresh)
+        data['access'] = str(refresh.access_token)
+        return data
+
+
+class UserTokenVerifySerializer(AsyncSerializerMixin, TokenVerifySerializer):
+    def validate(self, attrs):
+        check_revocation(UntypedToken(attrs['token']))
+        return {}
+
+    async def avalidate(self, attrs):
+        token = UntypedToken(attrs['token'])
+        await sync_to_async(check_revocation, thread_sensitive=False)(token)
+        return {}
+
+
+class LogoutSerializer(serializers.Serializer):
+    refresh = serializers.CharField(required=True, write_only=True)
+
+    def validate(self, data):
+        data['token'] = UserRefreshToken(data['refresh'])
+        return data
+
+    def create(self, validated_data):
+        token = validated_data['token']
+        family = token.get(FAMILY_CLAIM)
+        if family is not None:
+            refresh_store.revoke(family)
+        return {'message': 'Logged out.'}
+
+
+class TokenVerifyBatchSerializer(serializers.Serializer):
+    tokens = serializers.ListField(
+        child=serializers.CharField(),
+        allow_empty=False,
+        max_length=settings.TOKEN_VERIFY_BATCH_MAX_SIZE,
+        write_only=True,
+    )
+    results = serializers.ListField(read_only=True)
+
+    def validate(self, data):
+        return {'results': verify_tokens(data['tokens'])}
+
+
+class UserLookupSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), default=list, write_only=True)
+    emails = serializers.ListField(child=serializers.CharField(max_length=254), default=list, write_only=True)
+    users = UserProfileSerializer(many=True, read_only=True)
+    missing = serializers.DictField(child=serializers.ListField(), read_only=True)
+
+    def validate(self, data):
+        count = len(data['ids']) + len(data['emails'])
+        if not count:
+            raise serializers.ValidationError("Provide ids or emails to look up.")
+        if count > settings.USER_LOOKUP_MAX_SIZE:
+            raise serializers.ValidationError(
+                f"Look up at most {settings.USER_LOOKUP_MAX_SIZE} ids and emails at once.")
+        return lookup_users(data['ids'], data['emails'], UserProfileSerializer.Meta.fields)
+
+
+class UserExportSerializer(serializers.Serializer):
+    """Options for a user export (see users.exporter). Dates join the range as [from, to)."""
+    format = serializers.ChoiceField(choices=list(EXPORT_FORMATS), default='csv')
+    date_joined_from = serializers.DateTimeField(required=False, input_formats=[ISO_8601, '%Y-%m-%d'])
+    date_joined_to = serializers.DateTimeField(required=False, input_formats=[ISO_8601, '%Y-%m-%d'])
+    is_active = serializers.BooleanField(required=False, allow_null=True, default=None)
+    after = serializers.IntegerField(required=False, min_value=0, help_text='Resume after this user id.')
+
+
+class UserListSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = EXPORT_FIELDS
+        read_only_fields = fields
+
+
+class UserListQuerySerializer(serializers.Serializer):
+    """Options for the staff user list (see users.pagination)."""
+    ordering = serializers.ChoiceField(
+        choices=['-date_joined', 'date_joined', '-id', 'id', 'email', '-email'], default='-date_joined')
+    email = serializers.CharField(required=False, help_text='Start of the email address (case-sensitive).')
+    is_active = serializers.BooleanField(required=False, allow_null=True, default=None)
@@ -1,10 +1,94 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import csv
+import hashlib
+import io
+import json
+import os
+import pstats
+import subprocess
+import tempfile
+import threading
+import time
+from unittest import mock
+
+import jwt
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.core.cache import cache
+from django.utils import timezone
+import msgpack
+from prometheus_client import REGISTRY
+from prometheus_client.mmap_dict import MmapedDict
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from rest_framework_simplejwt import state
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from core import schema
+from core.db import routers
+
+from . import exporter, hashing, keys, serializers, views
+from .activity import last_login_tracker
+from .bloom import BloomFilter
+from .breaker import CircuitBreaker, redis_breaker
+from .checks import check_shared_token_store
+from .exceptions import TokenStoreUnavailable
+from .generations import TokenGenerationStore, token_generations
+from .profile_cache import profile_cache
+from .ratelimit import SharedMemoryTable, parse_rate, rate_limiter
+from .refresh_store import RefreshTokenStore, refresh_store
+from .reset_tokens import PasswordResetTokenStore
+from .serializers import ResetPasswordSerializer
+from .models import PasswordResetToken, User
+from .pagination import InvalidCursor, encode_cursor, keyset_ordering, paginate
+from .password_list import PasswordList, build_password_list, password_hash, read_passwords
+from .validators import CommonPasswordValidator
+from .verifier import JWKSVerifier
+from .utils import (
+    averify_password_reset_token, get_tokens_for_user, generate_password_reset_token, verify_password_reset_token)
+
+
+# No background last-login flushes while tests run; tests flush explicitly.
+_no_flusher = override_settings(LAST_LOGIN_TRACKER=dict(settings.LAST_LOGIN_TRACKER, FLUSH_INTERVAL=0))
+
+
+# Refresh rotation is off without Redis (see SIMPLE_JWT in core/settings.py);
+# a single test process is safe with the in-memory store. Patched rather than
+# overridden: simplejwt's reload wouldn't reach modules that imported
+# api_settings already.
+rotating = mock.patch.object(api_settings, 'ROTATE_REFRESH_TOKENS', True)
+
+
+def setUpModule():
+    _no_flusher.enable()
+
+
+def tearDownModule():
+    _no_flusher.disable()
 
-from .models import User
-from .utils import generate_password_reset_token, verify_password_reset_token
+
+def reset_shared_state():
+    """
+    Forget token generations, rate-limit counters and pending logins, which
+    outlive a test's transaction (and, for the shared-memory rate limiter, the
+    test process).
+    """
+    cache.clear()
+    token_generations._local.clear()
+    profile_cache._local.clear()
+    rate_limiter.reset()
+    redis_breaker.record_success()
+    last_login_tracker._buffer.clear()
 
 
 class UserRegistrationTestCase(APITestCase):
@@ -39,6 +123,7 @@ class UserRegistrationTestCase(APITestCase):
 
 class UserLoginTestCase(APITestCase):
     def setUp(self):
+        reset_shared_state()
         self.user = User.objects.create_user(
             email='test@example.com',
             full_name='Test User',
@@ -66,6 +151,8 @@ class UserLoginTestCase(APITestCase):
 
 class PasswordResetTestCase(APITestCase):
     def setUp(self):
+        reset_shared_state()
+        self.addCleanup(reset_shared_state)
         self.user = User.objects.create_user(
             email='test@example.com',
             full_name='Test User',
@@ -102,6 +189,63 @@ class PasswordResetTestCase(APITestCase):
         self.user.refresh_from_db()
         self.assertTrue(self.user.check_password('NewPassword123!'))
 
+class QueryBudgetTestCase(APITestCase):
+    """Each public auth flow looks the user up at most once."""
+
+    def setUp(self):
+        reset_shared_state()
+        self.addCleanup(reset_shared_state)
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            full_name='Test User',
+            password='TestPassword123!'
+        )
+
+    def test_register_budget(self):
+        """Test registration is a single insert"""
+        data = {
+            'full_name': 'John Doe',
+            'email': 'john@example.com',
+            'password': 'StrongPassword123!',
+            'password2': 'StrongPassword123!'
+        }
+        with self.assertNumQueries(1):
+            response = self.client.post('/api/auth/register/', data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        with self.assertNumQueries(1):
+            response = self.client.post('/api/auth/register/', data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error'], 'This email is already in use.')
+
+    def test_login_budget(self):
+        """Test successful and failed logins each cost one query"""
+        with self.assertNumQueries(1):
+            response = self.client.post('/api/auth/login/', {'email': 'test@example.com', 'password': 'TestPassword123!'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(1):
+            response = self.client.post('/api/auth/login/', {'email': 'test@example.com', 'password': 'WrongPassword'})
+        self.assertEqual(response.data['error'], 'Invalid password.')
+
+        with self.assertNumQueries(1):
+            response = self.client.post('/api/auth/login/', {'email': 'nobody@example.com', 'password': 'WrongPassword'})
+        self.assertEqual(response.data['error'], 'Invalid credentials.')
+
+    def test_forgot_password_budget(self):
+        """Test forgot password looks the user up once"""
+        # One lookup, plus purge + insert for the database reset-token store
+        # (no Redis in tests).
+        with self.assertNumQueries(3):
+            response = self.client.post('/api/auth/forgot-password/', {'email': 'test@example.com'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(1):
+            response = self.client.post('/api/auth/forgot-password/', {'email': 'nobody@example.com'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.data['error'], 'User not found')
+
+
 class RedisTokenTestCase(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -129,4 +273,1426 @@ class RedisTokenTestCase(TestCase):
         valid_token = generate_password_reset_token(user.id)
         invalid_token = 'invalid-token'
 
-        self.assertFalse(verify_password_reset_token(invalid_token))
\ No newline at end of file
+        self.assertFalse(verify_password_reset_token(invalid_token))
+
+    def test_falls_back_to_database_when_breaker_open(self):
+        """Test reset tokens skip Redis while the circuit breaker is open"""
+        breaker = CircuitBreaker('redis')
+        breaker.state, breaker.opened_at = CircuitBreaker.OPEN, time.monotonic()
+        store = PasswordResetTokenStore(breaker=breaker)
+        with mock.patch('users.reset_tokens.get_redis_connection') as get_redis_connection:
+            token = store.create(self.user.id)
+            self.assertEqual(store.consume(token), str(self.user.id))
+            self.assertIsNone(store.consume(token))
+        get_redis_connection.assert_not_called()
+        self.assertFalse(PasswordResetToken.objects.exists())
+
+    def test_redis_errors_open_breaker(self):
+        """Test repeated Redis errors open the breaker and fall back to the database"""
+        breaker = CircuitBreaker('redis')
+        store = PasswordResetTokenStore(breaker=breaker)
+        redis_conn = mock.Mock()
+        redis_conn.set.side_effect = RedisConnectionError()
+        with mock.patch('users.reset_tokens.get_redis_connection', return_value=redis_conn):
+            tokens = [store.create(self.user.id) for _ in range(5)]
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(redis_conn.set.call_count, settings.CIRCUIT_BREAKERS['redis']['FAILURE_THRESHOLD'])
+        self.assertEqual(PasswordResetToken.objects.count(), 5)
+        self.assertEqual(verify_password_reset_token(tokens[0]), str(self.user.id))
+
+    def test_expired_token_rejected(self):
+        """Test expired reset tokens are rejected"""
+        token = generate_password_reset_token(self.user.id)
+        PasswordResetToken.objects.update(expires_at=timezone.now())
+        self.assertIsNone(verify_password_reset_token(token))
+
+
+class HashingExecutorTestCase(TestCase):
+    def setUp(self):
+        reset_shared_state()
+        self.executor = hashing.HashingExecutor('test', max_workers=1, max_queue=0)
+        self.addCleanup(self.executor.shutdown)
+
+    def test_rejects_when_queue_full(self):
+        """Test the pool fails fast once every slot is taken, and exports it"""
+        rejections = REGISTRY.get_sample_value('password_hashing_pool_rejections_total', {'pool': 'test'}) or 0
+        release = threading.Event()
+        future = self.executor.submit(release.wait)
+        tasks = {state: REGISTRY.get_sample_value('password_hashing_pool_tasks', {'pool': 'test', 'state': state})
+                 for state in ('running', 'queued', 'max')}
+        self.assertEqual(tasks, {'running': 1, 'queued': 0, 'max': 1})
+        with self.assertRaises(hashing.HashingPoolSaturated):
+            self.executor.submit(lambda: None)
+        release.set()
+        future.result()
+
+        stats = self.executor.stats()
+        self.assertEqual(stats['rejected'], 1)
+        self.assertEqual(stats['completed'], 1)
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual(
+            REGISTRY.get_sample_value('password_hashing_pool_rejections_total', {'pool': 'test'}), rejections + 1)
+        self.assertEqual(REGISTRY.get_sample_value('password_hashing_pool_tasks', {'pool': 'test', 'state': 'running'}), 0)
+
+    def test_cancel_queued_task(self):
+        """Test cancelling a queued hash from asyncio frees its slot"""
+        executor = hashing.HashingExecutor('cancel', max_workers=1, max_queue=1)
+        self.addCleanup(executor.shutdown)
+        release = threading.Event()
+        running = executor.submit(release.wait)
+
+        async def cancel_queued():
+            task = asyncio.ensure_future(executor.arun(sum, [1, 2]))
+            await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel_queued())
+        release.set()
+        running.result()
+        stats = executor.stats()
+        self.assertEqual((stats['cancelled'], stats['completed'], stats['in_flight']), (1, 1, 0))
+
+    def test_async_run(self):
+        """Test the pool can be awaited from an event loop"""
+        result = asyncio.run(self.executor.arun(sum, [1, 2, 3]))
+        self.assertEqual(result, 6)
+
+    def test_login_returns_503_when_saturated(self):
+        """Test login answers 503 instead of queueing when hashing is saturated"""
+        User.objects.create_user(email='busy@example.com', password='TestPassword123!')
+        release = threading.Event()
+        future = self.executor.submit(release.wait)
+        try:
+            with mock.patch.dict(hashing._executors, {'default': self.executor}):
+                response = self.client.post('/api/auth/login/', {
+                    'email': 'busy@example.com',
+                    'password': 'TestPassword123!',
+                })
+        finally:
+            release.set()
+            future.result()
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+class StatelessAuthenticationTestCase(APITestCase):
+    def setUp(self):
+        reset_shared_state()
+        self.addCleanup(reset_shared_state)
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            full_name='Test User',
+            password='TestPassword123!'
+        )
+
+    def test_profile_without_user_query(self):
+        """Test profile is served from token claims without a database query"""
+        access = get_tokens_for_user(self.user)['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/auth/profile/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            'id': self.user.id,
+            'email': 'test@example.com',
+            'full_name': 'Test User',
+        })
+
+    def test_update_profile_uses_database_row(self):
+        """Test profile updates are written to the user row"""
+        access = get_tokens_for_user(self.user)['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        response = self.client.put('/api/auth/update-profile/', {
+            'email': 'new@example.com',
+            'full_name': 'New Name',
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.email, 'new@example.com')
+        self.assertEqual(self.user.full_name, 'New Name')
+
+    def test_token_without_claims_falls_back_to_database(self):
+        """Test tokens minted without user claims still authenticate"""
+        access = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/auth/profile/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['email'], 'test@example.com')
+
+
+class KeyRingTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            full_name='Test User',
+            password='TestPassword123!'
+        )
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        call_command('generate_signing_key', kid='old', algorithm='RS256', directory=directory.name, stdout=io.StringIO())
+        call_command('generate_signing_key', kid='new', algorithm='EdDSA', directory=directory.name, stdout=io.StringIO())
+        self.key_ring = keys.KeyRing.from_directory(directory.name, 'new')
+
+        patchers = [
+            mock.patch.object(keys, '_key_ring', self.key_ring),
+            mock.patch.object(state, 'token_backend', keys.KeyRingTokenBackend(self.key_ring)),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_tokens_signed_with_active_key(self):
+        """Test new tokens carry the active kid and authenticate"""
+        access = get_tokens_for_user(self.user)['access']
+        self.assertEqual(jwt.get_unverified_header(access), {'alg': 'EdDSA', 'kid': 'new', 'typ': 'JWT'})
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        response = self.client.get('/api/auth/profile/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_jwks_endpoint(self):
+        """Test the JWKS lists every key with cache headers and honours If-None-Match"""
+        response = self.client.get('/.well-known/jwks.json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({key['kid'] for key in response.json()['keys']}, {'old', 'new'})
+        self.assertIn('max-age=', response['Cache-Control'])
+        self.assertIn('public', response['Cache-Control'])
+
+        response = self.client.get('/.well-known/jwks.json', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_local_verifier(self):
+        """Test the verifier checks tokens against a cached JWKS without fetching"""
+        body, _ = self.key_ring.jwks
+        verifier = JWKSVerifier(jwks=body)
+        claims = verifier.verify(get_tokens_for_user(self.user)['access'])
+        self.assertEqual(claims['email'], 'test@example.com')
+
+        forged = jwt.encode({'token_type': 'access'}, 'secret', algorithm='HS256', headers={'kid': 'new'})
+        with self.assertRaises(jwt.InvalidTokenError):
+            verifier.verify(forged)
+
+    def test_hs256_transition(self):
+        """Test HS256 tokens from before the key ring verify only while JWT_ACCEPT_HS256 is on"""
+        with mock.patch.object(state, 'token_backend', TokenBackend('HS256', settings.SECRET_KEY)):
+            refresh = get_tokens_for_user(self.user)['refresh']
+
+        response = self.client.post('/api/auth/token/refresh/', {'refresh': refresh})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        with override_settings(JWT_ACCEPT_HS256=True):
+            keys.install_token_backend()
+        response = self.client.post('/api/auth/token/refresh/', {'refresh': refresh})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(jwt.get_unverified_header(response.data['access'])['kid'], 'new')
+
+
+class TokenVerifyBatchTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            full_name='Test User',
+            password='TestPassword123!'
+        )
+
+    def test_batch_verify(self):
+        """Test each token in a batch gets its own verdict"""
+        tokens = get_tokens_for_user(self.user)
+        response = self.client.post('/api/auth/token/verify/batch/', {
+            'tokens': [tokens['access'], 'not-a-token', tokens['refresh']],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        access, invalid, refresh = response.data['results']
+        self.assertTrue(access['valid'])
+        self.assertEqual(access['token_type'], 'access')
+        self.assertEqual(access['claims']['user_id'], str(self.user.id))
+        self.assertEqual(access['expires_at'], access['claims']['exp'])
+        self.assertEqual(invalid, {'valid': False, 'error': 'Token is invalid'})
+        self.assertEqual(refresh['token_type'], 'refresh')
+
+    def test_batch_size_limit(self):
+        """Test batches over the configured size are rejected"""
+        access = get_tokens_for_user(self.user)['access']
+        response = self.client.post('/api/auth/token/verify/batch/', {
+            'tokens': [access] * 101,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@rotating
+class RefreshRotationTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            full_name='Test User',
+            password='TestPassword123!'
+        )
+        self.tokens = get_tokens_for_user(self.user)
+
+    def refresh(self, token):
+        return self.client.post('/api/auth/token/refresh/', {'refresh': token})
+
+    def test_per_process_cache_warning(self):
+        """Test rotation with a per-process cache is flagged at startup"""
+        self.assertEqual([w.id for w in check_shared_token_store(None)], ['users.W001'])
+        with mock.patch.object(api_settings, 'ROTATE_REFRESH_TOKENS', False):
+            self.assertEqual(check_shared_token_store(None), [])
+
+    def test_refresh_rotates_token(self):
+        """Test refreshing returns a new refresh token and retires the old one"""
+        response = self.refresh(self.tokens['refresh'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('access', response.data)
+        self.assertNotEqual(response.data['refresh'], self.tokens['refresh'])
+
+        response = self.refresh(response.data['refresh'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_reuse_revokes_family(self):
+        """Test replaying a rotated refresh token revokes every token in its family"""
+        rotated = self.refresh(self.tokens['refresh']).data
+
+        response = self.refresh(self.tokens['refresh'])
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        response = self.refresh(rotated['refresh'])
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {rotated['access']}")
+        response = self.client.get('/api/auth/profile/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_logout_revokes_family(self):
+        """Test logging out invalidates the session's refresh and access tokens"""
+        response = self.client.post('/api/auth/logout/', {'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(self.refresh(self.tokens['refresh']).status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post('/api/auth/token/verify/', {'token': self.tokens['access']})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_other_sessions_unaffected(self):
+        """Test revoking one family leaves the user's other logins valid"""
+        other = get_tokens_for_user(self.user)
+        self.client.post('/api/auth/logout/', {'refresh': self.tokens['refresh']})
+        self.assertEqual(self.refresh(other['refresh']).status_code, status.HTTP_200_OK)
+
+    @override_settings(REFRESH_TOKEN_STORE=dict(settings.REFRESH_TOKEN_STORE, BLOOM_CAPACITY=8))
+    def test_catch_up_loads_whole_log(self):
+        """Test a new process sees every live revocation, however many there are"""
+        cache.clear()
+        families = [f'family-{i}' for i in range(20)]
+        for family in families:
+            refresh_store.revoke(family)
+        store = RefreshTokenStore()
+        self.assertTrue(all(store.is_revoked(family) for family in families))
+        self.assertFalse(store.is_revoked('other'))
+        self.assertGreaterEqual(store._bloom.capacity, 20)
+
+        # Filling the filter rebuilds it bigger rather than dropping entries.
+        for i in range(20, 40):
+            refresh_store.revoke(f'family-{i}')
+        store.sync(force=True)
+        self.assertTrue(store._bloom.is_full)
+        store.sync(force=True)
+        self.assertGreaterEqual(store._bloom.capacity, 40)
+        self.assertTrue(store.is_revoked(families[0]))
+
+    def test_unsynced_filter_asks_cache(self):
+        """Test a store that couldn't sync fails closed while the cache is down"""
+        store = RefreshTokenStore()
+        with mock.patch.object(cache, 'get', side_effect=RedisConnectionError()):
+            with self.assertRaises(TokenStoreUnavailable):
+                store.is_revoked('family')
+        store.sync(force=True)
+        self.assertFalse(store.is_revoked('family'))
+
+
+class BloomFilterTestCase(TestCase):
+    def test_membership(self):
+        """Test added items are always found and others rarely are"""
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add(f'member-{i}')
+        self.assertTrue(all(f'member-{i}' in bloom for i in range(1000)))
+        false_positives = sum(f'other-{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+        self.assertTrue(bloom.is_full)
+
+
+class CommonPasswordValidatorTestCase(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def test_build_in_runs(self):
+        """Test a list sorted in several spilled runs matches one sorted in memory"""
+        with open(self.path('passwords.txt'), 'w') as f:
+            f.write('\n'.join(f'Password{i % 700}' for i in range(1000)))
+        build_password_list(read_passwords(self.path('passwords.txt')), self.path('runs.bin'), run_size=100)
+        build_password_list(read_passwords(self.path('passwords.txt')), self.path('one.bin'))
+        with open(self.path('runs.bin'), 'rb') as runs, open(self.path('one.bin'), 'rb') as one:
+            self.assertEqual(runs.read(), one.read())
+
+        passwords = PasswordList.open(self.path('runs.bin'))
+        self.addCleanup(passwords.close)
+        self.assertEqual(len(passwords), 700)
+        self.assertTrue(all(password_hash(f'password{i}') in passwords for i in range(700)))
+        self.assertFalse(any(password_hash(f'password{i}') in passwords for i in range(700, 2000)))
+
+    def test_validator(self):
+        """Test passwords and SHA-1 hashes from the built list are rejected"""
+        with open(self.path('passwords.txt'), 'w') as f:
+            f.write('  Hunter2 \n\nletmein\n')
+        with open(self.path('sha1.txt'), 'w') as f:
+            f.write(f'{hashlib.sha1(b"Breached99!").hexdigest().upper()}:42\n')
+        call_command('build_password_list', self.path('passwords.txt'), '--sha1', self.path('sha1.txt'),
+                     '--output', self.path('list.bin'), stdout=io.StringIO())
+        validator = CommonPasswordValidator(self.path('list.bin'))
+        self.addCleanup(validator.passwords.close)
+
+        for password in ('hunter2', 'HUNTER2 ', 'LetMeIn', 'Breached99!'):
+            with self.assertRaises(ValidationError) as cm:
+                validator.validate(password)
+            self.assertEqual(cm.exception.code, 'password_too_common')
+        validator.validate('breached99!')
+        validator.validate('Uncommon-Password-123')
+
+    def test_default_list(self):
+        """Test Django's list is used when the file hasn't been built"""
+        with self.assertLogs('users.validators', 'WARNING'):
+            validator = CommonPasswordValidator(self.path('missing.bin'))
+        self.assertEqual(len(validator.passwords), 19640)
+        with self.assertRaises(ValidationError):
+            validator.validate('password')
+        validator.validate('Uncommon-Password-123')
+
+    def test_invalid_hashes(self):
+        """Test a malformed SHA-1 list fails the build and keeps the old file"""
+        with open(self.path('sha1.txt'), 'w') as f:
+            f.write('not-a-hash:1\n')
+        with open(self.path('list.bin'), 'wb') as f:
+            f.write(b'old')
+        with self.assertRaises(CommandError):
+            call_command('build_password_list', '--sha1', self.path('sha1.txt'), '--output', self.path('list.bin'))
+        with open(self.path('list.bin'), 'rb') as f:
+            self.assertEqual(f.read(), b'old')
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ['list.bin', 'sha1.txt'])
+
+
+class LogoutAllTestCase(APITestCase):
+    def setUp(self):
+        reset_shared_state()
+        self.addCleanup(reset_shared_state)
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            full_name='Test User',
+            password='TestPassword123!'
+        )
+
+    def test_logout_all_revokes_every_session(self):
+        """Test logging out everywhere revokes all of the user's tokens"""
+        first = get_tokens_for_user(self.user)
+        second = get_tokens_for_user(self.user)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {first['access']}")
+        response = self.client.post('/api/auth/logout-all/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {second['access']}")
+        self.assertEqual(self.client.get('/api/auth/profile/').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials()
+        response = self.client.post('/api/auth/token/refresh/', {'refresh': second['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        # Logging in again works and stays at zero queries per request.
+        fresh = get_tokens_for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {fresh['access']}")
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/auth/profile/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_tokens_issued_at_latest_generation(self):
+        """Test a login right after a bump on another worker isn't stamped with a stale generation"""
+        self.assertEqual(token_generations.current(self.user.id), 0)
+        TokenGenerationStore().bump(self.user.id)
+        tokens = get_tokens_for_user(self.user)
+        token_generations._local.clear()
+        response = self.client.post('/api/auth/token/verify/', {'token': tokens['access']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_unknown_generation_fails_closed(self):
+        """Test tokens are refused while the store is down unless this process has seen their generation"""
+        tokens = get_tokens_for_user(self.user)
+        token_generations._local.clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        with mock.patch.object(cache, 'get', side_effect=RedisConnectionError()):
+            self.assertEqual(self.client.get('/api/auth/profile/').status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(self.client.get('/api/auth/profile/').status_code, status.HTTP_200_OK)
+        with mock.patch.object(cache, 'get', side_effect=RedisConnectionError()):
+            token_generations._local[str(self.user.id)] = (0, 0)
+            self.assertEqual(self.client.get('/api/auth/profile/').status_code, status.HTTP_200_OK)
+
+    def test_generation_survives_refresh_lifetime(self):
+        """Test a second logout-all after the refresh lifetime still revokes tokens of the first"""
+        token_generations.bump(self.user.id)
+        tokens = get_tokens_for_user(self.user)
+        later = time.time() + api_settings.REFRESH_TOKEN_LIFETIME.total_seconds() + 60
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later):
+            token_generations._local.clear()
+            self.assertEqual(token_generations.bump(self.user.id), 2)
+        token_generations._local.clear()
+        response = self.client.post('/api/auth/token/verify/', {'token': tokens['access']})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_reset_revokes_tokens(self):
+        """Test tokens issued before a password reset stop working"""
+        tokens = get_tokens_for_user(self.user)
+        serializer = ResetPasswordSerializer()
+        serializer.create({'user_id': self.user.id, 'new_password': 'NewPassword123!'})
+
+        response = self.client.post('/api/auth/token/verify/', {'token': tokens['access']})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_reset_needs_revocation(self):
+        """Test the password is left unchanged when old tokens can't be revoked"""
+        tokens = get_tokens_for_user(self.user)
+        token = generate_password_reset_token(self.user.id)
+        data = {'token': token, 'new_password': 'NewPassword123!', 'new_password2': 'NewPassword123!'}
+        with mock.patch.object(token_generations, 'bump', side_effect=TokenStoreUnavailable()):
+            response = self.client.post('/api/auth/reset-password/', data)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn('Password not changed', response.data['error'])
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('TestPassword123!'))
+        response = self.client.post('/api/auth/token/verify/', {'token': tokens['access']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class RateLimitTestCase(APITestCase):
+    def setUp(self):
+        reset_shared_state()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            full_name='Test User',
+            password='TestPassword123!'
+        )
+
+    def test_login_limited_per_ip(self):
+        """Test the sixth login in a minute from one IP is refused with Retry-After"""
+        for i in range(5):
+            response = self.client.post('/api/auth/login/', {'email': f'user{i}@example.com', 'password': 'x'})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/api/auth/login/', {'email': 'test@example.com', 'password': 'TestPassword123!'})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+
+    def test_login_limited_per_account(self):
+        """Test one account can't be hammered from many IPs"""
+        for i in range(10):
+            response = self.client.post(
+                '/api/auth/login/', {'email': 'test@example.com', 'password': 'x'}, REMOTE_ADDR=f'10.0.0.{i}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(
+            '/api/auth/login/', {'email': 'Test@example.com', 'password': 'x'}, REMOTE_ADDR='10.0.1.1')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_body_not_an_object(self):
+        """Test a JSON list or scalar body is a 400 rather than a server error"""
+        for url in ('/api/auth/login/', '/api/auth/forgot-password/'):
+            for body in (['test@example.com'], 'test@example.com'):
+                response = self.client.post(url, body, format='json')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, (url, body))
+
+    def test_shared_memory_table_is_all_or_nothing(self):
+        """Test a refusal from one limit doesn't consume the others"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        table = SharedMemoryTable(f'{directory.name}/table', slots=64)
+        tight = ('tight', *parse_rate('1/m'))
+        loose = ('loose', *parse_rate('2/m'))
+
+        self.assertTrue(table.check([tight, loose]).allowed)
+        result = table.check([loose, tight])
+        self.assertFalse(result.allowed)
+        self.assertEqual(result.key, 'tight')
+        self.assertTrue(table.check([loose]).allowed)
+        self.assertFalse(table.check([loose]).allowed)
+
+    def test_script_args_at_least_one_millisecond(self):
+        """Test rates over 1000/s still send Redis a nonzero interval"""
+        keys, args = rate_limiter._script_args([('fast', *parse_rate('5000/s'))])
+        self.assertEqual(keys, ['ratelimit:fast'])
+        self.assertEqual(args, [1, 1000])
+
+
+class LastLoginTrackerTestCase(APITestCase):
+    def setUp(self):
+        reset_shared_state()
+        self.addCleanup(reset_shared_state)
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            full_name='Test User',
+            password='TestPassword123!'
+        )
+
+    def test_login_recorded_on_flush(self):
+        """Test logins update last_login only when flushed"""
+        self.assertIsNone(self.user.last_login)
+        response = self.client.post('/api/auth/login/', {'email': 'test@example.com', 'password': 'TestPassword123!'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertIsNone(self.user.last_login)
+
+        out = io.StringIO()
+        call_command('flush_last_login', stdout=out)
+        self.assertIn('1 users', out.getvalue())
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+        self.assertEqual(last_login_tracker.flush(), 0)
+
+    def test_flush_batches_and_never_goes_backwards(self):
+        """Test flushing writes in batches and keeps the newest login time"""
+        users = [self.user] + [
+            User.objects.create_user(email=f'user{i}@example.com', password='TestPassword123!') for i in range(4)
+        ]
+        now = time.time()
+        for user in users:
+            last_login_tracker.record(user.id, now)
+        last_login_tracker.record(self.user.id, now - 60)
+        with override_settings(LAST_LOGIN_TRACKER=dict(settings.LAST_LOGIN_TRACKER, BATCH_SIZE=2)):
+            with self.assertNumQueries(3):
+                self.assertEqual(last_login_tracker.flush(), 5)
+        for user in users:
+            user.refresh_from_db()
+            self.assertAlmostEqual(user.last_login.timestamp(), now, places=3)
+
+        last_login_tracker.record(self.user.id, now - 3600)
+        last_login_tracker.flush()
+        self.user.refresh_from_db()
+        self.assertAlmostEqual(self.user.last_login.timestamp(), now, places=3)
+
+    def test_profile_and_password_saves_keep_newer_last_login(self):
+        """Test updating the profile or password doesn't write back a stale last_login"""
+        stale = User.objects.get(id=self.user.id)
+        flushed = timezone.now()
+        User.objects.filter(id=self.user.id).update(last_login=flushed)
+
+        profile = serializers.UserProfileSerializer(stale, data={'full_name': 'Renamed'}, partial=True)
+        profile.is_valid(raise_exception=True)
+        profile.save()
+        with mock.patch.object(User.objects, 'get', return_value=stale):
+            ResetPasswordSerializer().create({'user_id': self.user.id, 'new_password': 'NewPassword123!'})
+        with mock.patch.object(User.objects, 'aget', mock.AsyncMock(return_value=stale)):
+            async_to_sync(ResetPasswordSerializer().acreate)(
+                {'user_id': self.user.id, 'new_password': 'NewPassword456!'})
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.full_name, 'Renamed')
+        self.assertTrue(self.user.check_password('NewPassword456!'))
+        self.assertEqual(self.user.last_login, flushed)
+
+    def test_save_does_not_touch_last_login(self):
+        """Test saving a user leaves last_login alone"""
+        self.user.full_name = 'Renamed'
+        self.user.save()
+        self.user.refresh_from_db()
+        self.assertIsNone(self.user.last_login)
+
+
+class ProfileCacheTestCase(APITestCase):
+    def setUp(self):
+        reset_shared_state()
+        self.addCleanup(reset_shared_state)
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            full_name='Test User',
+            password='TestPassword123!'
+        )
+        access = get_tokens_for_user(self.user)['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    def test_conditional_get(self):
+        """Test profile responses carry an ETag and honour If-None-Match"""
+        response = self.client.get('/api/auth/profile/')
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+
+        with mock.patch.object(serializers.UserProfileSerializer, 'to_representation') as to_representation:
+            response = self.client.get('/api/auth/profile/', HTTP_IF_NONE_MATCH=etag)
+        to_representation.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_update_invalidates_cache(self):
+        """Test updating the profile serves the new data despite the old token claims"""
+        etag = self.client.get('/api/auth/profile/')['ETag']
+        response = self.client.put('/api/auth/update-profile/', {
+            'email': 'new@example.com',
+            'full_name': 'New Name',
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/auth/profile/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['email'], 'new@example.com')
+        self.assertNotEqual(response['ETag'], etag)
+
+        # Other processes see the new version once their local entry expires.
+        profile_cache._local.clear()
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/auth/profile/')
+        self.assertEqual(response.data['full_name'], 'New Name')
+
+
+@rotating
+class AsyncViewsTestCase(TestCase):
+    def setUp(self):
+        reset_shared_state()
+        self.addCleanup(reset_shared_state)
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            full_name='Test User',
+            password='TestPassword123!'
+        )
+
+    def test_auth_endpoints_are_async(self):
+        """Test the public auth endpoints run as coroutines"""
+        for view in (views.RegisterView, views.LoginView, views.UserProfileView, views.ForgotPasswordView,
+                     views.ResetPasswordView, views.TokenRefreshView, views.TokenVerifyView):
+            self.assertTrue(view.view_is_async, view)
+
+    async def test_login_refresh_verify_profile(self):
+        """Test the full token flow through the async views"""
+        client = AsyncClient()
+        response = await client.post('/api/auth/login/', {'email': 'test@example.com', 'password': 'TestPassword123!'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        tokens = response.json()['jwt_token']
+
+        response = await client.post('/api/auth/token/refresh/', {'refresh': tokens['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        access = response.json()['access']
+
+        response = await client.post('/api/auth/token/verify/', {'token': access})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = await client.get('/api/auth/profile/', headers={'Authorization': f'Bearer {access}'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['email'], 'test@example.com')
+
+        # The consumed refresh token is rejected.
+        response = await client.post('/api/auth/token/refresh/', {'refresh': tokens['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_async_reset_token_store(self):
+        """Test async reset tokens are single-use"""
+        # As under ASGI; async tests otherwise run in a loop of their own.
+        with mock.patch('users.reset_tokens.in_temporary_loop', return_value=False):
+            token = await PasswordResetTokenStore().acreate(self.user.id)
+            self.assertEqual(await averify_password_reset_token(token), str(self.user.id))
+            self.assertIsNone(await averify_password_reset_token(token))
+
+    @override_settings(REDIS_URL='redis://127.0.0.1:1/0')
+    def test_wsgi_uses_sync_redis(self):
+        """Test async views served over WSGI use the sync Redis client rather than one per request"""
+        with mock.patch('users.async_redis.InstrumentedAsyncRedis.from_url') as from_url:
+            response = self.client.post('/api/auth/login/', {'email': 'test@example.com', 'password': 'TestPassword123!'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self.client.post('/api/auth/forgot-password/', {'email': 'test@example.com'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self.client.post('/api/auth/reset-password/', {
+                'token': response.data['token'], 'new_password': 'NewPassword123!', 'new_password2': 'NewPassword123!'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        from_url.assert_not_called()
+
+    def test_async_rate_limiter_falls_back(self):
+        """Test the async limiter uses shared memory when Redis fails"""
+        redis_conn = mock.Mock()
+        redis_conn.register_script.return_value = mock.AsyncMock(side_effect=RedisConnectionError())
+        with mock.patch('users.ratelimit.get_async_redis', return_value=redis_conn), \
+                mock.patch.object(rate_limiter, '_async_script', None):
+            results = [asyncio.run(rate_limiter.acheck([('async-test', '2/m')])) for _ in range(3)]
+        self.assertEqual([result.allowed for result in results], [True, True, False])
+        self.assertEqual(redis_breaker.failures, 3)
+
+
+class MetricsTestCase(APITestCase):
+    def setUp(self):
+        reset_shared_state()
+        self.addCleanup(reset_shared_state)
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            full_name='Test User',
+            password='TestPassword123!'
+        )
+
+    @staticmethod
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_login_records_latency_hashing_and_signing(self):
+        """Test a login is reflected in the request, hashing and JWT metrics"""
+        route = {'method': 'POST', 'route': 'api/auth/login/', 'status': '200'}
+        before = {
+            'requests': self.sample('http_request_duration_seconds_count', **route),
+            'hashes': self.sample('password_hash_duration_seconds_count', operation='verify'),
+            'signs': self.sample('jwt_duration_seconds_count', operation='sign'),
+            'queries': self.sample('http_request_db_queries_sum', route='api/auth/login/'),
+        }
+        response = self.client.post('/api/auth/login/', {'email': 'test@example.com', 'password': 'TestPassword123!'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(self.sample('http_request_duration_seconds_count', **route), before['requests'] + 1)
+        self.assertEqual(self.sample('password_hash_duration_seconds_count', operation='verify'), before['hashes'] + 1)
+        self.assertGreater(self.sample('jwt_duration_seconds_count', operation='sign'), before['signs'])
+        self.assertEqual(self.sample('http_request_db_queries_sum', route='api/auth/login/'), before['queries'] + 1)
+
+        with override_settings(DEBUG=True):
+            response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b'http_request_duration_seconds_bucket{', response.content)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_metrics_token(self):
+        """Test /metrics requires the bearer token when one is configured"""
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_metrics_hidden_without_token(self):
+        """Test /metrics isn't served without a token outside DEBUG"""
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_404_NOT_FOUND)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_dead_workers_dropped_from_live_gauges(self):
+        """Test a scrape drops the live gauges of workers that have exited"""
+        exited = subprocess.Popen(['true'])
+        exited.wait()
+        with tempfile.TemporaryDirectory() as path:
+            names = [f'gauge_livesum_{exited.pid}.db', f'gauge_livesum_{os.getpid()}.db', f'counter_{exited.pid}.db']
+            for name in names:
+                MmapedDict(os.path.join(path, name)).close()
+            with mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': path}):
+                response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(sorted(os.listdir(path)), sorted(names[1:]))
+
+    def test_rate_limit_rejections_counted(self):
+        """Test 429s are counted by limit group and scope"""
+        before = self.sample('ratelimit_rejections_total', group='login', scope='ip')
+        for i in range(6):
+            response = self.client.post('/api/auth/login/', {'email': f'user{i}@example.com', 'password': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.sample('ratelimit_rejections_total', group='login', scope='ip'), before + 1)
+
+    def test_reset_token_fallback_counted(self):
+        """Test falling back from Redis to the database is counted"""
+        before = self.sample('redis_fallbacks_total', component='reset_tokens')
+        redis_conn = mock.Mock()
+        redis_conn.set.side_effect = RedisConnectionError()
+        with mock.patch('users.reset_tokens.get_redis_connection', return_value=redis_conn):
+            PasswordResetTokenStore(breaker=CircuitBreaker('redis')).create(self.user.id)
+        self.assertEqual(self.sample('redis_fallbacks_total', component='reset_tokens'), before + 1)
+
+    def test_database_pool_instrumented(self):
+        """Test pooled checkouts record wait time, timeouts and pool saturation"""
+        from psycopg_pool import PoolTimeout
+
+        from core.db.postgresql.base import DatabaseWrapper
+
+        pool = mock.Mock()
+        pool.get_stats.return_value = {'pool_size': 4, 'pool_available': 1, 'pool_max': 10, 'requests_waiting': 3}
+        wrapper = DatabaseWrapper(dict(settings.DATABASES['default'], OPTIONS={'pool': {}}), alias='pooltest')
+        waits = self.sample('db_pool_wait_seconds_count', alias='pooltest')
+        with mock.patch.object(DatabaseWrapper, 'pool', new_callable=mock.PropertyMock, return_value=pool), \
+                mock.patch('django.db.backends.postgresql.base.DatabaseWrapper.get_new_connection',
+                           side_effect=[mock.sentinel.connection, PoolTimeout()]):
+            self.assertIs(wrapper.get_new_connection({}), mock.sentinel.connection)
+            with self.assertRaises(PoolTimeout):
+                wrapper.get_new_connection({})
+
+        self.assertEqual(self.sample('db_pool_wait_seconds_count', alias='pooltest'), waits + 2)
+        self.assertEqual(self.sample('db_pool_timeouts_total', alias='pooltest'), 1)
+        self.assertEqual(self.sample('db_pool_connections', alias='pooltest', state='open'), 4)
+        self.assertEqual(self.sample('db_pool_connections', alias='pooltest', state='idle'), 1)
+        self.assertEqual(self.sample('db_pool_waiting_requests', alias='pooltest'), 3)
+
+
+class DiagnosticsTestCase(APITestCase):
+    def setUp(self):
+        reset_shared_state()
+        self.addCleanup(reset_shared_state)
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            full_name='Test User',
+            password='TestPassword123!'
+        )
+        self.credentials = {'email': 'test@example.com', 'password': 'TestPassword123!'}
+
+    def diagnostics(self, **overrides):
+        return override_settings(REQUEST_DIAGNOSTICS=dict(settings.REQUEST_DIAGNOSTICS, **overrides))
+
+    def test_server_timing_off_by_default(self):
+        """Test Server-Timing is only sent when enabled"""
+        with self.diagnostics(SERVER_TIMING=False, DEBUG_TOKEN='debug-secret'):
+            response = self.client.post('/api/auth/login/', self.credentials)
+            self.assertNotIn('Server-Timing', response)
+            response = self.client.post('/api/auth/login/', self.credentials, HTTP_X_DEBUG_TOKEN='wrong')
+            self.assertNotIn('Server-Timing', response)
+
+    def test_server_timing_with_debug_token(self):
+        """Test a login's Server-Timing covers the database, hashing, signing and rendering"""
+        with self.diagnostics(DEBUG_TOKEN='debug-secret'):
+            response = self.client.post('/api/auth/login/', self.credentials, HTTP_X_DEBUG_TOKEN='debug-secret')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        phases = {entry.split(';')[0]: entry for entry in response['Server-Timing'].split(', ')}
+        self.assertIn('desc="1 queries"', phases['db'])
+        self.assertLessEqual({'hash', 'jwt', 'serialize', 'total'}, set(phases))
+
+    def test_sampled_profile_written(self):
+        """Test sampled requests leave a loadable pstats dump"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with self.diagnostics(PROFILE_DIR=directory.name, PROFILE_SAMPLE_RATE=1.0):
+            response = self.client.post('/api/auth/login/', self.credentials)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        [name] = os.listdir(directory.name)
+        self.assertIn('-POST-api_auth_login-200-', name)
+        stats = pstats.Stats(os.path.join(directory.name, name))
+        self.assertTrue(any(function == 'process_request' for _, _, function in stats.stats))
+
+        with self.diagnostics(PROFILE_DIR=directory.name, PROFILE_SAMPLE_RATE=0.0):
+            self.client.post('/api/auth/login/', self.credentials)
+        self.assertEqual(len(os.listdir(directory.name)), 1)
+
+
+class PrebuiltSchemaTestCase(TestCase):
+    def setUp(self):
+        schema.prebuilt_schema.cache_clear()
+        self.addCleanup(schema.prebuilt_schema.cache_clear)
+        # drf-spectacular prints its generator warnings to stderr.
+        quiet = contextlib.redirect_stderr(io.StringIO())
+        quiet.__enter__()
+        self.addCleanup(quiet.__exit__, None, None, None)
+
+    def test_serves_generated_schema(self):
+        """Test the schema views use the file hashed by collectstatic"""
+        source = tempfile.TemporaryDirectory()
+        static_root = tempfile.TemporaryDirectory()
+        self.addCleanup(source.cleanup)
+        self.addCleanup(static_root.cleanup)
+        call_command('generate_openapi_schema', output_dir=source.name, stdout=io.StringIO())
+        with override_settings(
+            STATICFILES_DIRS=[source.name],
+            STATIC_ROOT=static_root.name,
+            STORAGES=dict(settings.STORAGES, staticfiles={
+                'BACKEND': 'django.contrib.staticfiles.storage.ManifestStaticFilesStorage'}),
+        ):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            with mock.patch('drf_spectacular.generators.SchemaGenerator.get_schema') as get_schema:
+                response = self.client.get('/api/schema/', {'format': 'json'})
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertIn('/api/auth/login/', response.json()['paths'])
+                self.assertIn('max-age=', response['Cache-Control'])
+                response = self.client.get('/api/schema/', {'format': 'json'}, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+                response = self.client.get('/api/docs/')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertRegex(response.content.decode(), r'/static/openapi/schema\.[0-9a-f]{12}\.json')
+            get_schema.assert_not_called()
+
+    def test_falls_back_to_introspection(self):
+        """Test the schema is generated on request when none was built"""
+        with override_settings(STATICFILES_DIRS=[]):
+            response = self.client.get('/api/schema/', {'format': 'json'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('/api/auth/login/', response.json()['paths'])
+
+
+class APIProfileTestCase(APITestCase):
+    def setUp(self):
+        reset_shared_state()
+        self.user = User.objects.create_user(
+            email='test@example.com',
+            full_name='Test User',
+            password='TestPassword123!'
+        )
+
+    def test_api_profile_serves_only_the_api(self):
+        """Test the API-node URLconf and middleware serve auth but not admin or docs"""
+        from core import settings_api
+        with override_settings(ROOT_URLCONF=settings_api.ROOT_URLCONF, MIDDLEWARE=settings_api.MIDDLEWARE):
+            response = self.client.post('/api/auth/login/', {'email': 'test@example.com', 'password': 'TestPassword123!'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('sessionid', response.cookies)
+            access = response.json()['jwt_token']['access']
+            response = self.client.get('/api/auth/profile/', HTTP_AUTHORIZATION=f'Bearer {access}')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            for path in ('/admin/', '/api/docs/', '/api/schema/'):
+                self.assertEqual(self.client.get(path).status_code, status.HTTP_404_NOT_FOUND, path)
+
+
+class ImportUsersTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        User.objects.create_user(email='existing@example.com', full_name='Existing', password='TestPassword123!')
+        self.hashed = make_password('Imported123!')
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_import_csv(self):
+        """Test importing plain and pre-hashed passwords, skipping duplicates and invalid rows"""
+        path = self.write('users.csv', '\n'.join([
+            'email,full_name,password,password_hash,is_active',
+            f'one@EXAMPLE.com,One,,{self.hashed},',
+            'two@example.com,Two,Plain123!,,false',
+            'existing@example.com,Dup,Plain123!,,',
+            'one@example.com,Dup in file,,' + self.hashed + ',',
+            'not-an-email,Bad,Plain123!,,',
+            'three@example.com,Three,,md5$unknown,',
+            '',
+        ]))
+        rejects = os.path.join(self.directory.name, 'rejects.csv')
+        out = io.StringIO()
+        call_command('import_users', path, '--workers', '1', '--rejects', rejects, stdout=out)
+
+        self.assertIn('Imported 2 users from 6 rows: 2 duplicate emails, 2 rejected.', out.getvalue())
+        one = User.objects.get(email='one@example.com')
+        self.assertTrue(one.check_password('Imported123!'))
+        self.assertTrue(one.is_active)
+        two = User.objects.get(email='two@example.com')
+        self.assertTrue(two.check_password('Plain123!'))
+        self.assertFalse(two.is_active)
+        self.assertEqual(User.objects.get(email='existing@example.com').full_name, 'Existing')
+        with open(rejects) as f:
+            self.assertEqual([line.split(',')[0] for line in f.read().splitlines()], ['3', '4', '5', '6'])
+
+    def test_resume_from_checkpoint(self):
+        """Test a checkpointed import resumes after the last written batch"""
+        lines = [json.dumps({'email': f'user{i}@example.com', 'password_hash': self.hashed}) for i in range(5)]
+        path = self.write('users.jsonl', '\n'.join(lines[:3]) + '\n')
+        checkpoint = os.path.join(self.directory.name, 'checkpoint.json')
+        call_command('import_users', path, '--workers', '0', '--batch-size', '2', '--checkpoint', checkpoint,
+                     stdout=io.StringIO())
+        # The input grows (or the first run was interrupted); rows already
+        # done are skipped, not re-read as duplicates.
+        self.write('users.jsonl', '\n'.join(lines) + '\n')
+        out = io.StringIO()
+        call_command('import_users', path, '--workers', '0', '--batch-size', '2', '--checkpoint', checkpoint,
+                     stdout=out)
+        self.assertIn('Resumed after row 3.', out.getvalue())
+        self.assertIn('Imported 5 users from 5 rows: 0 duplicate emails, 0 rejected.', out.getvalue())
+        self.assertEqual(User.objects.filter(email__startswith='user').count(), 5)
+
+    def test_reject_unreadable_rows(self):
+        """Test malformed JSON lines and overlong names are rejected without failing their batch"""
+        path = self.write('users.jsonl', '\n'.join([
+            json.dumps({'email': 'one@example.com', 'password_hash': self.hashed}),
+            '{"email": "broken@example.com",',
+            json.dumps(['not', 'an', 'object']),
+            json.dumps({'email': 'long@example.com', 'full_name': 'x' * 256, 'password_hash': self.hashed}),
+            json.dumps({'email': 'two@example.com', 'full_name': 'x' * 255, 'password_hash': self.hashed}),
+        ]) + '\n')
+        rejects = os.path.join(self.directory.name, 'rejects.csv')
+        out = io.StringIO()
+        call_command('import_users', path, '--workers', '0', '--rejects', rejects, stdout=out)
+
+        self.assertIn('Imported 2 users from 5 rows: 0 duplicate emails, 3 rejected.', out.getvalue())
+        self.assertFalse(User.objects.filter(email='long@example.com').exists())
+        with open(rejects) as f:
+            reasons = {row[0]: row[2] for row in csv.reader(f)}
+        self.assertEqual(sorted(reasons), ['2', '3', '4'])
+        self.assertTrue(reasons['2'].startswith('invalid JSON'))
+        self.assertEqual(reasons['3'], 'not a JSON object')
+
+    def test_reject_values_too_long_for_their_columns(self):
+        """Test emails and password hashes longer than their columns are rejected per row"""
+        long_email = 'a' * 64 + '@' + '.'.join(['b' * 63] * 3) + '.com'
+        path = self.write('users.jsonl', '\n'.join([
+            json.dumps({'email': long_email, 'password_hash': self.hashed}),
+            json.dumps({'email': 'hash@example.com', 'password_hash': self.hashed + 'x' * 128}),
+            json.dumps({'email': 'one@example.com', 'password_hash': self.hashed}),
+        ]) + '\n')
+        rejects = os.path.join(self.directory.name, 'rejects.csv')
+        out = io.StringIO()
+        call_command('import_users', path, '--workers', '0', '--rejects', rejects, stdout=out)
+
+        self.assertIn('Imported 1 users from 3 rows: 0 duplicate emails, 2 rejected.', out.getvalue())
+        with open(rejects) as f:
+            reasons = [row[2] for row in csv.reader(f)]
+        self.assertEqual(reasons, ['email longer than 254 characters', 'password_hash longer than 128 characters'])
+
+
+@override_settings(SERVICE_API_KEYS={'search': 'search-key', 'billing': 'billing-key'})
+class UserLookupTestCase(APITestCase):
+    def setUp(self):
+        reset_shared_state()
+        self.users = [
+            User.objects.create_user(email=f'user{i}@example.com', full_name=f'User {i}', password='TestPassword123!')
+            for i in range(3)
+        ]
+        self.url = '/api/auth/users/lookup/'
+        self.auth = {'HTTP_AUTHORIZATION': 'Service billing-key'}
+
+    def test_service_key_required(self):
+        """Test the lookup rejects anonymous requests, user tokens and unknown keys"""
+        body = {'ids': [self.users[0].id]}
+        response = self.client.post(self.url, body, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response['WWW-Authenticate'], 'Service')
+        access = get_tokens_for_user(self.users[0])['access']
+        response = self.client.post(self.url, body, format='json', HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post(self.url, body, format='json', HTTP_AUTHORIZATION='Service wrong-key')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_lookup_by_ids_and_emails(self):
+        """Test ids and emails resolve in one query, in request order, with misses reported"""
+        first, second, third = self.users
+        body = {'ids': [third.id, first.id, 999999], 'emails': ['USER1@EXAMPLE.COM', third.email, 'nobody@example.com']}
+        with self.assertNumQueries(1):
+            response = self.client.post(self.url, body, format='json', **self.auth)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # USER1@EXAMPLE.COM keeps its local part's case, so it doesn't match.
+        self.assertEqual(response.json(), {
+            'users': [
+                {'id': third.id, 'email': third.email, 'full_name': third.full_name},
+                {'id': first.id, 'email': first.email, 'full_name': first.full_name},
+            ],
+            'missing': {'ids': [999999], 'emails': ['USER1@EXAMPLE.COM', 'nobody@example.com']},
+        })
+
+    def test_lookup_uses_profile_cache(self):
+        """Test warm profiles are served without a query, and updates invalidate them"""
+        ids = [user.id for user in self.users]
+        self.client.post(self.url, {'ids': ids}, format='json', **self.auth)
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url, {'ids': ids}, format='json', **self.auth)
+        self.assertEqual(len(response.json()['users']), 3)
+
+        # The profile endpoint shares the entries.
+        access = get_tokens_for_user(self.users[1])['access']
+        response = self.client.get('/api/auth/profile/', HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(response.json()['full_name'], 'User 1')
+
+        response = self.client.put('/api/auth/update-profile/', {'email': 'renamed@example.com', 'full_name': 'Renamed'},
+                                   format='json', HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(1):
+            response = self.client.post(self.url, {'ids': ids}, format='json', **self.auth)
+        self.assertEqual([user['full_name'] for user in response.json()['users']], ['User 0', 'Renamed', 'User 2'])
+
+    def test_msgpack(self):
+        """Test MessagePack requests and responses"""
+        response = self.client.post(self.url, msgpack.packb({'ids': [self.users[0].id]}),
+                                    content_type='application/msgpack', HTTP_ACCEPT='application/msgpack',
+                                    **self.auth)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content)['users'][0]['email'], 'user0@example.com')
+
+        response = self.client.post(self.url, b'\xc1', content_type='application/msgpack', **self.auth)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(USER_LOOKUP_MAX_SIZE=3)
+    def test_lookup_size_limits(self):
+        """Test lookups need at least one and at most USER_LOOKUP_MAX_SIZE ids and emails"""
+        response = self.client.post(self.url, {}, format='json', **self.auth)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.url, {'ids': [1, 2], 'emails': ['a@example.com', 'b@example.com']},
+                                    format='json', **self.auth)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('at most 3', response.json()['error'])
+
+
+@override_settings(STORAGES=dict(settings.STORAGES, staticfiles={
+    'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}))
+class UserListingTestCase(APITestCase):
+    def setUp(self):
+        reset_shared_state()
+        self.staff = User.objects.create_superuser(email='admin@example.com', password='TestPassword123!')
+        User.objects.bulk_create(
+            User(email=f'user{i}@example.com', full_name=f'User {i}', is_active=i % 3 != 0) for i in range(9))
+        # Ties on date_joined must be broken by id.
+        joined = timezone.now()
+        User.objects.filter(email__in=['user2@example.com', 'user3@example.com', 'user4@example.com']).update(
+            date_joined=joined)
+        self.newest_first = list(User.objects.order_by('-date_joined', '-id').values_list('id', flat=True))
+
+    def test_keyset_ordering(self):
+        """Test orderings are completed with the primary key, in the sort's direction"""
+        self.assertEqual(keyset_ordering(User.objects.order_by('date_joined')), [('date_joined', False), ('id', False)])
+        self.assertEqual(keyset_ordering(User.objects.order_by('-date_joined', 'pk', '-date_joined')),
+                         [('date_joined', True), ('id', True)])
+        self.assertEqual(keyset_ordering(User.objects.order_by('email', 'id')), [('email', False)])
+        with self.assertRaises(ValueError):
+            keyset_ordering(User.objects.order_by('last_login'))
+
+    def test_paginate_both_ways(self):
+        """Test following next and previous cursors visits every row once, in order"""
+        queryset = User.objects.order_by('-date_joined')
+        pages = [paginate(queryset, None, 3)]
+        self.assertIsNone(pages[0].previous_cursor)
+        while pages[-1].next_cursor:
+            pages.append(paginate(queryset, pages[-1].next_cursor, 3))
+        self.assertEqual([row.id for page in pages for row in page.rows], self.newest_first)
+
+        page = pages[-1]
+        backwards = []
+        while page.previous_cursor:
+            page = paginate(queryset, page.previous_cursor, 3)
+            backwards.insert(0, [row.id for row in page.rows])
+        self.assertEqual(backwards, [[row.id for row in page.rows] for page in pages[:-1]])
+
+    def test_invalid_cursors(self):
+        """Test malformed cursors, and cursors for another ordering, are rejected"""
+        queryset = User.objects.order_by('-date_joined')
+        cursor = encode_cursor(keyset_ordering(User.objects.order_by('email')), self.staff)
+        for bad in ('bogus', 'e30', cursor):
+            with self.assertRaises(InvalidCursor):
+                paginate(queryset, bad, 3)
+
+    def test_list_api(self):
+        """Test the staff user list pages with cursors and filters"""
+        url = '/api/auth/users/'
+        access = get_tokens_for_user(User.objects.get(email='user1@example.com'))['access']
+        response = self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        auth = {'HTTP_AUTHORIZATION': f'Bearer {get_tokens_for_user(self.staff)["access"]}'}
+        ids = []
+        response = self.client.get(url, {'page_size': 4}, **auth).json()
+        self.assertEqual((response['count'], response['count_exact'], response['previous']), (10, True, None))
+        while True:
+            ids += [user['id'] for user in response['results']]
+            if not response['next']:
+                break
+            response = self.client.get(response['next'], **auth).json()
+        self.assertEqual(ids, self.newest_first)
+
+        response = self.client.get(url, {'ordering': 'email', 'email': 'user', 'is_active': 'false'}, **auth).json()
+        self.assertEqual([user['email'] for user in response['results']],
+                         ['user0@example.com', 'user3@example.com', 'user6@example.com'])
+        self.assertEqual(set(response['results'][0]), set(exporter.FIELDS))
+
+        response = self.client.get(url, {'ordering': 'full_name'}, **auth)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(url, {'cursor': 'bogus'}, **auth)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_admin_changelist(self):
+        """Test the admin changelist pages with cursors and searches by email prefix or id"""
+        self.client.force_login(self.staff)
+        url = '/admin/users/user/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        changelist = response.context['cl']
+        self.assertEqual([user.id for user in changelist.result_list], self.newest_first)
+        self.assertIsNone(changelist.next_url)
+
+        with mock.patch('users.admin.UserAdmin.list_per_page', 4):
+            response = self.client.get(url)
+            next_url = response.context['cl'].next_url
+            self.assertContains(response, f'href="{next_url}"'.replace('&', '&amp;'))
+            response = self.client.get(url + next_url)
+        self.assertEqual([user.id for user in response.context['cl'].result_list], self.newest_first[4:8])
+
+        response = self.client.get(url, {'q': 'user1'})
+        self.assertEqual([user.email for user in response.context['cl'].result_list], ['user1@example.com'])
+        response = self.client.get(url, {'q': str(self.staff.id)})
+        self.assertIn(self.staff, response.context['cl'].result_list)
+        response = self.client.get(url, {'cursor': 'bogus'})
+        self.assertRedirects(response, url + '?e=1', fetch_redirect_response=False)
+
+    def test_admin_deactivation_revokes_tokens(self):
+        """Test deactivating a user in the admin revokes their tokens and profile cache"""
+        user = User.objects.get(email='user1@example.com')
+        access = get_tokens_for_user(user)['access']
+        self.client.force_login(self.staff)
+        response = self.client.post(f'/admin/users/user/{user.id}/change/', {
+            'email': user.email, 'full_name': 'Renamed', 'is_active': '',
+        })
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.client.logout()
+        response = self.client.get('/api/auth/profile/', HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_admin_privilege_change_revokes_tokens(self):
+        """Test removing staff status in the admin revokes tokens that still claim it"""
+        other = User.objects.create_user(email='other@example.com', full_name='Other', password='TestPassword123!',
+                                          is_staff=True)
+        access = get_tokens_for_user(other)['access']
+        self.client.force_login(self.staff)
+        response = self.client.post(f'/admin/users/user/{other.id}/change/', {
+            'email': other.email, 'full_name': other.full_name, 'is_active': 'on',
+        })
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.client.logout()
+        response = self.client.get('/api/auth/users/', HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class UserExportTestCase(APITestCase):
+    def setUp(self):
+        reset_shared_state()
+        self.staff = User.objects.create_user(email='staff@example.com', full_name='Staff', password='TestPassword123!',
+                                              is_staff=True)
+        self.users = [
+            User.objects.create_user(email=f'user{i}@example.com', full_name=f'User {i}', password='TestPassword123!',
+                                     is_active=i % 2 == 0)
+            for i in range(5)
+        ]
+        self.url = '/api/auth/users/export/'
+
+    def auth(self, user):
+        return {'HTTP_AUTHORIZATION': f'Bearer {get_tokens_for_user(user)["access"]}'}
+
+    def test_staff_only(self):
+        """Test the export needs a staff user"""
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.get(self.url, **self.auth(self.users[0]))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_csv_export(self):
+        """Test the CSV export streams every user in id order, without password hashes"""
+        response = self.client.get(self.url, **self.auth(self.staff))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,email,full_name,is_active,is_staff,date_joined,last_login')
+        self.assertEqual([line.split(',')[1] for line in lines[1:]],
+                         ['staff@example.com'] + [user.email for user in self.users])
+        self.assertNotIn('pbkdf2', '\n'.join(lines))
+
+    @override_settings(USER_EXPORT_CHUNK_SIZE=1)
+    def test_jsonl_filters_and_resume(self):
+        """Test filtering by is_active and date_joined, and resuming after an id"""
+        params = {'format': 'jsonl', 'is_active': 'true', 'after': self.users[0].id,
+                  'date_joined_from': '2000-01-01', 'date_joined_to': '2999-01-01T00:00:00Z'}
+        response = self.client.get(self.url, params, **self.auth(self.staff))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['id'] for row in rows], [self.users[2].id, self.users[4].id])
+
+        response = self.client.get(self.url, {'date_joined_to': '2000-01-01'}, **self.auth(self.staff))
+        self.assertEqual(b''.join(response.streaming_content).decode().count('\n'), 1)
+        response = self.client.get(self.url, {'format': 'xml'}, **self.auth(self.staff))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_async_export_streams(self):
+        """Test the export streams from an async iterator under ASGI"""
+        headers = {'Authorization': self.auth(self.staff)['HTTP_AUTHORIZATION']}
+        response = await AsyncClient().get(self.url, {'format': 'jsonl'}, headers=headers)
+        self.assertTrue(hasattr(response.streaming_content, '__aiter__'))
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual(content.count(b'\n'), 6)
+
+    def test_export_command(self):
+        """Test the command's output can be imported with import_users"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'users.csv')
+            call_command('export_users', path, '--with-password-hash', '--inactive', stderr=io.StringIO())
+            with open(path) as f:
+                content = f.read()
+            self.assertIn('password_hash', content.splitlines()[0])
+            User.objects.filter(is_active=False).delete()
+            call_command('import_users', path, '--workers', '0', stdout=io.StringIO())
+        imported = User.objects.get(email='user1@example.com')
+        self.assertFalse(imported.is_active)
+        self.assertTrue(imported.check_password('TestPassword123!'))
+
+
+class GunicornConfigTestCase(SimpleTestCase):
+    def load_config(self, **env):
+        import runpy
+        with mock.patch.dict(os.environ, env), mock.patch('gc.disable'):
+            return runpy.run_path(os.path.join(settings.BASE_DIR, 'gunicorn.conf.py'))
+
+    def test_workers_sized_from_cpus_and_memory(self):
+        """Test the default worker count is 2 * CPUs + 1, capped by memory"""
+        config = self.load_config(GUNICORN_WORKERS='', WEB_CONCURRENCY='')
+        with mock.patch.dict(config['default_workers'].__globals__, cpu_count=lambda: 4,
+                             memory_bytes=lambda: 8 * 1024 ** 3):
+            self.assertEqual(config['default_workers'](), 9)
+        with mock.patch.dict(config['default_workers'].__globals__, cpu_count=lambda: 4,
+                             memory_bytes=lambda: 512 * 1024 ** 2):
+            self.assertEqual(config['default_workers'](), 2)
+        config = self.load_config(GUNICORN_WORKERS='3', GUNICORN_PRELOAD='False')
+        self.assertEqual(config['workers'], 3)
+        self.assertFalse(config['preload_app'])
+        self.assertFalse(config['freeze_gc'])
+
+    def test_warm_up_opens_no_connections(self):
+        """Test warming up in the master loads the request path without touching the database"""
+        from core.warmup import warm_up
+        # SimpleTestCase fails any database query.
+        warm_up()
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+class ReplicaRoutingTestCase(APITestCase):
+    def setUp(self):
+        reset_shared_state()
+        self.router = routers.ReplicaRouter()
+
+    def in_request(self, fn):
+        """Run ``fn`` inside ReplicaPinningMiddleware, as a view would."""
+        return routers.ReplicaPinningMiddleware(lambda request: fn())(None)
+
+    def test_reads_use_replicas_until_the_request_writes(self):
+        """Test reads go to a replica, and to the primary once the request has written"""
+        def view():
+            reads = {self.router.db_for_read(User) for _ in range(20)}
+            self.assertEqual(self.router.db_for_write(User), 'default')
+            return reads, self.router.db_for_read(User)
+
+        reads, after_write = self.in_request(view)
+        self.assertEqual(reads, {'replica1', 'replica2'})
+        self.assertEqual(after_write, 'default')
+        # Outside a request everything uses the primary.
+        self.assertEqual(self.router.db_for_read(User), 'default')
+        self.assertFalse(self.router.allow_migrate('replica1', 'users'))
+
+    def test_recent_writes_pin_later_requests(self):
+        """Test a user written to recently is read from the primary"""
+        response = self.client.post('/api/auth/register/', {
+            'email': 'New@example.com',
+            'full_name': 'New User',
+            'password': 'TestPassword123!',
+            'password2': 'TestPassword123!',
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        user_id = response.json()['user']['id']
+
+        def view(**keys):
+            return routers.primary_pins.check(**keys), self.router.db_for_read(User)
+
+        self.assertEqual(self.in_request(lambda: view(email='new@example.com')), (True, 'default'))
+        self.assertEqual(self.in_request(lambda: view(user_id=user_id)), (True, 'default'))
+        pinned, db = self.in_request(lambda: view(user_id=user_id + 1))
+        self.assertFalse(pinned)
+        self.assertIn(db, ('replica1', 'replica2'))
+
+    def test_cache_outage_reads_from_primary(self):
+        """Test pins that can't be read send the request to the primary"""
+        with mock.patch.object(routers.PrimaryPins, 'cache', new_callable=mock.PropertyMock) as pin_cache:
+            pin_cache.return_value.get_many.side_effect = RedisConnectionError()
+            pinned, db = self.in_request(lambda: (routers.primary_pins.check(user_id=1), self.router.db_for_read(User)))
+        self.assertTrue(pinned)
+        self.assertEqual(db, 'default')
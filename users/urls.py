@@ -1,5 +1,5 @@
 from rest_framework.routers import DefaultRouter
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView, TokenVerifyView
+from rest_framework_simplejwt.views import TokenObtainPairView
 
 from django.urls import path, include
 
@@ -12,11 +12,16 @@ router.register('', views.UserProfileView, basename='profile')
 router.register('login', views.LoginView, basename='login')
 router.register('forgot-password', views.ForgotPasswordView, basename='forgot-password')
 router.register('reset-password', views.ResetPasswordView, basename='reset-password')
+router.register('logout', views.LogoutView, basename='logout')
 
 
 urlpatterns = [
     path('', include(router.urls)),
     path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
-    path('token/verify/', TokenVerifyView.as_view(), name='token_verify'),
+    path('token/refresh/', views.TokenRefreshView.as_view(), name='token_refresh'),
+    path('token/verify/', views.TokenVerifyView.as_view(), name='token_verify'),
+    path('token/verify/batch/', views.TokenVerifyBatchView.as_view(), name='token_verify_batch'),
+    path('users/', views.UserListView.as_view(), name='user_list'),
+    path('users/lookup/', views.UserLookupView.as_view(), name='user_lookup'),
+    path('users/export/', views.UserExportView.as_view(), name='user_export'),
 ]
\ No newline at end of file
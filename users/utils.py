@@ -1,15 +1,15 @@
-import os
-import secrets
-import dotenv
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from rest_framework_simplejwt import state
+from rest_framework_simplejwt.exceptions import TokenBackendError, TokenError
+from rest_framework_simplejwt.settings import api_settings
 
-from django.core.cache import cache
-from rest_framework_simplejwt.tokens import RefreshToken
-from django_redis import get_redis_connection, exceptions
-from redis.exceptions import ConnectionError
+from .models import User, UserManager
+from .profile_cache import profile_cache
+from .reset_tokens import reset_token_store
+from .tokens import UserRefreshToken, check_revocation
 
 
-dotenv.load_dotenv()
-
 def get_tokens_for_user(user):
     """
     Generate JWT tokens for the given user.
@@ -20,7 +20,7 @@ def get_tokens_for_user(user):
     Returns:
         A dictionary containing access and refresh tokens.
     """
-    refresh = RefreshToken.for_user(user)
+    refresh = UserRefreshToken.for_user(user)
     token_lifetime = refresh.lifetime
 
     return {
@@ -30,9 +30,62 @@ def get_tokens_for_user(user):
     }
 
 
+async def aget_tokens_for_user(user):
+    """See get_tokens_for_user()."""
+    # The refresh-token and generation stores use the synchronous Django cache
+    # client and never the database, so any thread will do.
+    return await sync_to_async(get_tokens_for_user, thread_sensitive=False)(user)
+
+
+def verify_tokens(tokens):
+    """
+    Verify a batch of JWTs of any type.
+
+    Every token is checked with the same token backend, so key material is
+    parsed once rather than once per token.
+
+    Args:
+        tokens: An iterable of encoded tokens.
+
+    Returns:
+        list: One dict per token, in order. Valid tokens get ``valid``,
+        ``token_type``, ``expires_at`` (epoch seconds) and ``claims``; invalid
+        ones get ``valid`` and ``error``.
+    """
+    token_backend = state.token_backend
+    token_type_claim = api_settings.TOKEN_TYPE_CLAIM
+    jti_claim = api_settings.JTI_CLAIM
+    results = []
+    for token in tokens:
+        try:
+            claims = token_backend.decode(token)
+        except TokenBackendError as e:
+            results.append({'valid': False, 'error': str(e.args[0])})
+            continue
+        if 'exp' not in claims:
+            results.append({'valid': False, 'error': "Token has no 'exp' claim"})
+            continue
+        if jti_claim is not None and jti_claim not in claims:
+            results.append({'valid': False, 'error': 'Token has no id'})
+            continue
+        try:
+            check_revocation(claims)
+        except TokenError as e:
+            results.append({'valid': False, 'error': str(e.args[0])})
+        else:
+            results.append({
+                'valid': True,
+                'token_type': claims.get(token_type_claim),
+                'expires_at': claims['exp'],
+                'claims': claims,
+            })
+    return results
+
+
 def generate_password_reset_token(user_id):
     """
-    Generate a password reset token and store it in Redis or Django Cache.
+    Generate a password reset token and store it in Redis or, when Redis is
+    unavailable, the database.
 
     Args:
         user_id: The ID of the user requesting password reset.
@@ -40,19 +93,13 @@ def generate_password_reset_token(user_id):
     Returns:
         str: The generated reset token.
     """
-    token = secrets.token_urlsafe(32)
-
-    try:
-        redis_conn = get_redis_connection("default")
-        redis_conn.setex(f"password_reset_{token}", int(os.getenv("PASSWORD_RESET_EXPIRY_SECONDS", 600)), str(user_id))
-    except (exceptions.ConnectionInterrupted, ConnectionError):
-        cache.set(f"password_reset_{token}", str(user_id), int(os.getenv("PASSWORD_RESET_EXPIRY_SECONDS", 600)))
-    return token
+    return reset_token_store.create(user_id)
 
 
 def verify_password_reset_token(token):
     """
     Verify if a password-reset token is valid and return the associated user ID.
+    A token can only be verified once.
 
     Args:
         token: The reset token to verify.
@@ -60,19 +107,63 @@ def verify_password_reset_token(token):
     Returns:
         str: The user ID if token is valid, None otherwise.
     """
-    try:
-        redis_conn = get_redis_connection("default")
-        user_id = redis_conn.get(f"password_reset_{token}")
-        if user_id:
-            redis_conn.delete(f"password_reset_{token}")
-            return user_id.decode()
-        else:
-            return None
-    except (exceptions.ConnectionInterrupted, ConnectionError):
-        user_id = cache.get(f"password_reset_{token}")
-        if user_id:
-            cache.delete(f"password_reset_{token}")
-            return user_id
-        else:
-            return None
+    return reset_token_store.consume(token)
+
+
+async def agenerate_password_reset_token(user_id):
+    """See generate_password_reset_token()."""
+    return await reset_token_store.acreate(user_id)
+
+
+async def averify_password_reset_token(token):
+    """See verify_password_reset_token()."""
+    return await reset_token_store.aconsume(token)
+
+
+def lookup_users(ids, emails, fields):
+    """
+    Look up many users by id and email at once.
 
+    Profiles of the requested ids come from the profile cache when it's warm;
+    everything else is read in one query selecting only ``fields``, and the
+    profiles it builds are cached for next time.
+
+    Args:
+        ids: User ids.
+        emails: Email addresses, normalized like registration.
+        fields: The profile's fields, as the profile cache stores them.
+
+    Returns:
+        dict: ``users``, each found user's profile once, in request order
+        (ids, then emails); and ``missing``, the ``ids`` and ``emails`` that
+        matched no user.
+    """
+    emails = {UserManager.normalize_email(email): email for email in emails}
+    by_email = {}
+
+    def build(missing):
+        if not missing and not emails:
+            return {}
+        built = {}
+        missing = set(missing)
+        rows = User.objects.filter(Q(id__in=missing) | Q(email__in=emails)).values(*fields)
+        for row in rows:
+            if row['id'] in missing:
+                built[row['id']] = row
+            if row['email'] in emails:
+                by_email[row['email']] = row
+        return built
+
+    by_id = profile_cache.get_many(ids, build)
+    users = {}
+    found = [by_id[user_id] for user_id in ids if user_id in by_id]
+    found += [by_email[email] for email in emails if email in by_email]
+    for profile in found:
+        users.setdefault(profile['id'], profile)
+    return {
+        'users': list(users.values()),
+        'missing': {
+            'ids': [user_id for user_id in ids if user_id not in by_id],
+            'emails': [original for email, original in emails.items() if email not in by_email],
+        },
+    }
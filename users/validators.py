@@ -0,0 +1,63 @@
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import password_validation
+from django.core.exceptions import ValidationError
+from django.utils.translation import gettext as _
+
+from .password_list import PasswordList, build_password_list, password_hash, read_passwords
+
+
+logger = logging.getLogger(__name__)
+
+# The list Django's CommonPasswordValidator loads.
+DJANGO_PASSWORD_LIST_PATH = Path(password_validation.__file__).resolve().parent / 'common-passwords.txt.gz'
+
+
+class CommonPasswordValidator:
+    """
+    Reject passwords found in a prebuilt password list (see
+    users/password_list.py), which every worker maps rather than loads.
+
+    The password is checked lowercased and stripped, as Django's
+    ``CommonPasswordValidator`` checks it and as plain-text lists are
+    stored, and if the list has SHA-1 hashes of breached passwords, also as
+    typed.
+
+    Without the file (before ``manage.py build_password_list`` has run, as
+    in development) Django's list is built in memory instead.
+    """
+
+    def __init__(self, path=None):
+        path = Path(path or settings.COMMON_PASSWORDS_PATH)
+        try:
+            self.passwords = PasswordList.open(path)
+        except FileNotFoundError:
+            logger.warning('%s not found; run manage.py build_password_list. Using Django\'s list.', path)
+            self.passwords = self._build_default()
+
+    @staticmethod
+    def _build_default():
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'common-passwords.bin')
+            build_password_list(read_passwords(DJANGO_PASSWORD_LIST_PATH), path)
+            with open(path, 'rb') as f:
+                return PasswordList(f.read())
+
+    def __contains__(self, password):
+        normalized = password.lower().strip()
+        return password_hash(normalized) in self.passwords or (
+            self.passwords.as_typed and normalized != password and password_hash(password) in self.passwords)
+
+    def validate(self, password, user=None):
+        if password in self:
+            raise ValidationError(self.get_error_message(), code='password_too_common')
+
+    def get_error_message(self):
+        return _('This password is too common.')
+
+    def get_help_text(self):
+        return _("Your password can't be a commonly used password.")
@@ -0,0 +1,131 @@
+"""
+Local JWT verification for services downstream of the auth service.
+
+Fetches the auth service's ``/.well-known/jwks.json`` once, keeps the parsed
+keys in memory and verifies tokens without any further network calls. The
+document is only fetched again when its cache lifetime runs out or a token
+names a ``kid`` we haven't seen (rate limited, so a flood of forged ``kid``
+values can't turn into a flood of requests).
+
+This module depends only on PyJWT (plus ``cryptography``) and the standard
+library, so other services can vendor it as-is::
+
+    verifier = JWKSVerifier('https://auth.example.com/.well-known/jwks.json')
+    claims = verifier.verify(request_token)
+"""
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import jwt
+
+
+class JWKSVerifier:
+    def __init__(self, jwks_url=None, audience=None, issuer=None, leeway=0,
+                 cache_ttl=3600, min_refresh_interval=30, timeout=5, jwks=None):
+        self.jwks_url = jwks_url
+        self.audience = audience
+        self.issuer = issuer
+        self.leeway = leeway
+        self.cache_ttl = cache_ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._etag = None
+        self._fetched_at = None
+        self._attempted_at = None
+        if jwks is not None:
+            self.load(jwks)
+
+    def load(self, jwks):
+        """
+        Replace the cached keys with those in a JWKS document.
+
+        Args:
+            jwks: The document, as a dict or JSON string/bytes.
+        """
+        if isinstance(jwks, (str, bytes)):
+            jwks = json.loads(jwks)
+        keys = {}
+        for data in jwks.get('keys', []):
+            if data.get('use', 'sig') != 'sig' or 'kid' not in data:
+                continue
+            keys[data['kid']] = jwt.PyJWK(data, algorithm=data.get('alg'))
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+
+    def refresh(self):
+        """Fetch the JWKS document, reusing the cached copy on 304."""
+        self._attempted_at = time.monotonic()
+        request = urllib.request.Request(self.jwks_url, headers={'Accept': 'application/json'})
+        if self._etag:
+            request.add_header('If-None-Match', f'"{self._etag}"')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+                etag = response.headers.get('ETag')
+        except urllib.error.HTTPError as e:
+            if e.code != 304:
+                raise
+            self._fetched_at = time.monotonic()
+            return
+        self.load(body)
+        self._etag = etag.strip('"') if etag else None
+
+    def _is_stale(self):
+        return self._fetched_at is None or time.monotonic() - self._fetched_at > self.cache_ttl
+
+    def _can_refresh(self):
+        return (
+            self.jwks_url is not None
+            and (self._attempted_at is None or time.monotonic() - self._attempted_at >= self.min_refresh_interval)
+        )
+
+    def get_key(self, kid):
+        """
+        Return the ``PyJWK`` for ``kid``, fetching the JWKS only if it is stale
+        or doesn't know ``kid`` yet.
+        """
+        key = self._keys.get(kid)
+        if (key is None or self._is_stale()) and self._can_refresh():
+            with self._lock:
+                key = self._keys.get(kid)
+                if (key is None or self._is_stale()) and self._can_refresh():
+                    try:
+                        self.refresh()
+                    except OSError:
+                        # Keep verifying with the keys we have while the
+                        # auth service is unreachable.
+                        if key is None:
+                            raise
+                    key = self._keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f'Unknown signing key {kid!r}')
+        return key
+
+    def verify(self, token, token_type='access'):
+        """
+        Verify a token's signature, expiry and type and return its claims.
+
+        Raises:
+            jwt.InvalidTokenError: If the token is invalid for any reason.
+            OSError: If the token's key isn't cached and the JWKS can't be
+                fetched.
+        """
+        kid = jwt.get_unverified_header(token).get('kid')
+        key = self.get_key(kid)
+        claims = jwt.decode(
+            token,
+            key.key,
+            algorithms=[key.algorithm_name],
+            audience=self.audience,
+            issuer=self.issuer,
+            leeway=self.leeway,
+            options={'verify_aud': self.audience is not None},
+        )
+        if token_type is not None and claims.get('token_type') != token_type:
+            raise jwt.InvalidTokenError('Token has wrong type')
+        return claims
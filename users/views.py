@@ -1,13 +1,37 @@
+import math
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
-from django_ratelimit.core import is_ratelimited
+from django.utils.http import parse_etags
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_GET
 
-from rest_framework import viewsets, mixins, status, permissions
+from adrf.views import APIView as AsyncAPIView
+from adrf.viewsets import GenericViewSet as AsyncGenericViewSet
+from rest_framework import generics, viewsets, mixins, status, permissions
 from rest_framework.decorators import action
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
-from rest_framework.exceptions import ErrorDetail
+from rest_framework.exceptions import ErrorDetail, NotFound
+from rest_framework.views import APIView
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.views import TokenViewBase
+
+from core.diagnostics import JSONRenderer
+from core.renderers import MessagePackParser, MessagePackRenderer
 
-from . import serializers
-from .models import User
+from . import exporter, serializers
+from .authentication import IsService, ServiceKeyAuthentication, get_model_user
+from .exceptions import ServiceUnavailable
+from .generations import token_generations
+from .keys import get_key_ring
+from .models import User, UserManager
+from .pagination import KeysetPagination
+from .profile_cache import profile_cache
+from .ratelimit import acheck_rate_limit
 
 
 def get_error_message(error):
@@ -35,59 +59,78 @@ def get_error_message(error):
     return str(error)
 
 
+def get_data_field(request, name):
+    """A field of the request body, or None when the body isn't an object (a JSON list, say)."""
+    return request.data.get(name) if isinstance(request.data, dict) else None
+
+
 # Create your views here.
-class RegisterView(mixins.CreateModelMixin, viewsets.GenericViewSet):
+# The public auth endpoints are async (adrf) so that under ASGI a request
+# waiting on the database, Redis or the hashing pool doesn't hold a thread.
+class RegisterView(mixins.CreateModelMixin, AsyncGenericViewSet):
     serializer_class = serializers.RegistrationSerializer
     permission_classes = [permissions.AllowAny]
 
-    def create(self, request, *args, **kwargs):
+    async def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         try:
-            serializer.is_valid(raise_exception=True)
-            self.perform_create(serializer)
+            await serializer.ais_valid(raise_exception=True)
+            await serializer.asave()
             headers = self.get_success_headers(serializer.data)
             return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+        except ServiceUnavailable as e:
+            return Response({'error': get_error_message(e)}, status=e.status_code)
         except Exception as e:
             return Response({'error': get_error_message(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class LoginView(mixins.CreateModelMixin, viewsets.GenericViewSet):
+class LoginView(mixins.CreateModelMixin, AsyncGenericViewSet):
     serializer_class = serializers.LoginSerializer
     permission_classes = [permissions.AllowAny]
 
-    def create(self, request, *args, **kwargs):
-        # Rate limit: 5 login attempts per minute per IP
-        limited = is_ratelimited(
-            request=request,
-            group='login',
-            key='ip',
-            rate='5/m',
-            method=['POST'],
-            increment=True
-        )
-        if limited:
-            return Response({'error': 'Too many login attempts. Please try again later.'}, status=429)
+    async def create(self, request, *args, **kwargs):
+        # Rate limit per IP, per account and globally (settings.RATELIMITS)
+        limit = await acheck_rate_limit(request, 'login', account=get_data_field(request, 'email'))
+        if not limit.allowed:
+            return Response(
+                {'error': 'Too many login attempts. Please try again later.'},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(math.ceil(limit.retry_after))},
+            )
 
         serializer = self.get_serializer(data=request.data)
         try:
-            serializer.is_valid(raise_exception=True)
+            await serializer.ais_valid(raise_exception=True)
             return Response(serializer.data, status=status.HTTP_200_OK)
+        except ServiceUnavailable as e:
+            return Response({'error': get_error_message(e)}, status=e.status_code)
         except Exception as e:
             return Response({'error': get_error_message(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class UserProfileView(viewsets.GenericViewSet):
+class UserProfileView(AsyncGenericViewSet):
     serializer_class = serializers.UserProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
-        return self.request.user
+        # request.user is usually a ClaimsUser built from the access token;
+        # writes need the real row.
+        return get_model_user(self.request.user)
 
     @action(detail=False, methods=['GET'])
-    def profile(self, request, *args, **kwargs):
-        instance = self.get_object()
-        serializer = self.get_serializer(instance)
-        return Response(serializer.data)
+    async def profile(self, request, *args, **kwargs):
+        def build(changed):
+            # Everything the profile shows is in the token claims, so this
+            # only touches the database if the profile changed since the
+            # token may have been issued.
+            instance = self.get_object() if changed else request.user
+            return self.get_serializer(instance).data
+
+        etag, data = await profile_cache.aget(request.user.id, build)
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(data, headers=headers)
 
     @action(detail=False, methods=['PUT'], url_path='update-profile', url_name='update-profile')
     def update_profile(self, request, *args, **kwargs):
@@ -101,53 +144,223 @@ class UserProfileView(viewsets.GenericViewSet):
         except Exception as e:
             return Response({'error': get_error_message(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['POST'], url_path='logout-all', url_name='logout-all')
+    def logout_all(self, request, *args, **kwargs):
+        # One counter bump revokes every token issued to this user so far.
+        try:
+            token_generations.bump(request.user.id)
+        except ServiceUnavailable as e:
+            return Response({'error': get_error_message(e)}, status=e.status_code)
+        return Response({'message': 'Logged out of all sessions.'}, status=status.HTTP_200_OK)
 
-class ForgotPasswordView(mixins.CreateModelMixin, viewsets.GenericViewSet):
+
+class ForgotPasswordView(mixins.CreateModelMixin, AsyncGenericViewSet):
     serializer_class = serializers.ForgotPasswordSerializer
     permission_classes = [permissions.AllowAny]
 
-    def create(self, request, *args, **kwargs):
+    async def create(self, request, *args, **kwargs):
         if request.user.is_authenticated:
             return Response("You are already logged in", status=status.HTTP_403_FORBIDDEN)
-        # Pre-check user existence to return proper 404 for nonexistent email
-        email = request.data.get('email')
+        email = get_data_field(request, 'email')
         if not email:
             return Response({'error': 'Email is required'}, status=status.HTTP_400_BAD_REQUEST)
-        if not User.objects.filter(email=email).exists():
-            return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
         serializer = self.get_serializer(data=request.data)
         try:
-            serializer.is_valid(raise_exception=True)
-            result = serializer.save()
+            await serializer.ais_valid(raise_exception=True)
+            result = await serializer.asave()
             return Response(result, status=status.HTTP_200_OK)
+        except NotFound as e:
+            # The serializer's lookup doubles as the existence check.
+            return Response({'error': get_error_message(e)}, status=e.status_code)
+        except ServiceUnavailable as e:
+            return Response({'error': get_error_message(e)}, status=e.status_code)
         except Exception as e:
             return Response({'error': get_error_message(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
 
-class ResetPasswordView(mixins.CreateModelMixin, viewsets.GenericViewSet):
+class ResetPasswordView(mixins.CreateModelMixin, AsyncGenericViewSet):
     serializer_class = serializers.ResetPasswordSerializer
     permission_classes = [permissions.AllowAny]
 
-    def create(self, request, *args, **kwargs):
+    async def create(self, request, *args, **kwargs):
         if request.user.is_authenticated:
             return Response({'error': "You are already logged in"}, status=status.HTTP_403_FORBIDDEN)
-        # Rate limit: 3 reset requests per minute per IP
-        limited = is_ratelimited(
-            request=request,
-            group='forgot-password',
-            key='ip',
-            rate='3/m',
-            method=['POST'],
-            increment=True
-        )
-        if limited:
-            return Response({'error': 'Too many password reset requests. Please try again later.'}, status=429)
+        # Rate limit per IP and globally (settings.RATELIMITS)
+        limit = await acheck_rate_limit(request, 'reset-password')
+        if not limit.allowed:
+            return Response(
+                {'error': 'Too many password reset requests. Please try again later.'},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(math.ceil(limit.retry_after))},
+            )
 
+        serializer = self.get_serializer(data=request.data)
+        try:
+            await serializer.ais_valid(raise_exception=True)
+            result = await serializer.asave()
+            return Response(result, status=status.HTTP_200_OK)
+        except ServiceUnavailable as e:
+            return Response({'error': get_error_message(e)}, status=e.status_code)
+        except Exception as e:
+            return Response({'error': get_error_message(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class LogoutView(mixins.CreateModelMixin, viewsets.GenericViewSet):
+    serializer_class = serializers.LogoutSerializer
+    permission_classes = [permissions.AllowAny]
+
+    def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         try:
             serializer.is_valid(raise_exception=True)
             result = serializer.save()
             return Response(result, status=status.HTTP_200_OK)
+        except ServiceUnavailable as e:
+            return Response({'error': get_error_message(e)}, status=e.status_code)
         except Exception as e:
             return Response({'error': get_error_message(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncTokenViewBase(AsyncAPIView, TokenViewBase):
+    """``TokenViewBase`` with an async ``post()``; see AsyncSerializerMixin."""
+
+    async def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        try:
+            await serializer.ais_valid(raise_exception=True)
+        except TokenError as e:
+            raise InvalidToken(e.args[0]) from e
+        return Response(serializer.validated_data, status=status.HTTP_200_OK)
+
+
+class TokenRefreshView(AsyncTokenViewBase):
+    """
+    Takes a refresh token and returns a new access token and, with rotation
+    on, a new refresh token in place of the one presented.
+    """
+    serializer_class = serializers.UserTokenRefreshSerializer
+
+
+class TokenVerifyView(AsyncTokenViewBase):
+    """
+    Takes a token and indicates if it is valid. This view provides no
+    information about a token's fitness for a particular use.
+    """
+    serializer_class = serializers.UserTokenVerifySerializer
+
+
+class TokenVerifyBatchView(TokenViewBase):
+    """
+    Takes a list of tokens and reports, for each one, whether it is valid
+    along with its claims and expiry. Invalid tokens don't fail the batch.
+    """
+    serializer_class = serializers.TokenVerifyBatchSerializer
+
+
+class UserLookupView(generics.GenericAPIView):
+    """
+    Resolves up to USER_LOOKUP_MAX_SIZE user ids and emails to profiles in
+    one call, for other services. Authenticated with a service key; answers
+    in JSON or, with ``Accept: application/msgpack``, MessagePack.
+    """
+    authentication_classes = [ServiceKeyAuthentication]
+    permission_classes = [IsService]
+    renderer_classes = [JSONRenderer, MessagePackRenderer]
+    parser_classes = [JSONParser, MessagePackParser]
+    serializer_class = serializers.UserLookupSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({'error': get_error_message(serializer.errors)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(serializer.validated_data)
+
+
+class UserListView(generics.ListAPIView):
+    """
+    Lists users a page at a time, newest first by default (?ordering= one of
+    date_joined, id or email, with - for descending), optionally filtered by
+    the start of the email address and is_active. Follow the next and
+    previous links to page; the count is an estimate on large tables. Staff
+    only.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    serializer_class = serializers.UserListSerializer
+    pagination_class = KeysetPagination
+
+    def list(self, request, *args, **kwargs):
+        options = serializers.UserListQuerySerializer(data=request.query_params.dict())
+        if not options.is_valid():
+            return Response({'error': get_error_message(options.errors)}, status=status.HTTP_400_BAD_REQUEST)
+        self.options = options.validated_data
+        return super().list(request, *args, **kwargs)
+
+    def get_queryset(self):
+        options = getattr(self, 'options', {})
+        queryset = User.objects.only(*self.serializer_class.Meta.fields)
+        queryset = queryset.order_by(options.get('ordering', '-date_joined'))
+        if options.get('email'):
+            queryset = queryset.filter(email__startswith=UserManager.normalize_email(options['email']))
+        if options.get('is_active') is not None:
+            queryset = queryset.filter(is_active=options['is_active'])
+        return queryset
+
+
+class ExportContentNegotiation(BaseContentNegotiation):
+    # ?format picks CSV or JSON Lines, which aren't DRF renderers; whatever
+    # the Accept header says, errors are rendered with the first renderer.
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class UserExportView(APIView):
+    """
+    Streams users in id order as CSV (default) or JSON Lines (?format=jsonl),
+    optionally filtered by date_joined_from / date_joined_to (ISO dates or
+    datetimes) and is_active. Pass the last id received as ?after to resume.
+    Staff only.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    content_negotiation_class = ExportContentNegotiation
+
+    def get(self, request, *args, **kwargs):
+        serializer = serializers.UserExportSerializer(data=request.query_params.dict())
+        if not serializer.is_valid():
+            return Response({'error': get_error_message(serializer.errors)}, status=status.HTTP_400_BAD_REQUEST)
+        options = dict(serializer.validated_data)
+        fmt = options.pop('format')
+        queryset = exporter.export_queryset(**options)
+        # Under ASGI only an async iterator is streamed; a sync one would be
+        # read into memory first.
+        stream = exporter.astream_export if isinstance(request._request, ASGIRequest) else exporter.stream_export
+        response = StreamingHttpResponse(
+            stream(queryset, exporter.ExportEncoder(fmt), chunk_size=settings.USER_EXPORT_CHUNK_SIZE),
+            content_type=exporter.FORMATS[fmt],
+        )
+        response['Content-Disposition'] = f'attachment; filename="users.{fmt}"'
+        return response
+
+
+EMPTY_JWKS = (b'{"keys":[]}', 'empty')
+
+
+def _jwks_etag(request):
+    key_ring = get_key_ring()
+    return (key_ring.jwks if key_ring else EMPTY_JWKS)[1]
+
+
+@require_GET
+@cache_control(public=True, max_age=settings.JWKS_CACHE_MAX_AGE)
+@condition(etag_func=_jwks_etag)
+def jwks(request):
+    """
+    Public keys for verifying access tokens locally (see users/verifier.py).
+    Empty while tokens are still signed with the shared HMAC secret.
+    """
+    key_ring = get_key_ring()
+    body = (key_ring.jwks if key_ring else EMPTY_JWKS)[0]
+    return HttpResponse(body, content_type='application/json')